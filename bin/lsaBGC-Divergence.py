@@ -37,6 +37,7 @@
 
 import os
 import sys
+import math
 import traceback
 from time import sleep
 import argparse
@@ -154,12 +155,11 @@ def lsaBGC_Divergence():
 
     # Step 2: Determine Sequence Similarity from Codon Alignments
     logObject.info("Determining similarities in BGC content and sequence space between pairs of samples.")
-    bgc_pairwise_similarities = util.determineBGCSequenceSimilarityFromCodonAlignments(codon_alignments_file, cpus=cpus, use_translation=(not use_codon_flag))
+    samples_bgc, bgc_seq_sims, bgc_con_sims = util.determineBGCSequenceSimilarityFromCodonAlignments(codon_alignments_file, cpus=cpus, use_translation=(not use_codon_flag))
     logObject.info("Finished determining BGC specific similarity between pairs of samples.")
 
     # Step 3: Calculate and report Beta-RD statistic for all pairs of samples/isolates
     logObject.info("Beginning generation of report.")
-    samples_bgc = set(bgc_pairwise_similarities.keys())
     try:
         final_report = outdir + 'Relative_Divergence_Report.txt'
         final_report_handle = open(final_report, 'w')
@@ -168,12 +168,12 @@ def lsaBGC_Divergence():
             for j, s2 in enumerate(samples_bgc):
                 if sample_retention_set and (not s1 in sample_retention_set or not s2 in sample_retention_set): continue
                 if i >= j: continue
-                gcf_seq_sim = bgc_pairwise_similarities[s1][s2][0]
-                gcf_con_sim = bgc_pairwise_similarities[s1][s2][1]
+                gcf_seq_sim = float(bgc_seq_sims[i, j])
+                gcf_con_sim = float(bgc_con_sims[i, j])
                 gw_seq_sim = gw_pairwise_similarities[s1][s2]
 
                 if gw_seq_sim != 0.0:
-                    if gcf_seq_sim != 'NA':
+                    if not math.isnan(gcf_seq_sim):
                         beta_rd = min([gcf_seq_sim/gw_seq_sim, 2.0])
                         final_report_handle.write('%s\t%s\t%s\t%f\t%f\t%f\t%f\n' % (gcf_id, s1, s2, beta_rd, gw_seq_sim, gcf_seq_sim, gcf_con_sim))
                     else:
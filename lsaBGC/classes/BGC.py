@@ -6,7 +6,6 @@ from Bio.SeqRecord import SeqRecord
 from Bio.SeqFeature import SeqFeature, FeatureLocation
 from operator import itemgetter
 import traceback
-import copy
 import _pickle as cPickle
 from lsaBGC import util
 
@@ -87,13 +86,10 @@ class BGC:
 				except:
 					product = "hypothetical protein"
 
-				grange = set(range(start, end + 1))
-
 				gene_domains = []
 				core_overlap = False
 				for d in domains:
-					drange = set(range(d['start'], d['end'] + 1))
-					if len(drange.intersection(grange)) > 0:
+					if d['end'] >= start and d['start'] <= end and d['start'] <= d['end']:
 						gene_domains.append(d)
 						if (d['aSDomain'] + '|' + str(d['start']) + '|' + str(d['end'])) in core_domains:
 							core_overlap = True
@@ -237,13 +233,10 @@ class BGC:
 						except:
 							product = "hypothetical protein"
 
-						grange = set(range(start, end + 1))
-
 						gene_domains = []
 						core_overlap = False
 						for d in domains:
-							drange = set(range(d['start'], d['end'] + 1))
-							if len(drange.intersection(grange)) > 0:
+							if d['end'] >= start and d['start'] <= end and d['start'] <= d['end']:
 								gene_domains.append(d)
 								if (d['aSDomain'] + '|' + str(d['start']) + '|' + str(d['end'])) in core_domains:
 									core_overlap = True
@@ -402,8 +395,7 @@ class BGC:
 							prot_seq = feature.qualifiers.get('translation')[0]
 							gene_domains = []
 							for d in domains:
-								drange = set(range(d['start'], d['end'] + 1))
-								if len(drange.intersection(grange)) > 0:
+								if d['end'] >= start and d['start'] <= end and d['start'] <= d['end']:
 									gene_domains.append(d)
 
 							flank_start = start - flank_size
@@ -485,7 +477,6 @@ class BGC:
 			rgf_handle = open(refined_genbank_file, 'w')
 			start_coord = min([self.gene_information[first_bg]['start'], self.gene_information[first_bg]['end'], self.gene_information[second_bg]['start'], self.gene_information[second_bg]['end']])
 			end_coord = max([self.gene_information[first_bg]['start'], self.gene_information[first_bg]['end'], self.gene_information[second_bg]['start'], self.gene_information[second_bg]['end']])
-			pruned_coords = set(range(start_coord, end_coord+1))
 			with open(self.bgc_genbank) as ogbk:
 				recs = [x for x in SeqIO.parse(ogbk, 'genbank')]
 				try:
@@ -502,17 +493,19 @@ class BGC:
 
 					new_seq_object = Seq(filtered_seq)
 
-					updated_rec = copy.deepcopy(rec)
-					updated_rec.seq = new_seq_object
+					updated_rec = SeqRecord(new_seq_object, id=rec.id, name=rec.name, description=rec.description,
+										   dbxrefs=list(rec.dbxrefs), annotations=dict(rec.annotations))
 
 					updated_features = []
 					for feature in rec.features:
-						all_coords, start, end, direction, is_multi_part = util.parseCDSCoord(str(feature.location))
+						start = int(feature.location.start) + 1
+						end = int(feature.location.end)
 
-						feature_coords = set(range(start, end+1))
-						if len(feature_coords.intersection(pruned_coords)) > 0:
+						if end >= start_coord and start <= end_coord:
 							fls = []
-							for sc, ec, dc in all_coords:
+							for part in feature.location.parts:
+								sc = int(part.start) + 1
+								ec = int(part.end)
 								updated_start = sc - start_coord + 1
 								updated_end = ec - start_coord + 1
 								if ec > end_coord:
@@ -527,15 +520,14 @@ class BGC:
 										updated_start = 1  # ; flag2 = True
 
 								strand = 1
-								if dc == '-':
+								if part.strand == -1:
 									strand = -1
 								fls.append(FeatureLocation(updated_start - 1, updated_end, strand=strand))
 							if len(fls) > 0:
 								updated_location = fls[0]
 								if len(fls) > 1:
 									updated_location = sum(fls)
-								feature.location = updated_location
-								updated_features.append(feature)
+								updated_features.append(SeqFeature(updated_location, type=feature.type, qualifiers=feature.qualifiers))
 					updated_rec.features = updated_features
 					SeqIO.write(updated_rec, rgf_handle, 'genbank')
 			rgf_handle.close()
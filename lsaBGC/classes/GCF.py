@@ -1,4 +1,6 @@
 import copy
+import csv
+import io
 import os
 import sys
 import logging
@@ -9,22 +11,24 @@ import subprocess
 import pysam
 import gzip
 import multiprocessing
-from scipy.stats import f_oneway, fisher_exact, pearsonr, median_abs_deviation, entropy
+from scipy.stats import fisher_exact, pearsonr, median_abs_deviation, entropy
 from ete3 import Tree
 import numpy as np
 from operator import itemgetter
 import itertools
-from collections import defaultdict
-from lsaBGC.classes.Pan import Pan
+from collections import defaultdict, Counter, deque
+from lsaBGC.classes.Pan import Pan, OUTPUT_BUFFER_SIZE
 from lsaBGC import util
-from pandas import DataFrame
 from pomegranate import *
 import math
+import string
 import warnings
 import decimal
-from Bio import SeqIO, Align
+from Bio import Align
+from Bio.SeqIO.FastaIO import SimpleFastaParser
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
+from Bio.Data.CodonTable import standard_dna_table
 from Bio.codonalign.codonseq import CodonSeq, cal_dn_ds
 from lsaBGC.classes.BGC import BGC
 warnings.filterwarnings('ignore')
@@ -32,7 +36,37 @@ warnings.filterwarnings('ignore')
 # updated 07/22/2022 to have key term be transpos instead of transp - because of transporter now appearing in definitions
 # due to switch from Prokka annotation to custom KO/PGAP annotations
 mges = set(['transpos', 'integrase'])
-purine_alleles = set(['A', 'G'])
+purine_mask = {'A': 1, 'G': 1, 'C': 0, 'T': 0, 'N': 0}
+
+# standard genetic code lookup for translating individual codons without constructing Seq objects
+codon_to_aa = dict(standard_dna_table.forward_table)
+for stop_codon in standard_dna_table.stop_codons:
+	codon_to_aa[stop_codon] = '*'
+stop_codons = set(standard_dna_table.stop_codons)
+
+# 2-bit codes of nucleotides, with other characters coded as 64, and a lookup of which of the 64 codon indices (plus
+# the invalid index) are stop codons, for scanning reading frames as arrays
+nucleotide_code_lut = np.full(256, 64, dtype=np.int32)
+for nucleotide_code, nucleotide in enumerate('ACGT'):
+	nucleotide_code_lut[ord(nucleotide)] = nucleotide_code
+stop_codon_lut = np.zeros(65, dtype=bool)
+for stop_codon in standard_dna_table.stop_codons:
+	stop_codon_lut[16*'ACGT'.index(stop_codon[0]) + 4*'ACGT'.index(stop_codon[1]) + 'ACGT'.index(stop_codon[2])] = True
+
+# column index of each nucleotide in per-position allele count matrices
+allele_index = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+
+# line template for the 22 column novel SNV report
+novel_snv_report_line = '\t'.join(['%s']*22) + '\n'
+
+# translation table to upper-case sequences and treat ambiguous N bases as gaps in a single pass
+upper_n_to_gap = str.maketrans(string.ascii_lowercase + 'N', string.ascii_uppercase.replace('N', '-') + '-')
+# byte lookup table flagging the bases which render a codon gapped/ambiguous
+gap_base_lut = np.zeros(256, dtype=bool)
+gap_base_lut[[ord('-'), ord('N')]] = True
+# byte lookup table flagging unambiguous nucleotides
+nucleotide_base_lut = np.zeros(256, dtype=bool)
+nucleotide_base_lut[[ord('A'), ord('C'), ord('G'), ord('T')]] = True
 
 lsaBGC_main_directory = '/'.join(os.path.realpath(__file__).split('/')[:-3])
 RSCRIPT_FOR_COLORBREW = lsaBGC_main_directory + '/lsaBGC/Rscripts/brewColors.R'
@@ -44,6 +78,14 @@ RSCRIPT_FOR_GENERATE = lsaBGC_main_directory + '/lsaBGC/Rscripts/GeneRatePhyloge
 RSCRIPT_FOR_PCA = lsaBGC_main_directory + '/lsaBGC/Rscripts/ClusterVisualOfSamples.R'
 SEED = 1234
 
+# tab-delimited track files are written verbatim, so values such as the quoted colors for R are left as is
+csv.register_dialect('track', delimiter='\t', lineterminator='\n', quoting=csv.QUOTE_NONE, quotechar=None)
+# minimum number of sequences in a homolog group for its alignment to be given multiple threads
+MULTITHREADED_MSA_MIN_SEQUENCES = 100
+
+# cap on the number of array elements held at once when comparing sample allele profiles in blocks
+PAIRWISE_BLOCK_ELEMENTS = 1 << 24
+
 class GCF(Pan):
 	def __init__(self, bgc_genbanks_listing, gcf_id='GCF_X', logObject=None, lineage_name='Unnamed lineage'):
 		super().__init__(bgc_genbanks_listing, lineage_name=lineage_name, logObject=logObject)
@@ -55,6 +97,7 @@ class GCF(Pan):
 
 		# General variables
 		self.hg_to_color = None
+		self.bgc_gene_geometry = None
 		self.hg_order_scores = defaultdict(lambda: ['NA', 'NA'])
 		self.specific_core_homologs =set([])
 		self.scc_homologs = set([])
@@ -162,14 +205,13 @@ class GCF(Pan):
 			if prune_set != None:
 				t.prune(prune_set)
 
-			for node in t.traverse('postorder'):
+			for node in postorder_nodes(t):
 				if node.name in self.sample_bgcs and len(self.sample_bgcs[node.name]) > 1:
 					og_node_name = node.name
 					node.name = node.name + '_INNERNODE'
 					for bgc_id in self.sample_bgcs[og_node_name]:
 						# if bgc_id == node.name: continue
-						node.add_child(name=bgc_id)
-						child_node = t.search_nodes(name=bgc_id)[0]
+						child_node = node.add_child(name=bgc_id)
 						child_node.dist = 0
 						if bgc_id != og_node_name: number_of_added_leaves += 1
 
@@ -185,6 +227,87 @@ class GCF(Pan):
 				self.logObject.error(traceback.format_exc())
 			raise RuntimeError(traceback.format_exc())
 
+	def determineBGCGeneGeometry(self):
+		"""
+		Function to gather the coordinates and directions of genes in each BGC once, as parallel arrays/lists per BGC,
+		for reuse by the functions which lay out or order BGC gene architectures.
+
+		:return: dictionary mapping each BGC to its genes, their start and end coordinates and their directions.
+		"""
+		if self.bgc_gene_geometry != None:
+			return self.bgc_gene_geometry
+
+		bgc_genes = self.bgc_genes
+		comp_gene_info = self.comp_gene_info
+		bgc_gene_geometry = {}
+		for bgc in bgc_genes:
+			genes = list(bgc_genes[bgc])
+			starts = []
+			ends = []
+			directions = []
+			for lt in genes:
+				ginfo = comp_gene_info[lt]
+				starts.append(ginfo['start'])
+				ends.append(ginfo['end'])
+				directions.append(ginfo['direction'])
+			bgc_gene_geometry[bgc] = {'genes': genes, 'starts': np.array(starts, dtype=np.int32),
+									  'ends': np.array(ends, dtype=np.int32), 'directions': directions}
+		self.bgc_gene_geometry = bgc_gene_geometry
+		return bgc_gene_geometry
+
+	def determineBGCHgLayouts(self, sort_genes=False):
+		"""
+		Function to gather, per BGC, the direction, mean gene length and start coordinate of each homolog group it
+		features. For homolog groups in multi-copy, the last gene walked determines the direction and start. Layouts
+		depend on the current homology information and are therefore not cached.
+
+		:param sort_genes: whether to walk genes in sorted order rather than in the order they are listed for the BGC.
+		:return: dictionary mapping each BGC to dictionaries of homolog group directions, weights and starts.
+		"""
+		gene_to_hg = self.gene_to_hg
+		bgc_hg_layouts = {}
+		for bgc, geometry in self.determineBGCGeneGeometry().items():
+			hg_directions = {}
+			hg_lengths = defaultdict(list)
+			hg_starts = {}
+			gene_geometries = zip(geometry['genes'], geometry['starts'].tolist(), geometry['ends'].tolist(), geometry['directions'])
+			if sort_genes:
+				gene_geometries = sorted(gene_geometries)
+			for g, gstart, gend, gdir in gene_geometries:
+				if g in gene_to_hg:
+					hg = gene_to_hg[g]
+					hg_directions[hg] = gdir
+					hg_lengths[hg].append(abs(gend - gstart))
+					hg_starts[hg] = gstart
+			hg_weights = {}
+			for hg in hg_lengths:
+				hg_weights[hg] = sum(hg_lengths[hg]) / float(len(hg_lengths[hg]))
+			bgc_hg_layouts[bgc] = {'hg_directions': hg_directions, 'hg_weights': hg_weights, 'hg_starts': hg_starts}
+		return bgc_hg_layouts
+
+	def determineBGCFlip(self, bgc_hg_layouts, bgc, ref_bgc):
+		"""
+		Function to determine whether a BGC should be flipped relative to a reference BGC, based on whether homolog
+		groups shared with the reference mostly (weighted by gene length) lie on the opposite strand.
+
+		:param bgc_hg_layouts: dictionary of homolog group layouts per BGC from determineBGCHgLayouts().
+		:param bgc: BGC identifier.
+		:param ref_bgc: identifier of the reference BGC.
+		:return: True if the BGC should be flipped.
+		"""
+		ref_hg_directions = bgc_hg_layouts[ref_bgc]['hg_directions']
+		hg_directions = bgc_hg_layouts[bgc]['hg_directions']
+		hg_weights = bgc_hg_layouts[bgc]['hg_weights']
+		flip_support = 0
+		keep_support = 0
+		for c in ref_hg_directions:
+			if not c in hg_directions: continue
+			if hg_directions[c] == ref_hg_directions[c]:
+				keep_support += hg_weights[c]
+			else:
+				flip_support += hg_weights[c]
+		return flip_support > keep_support
+
 	def assignColorsToHGs(self, gene_to_hg, bgc_genes, outdir):
 		"""
 		Simple function to associate each homolog group with a color for consistent coloring.
@@ -194,16 +317,8 @@ class GCF(Pan):
 		:return: dictionary mapping each HG to a hex color value.
 		"""
 
-		hg_bgc_counts = defaultdict(int)
-		for b in bgc_genes:
-			for g in bgc_genes[b]:
-				if g in gene_to_hg:
-					hg_bgc_counts[gene_to_hg[g]] += 1
-
-		hgs = set([])
-		for c in hg_bgc_counts:
-			if hg_bgc_counts[c] > 1:
-				hgs.add(c)
+		hg_bgc_counts = Counter(gene_to_hg[g] for genes in bgc_genes.values() for g in genes if g in gene_to_hg)
+		hgs = [hg for hg, count in hg_bgc_counts.items() if count > 1]
 
 		len_hgs = len(hgs)
 		color_listing_file = outdir + 'colors_for_hgs.txt'
@@ -212,9 +327,8 @@ class GCF(Pan):
 		if self.logObject:
 			self.logObject.info('Running R-based plotting with the following command: %s' % ' '.join(rscript_brew_color))
 		try:
-			subprocess.call(' '.join(rscript_brew_color), shell=True, stdout=subprocess.DEVNULL,
-							stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(rscript_brew_color, stdout=subprocess.DEVNULL,
+							stderr=subprocess.DEVNULL)
 			assert(os.path.isfile(color_listing_file) and os.path.getsize(color_listing_file) > 0)
 			if self.logObject:
 				self.logObject.info('Successfully ran: %s' % ' '.join(rscript_brew_color))
@@ -226,15 +340,11 @@ class GCF(Pan):
 			raise RuntimeError(traceback.format_exc())
 
 		# read in list of colors
-		colors = []
 		with open(color_listing_file) as ocf:
-			colors = [x.strip() for x in ocf.readlines()]
+			colors = [x.strip() for x in ocf]
 		random.Random(SEED).shuffle(colors)
 
-		hg_to_color = {}
-		for i, c in enumerate(set(hgs)):
-			hg_to_color[c] = colors[i]
-		self.hg_to_color = hg_to_color
+		self.hg_to_color = dict(zip(hgs, colors))
 
 	def createItolBGCSeeTrack(self, result_track_file):
 		"""
@@ -244,86 +354,70 @@ class GCF(Pan):
 		:param result_track_file: The path to the resulting iTol track file for BGC gene visualization.
 		"""
 		try:
-			track_handle = open(result_track_file, 'w')
+			track_handle = open(result_track_file, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE)
 
 			if self.logObject:
 				self.logObject.info("Writing iTol track file to: %s" % result_track_file)
 				self.logObject.info("Track will have label: %s" % self.gcf_id)
 
-			# write header for iTol track file
-			track_handle.write('DATASET_DOMAINS\n')
-			track_handle.write('SEPARATOR TAB\n')
-			track_handle.write('DATASET_LABEL\t%s\n' % self.gcf_id)
-			track_handle.write('COLOR\t#000000\n')
-			track_handle.write('BORDER_WIDTH\t1\n')
-			track_handle.write('BORDER_COLOR\t#000000\n')
-			track_handle.write('SHOW_DOMAIN_LABELS\t0\n')
-			track_handle.write('DATA\n')
+			# header for iTol track file, track rows are gathered and written in one go at the end
+			track_rows = [['DATASET_DOMAINS'], ['SEPARATOR TAB'], ['DATASET_LABEL', self.gcf_id], ['COLOR', '#000000'],
+						  ['BORDER_WIDTH', '1'], ['BORDER_COLOR', '#000000'], ['SHOW_DOMAIN_LABELS', '0'], ['DATA']]
 
 			# write the rest of the iTol track file for illustrating genes across BGC instances
-			ref_hg_directions = {}
+			ref_bgc = None
+			# attributes used within the per-gene loops are bound to locals once
+			bgc_genes = self.bgc_genes
+			gene_to_hg = self.gene_to_hg
+			hg_to_color = self.hg_to_color
+
 			bgc_gene_counts = defaultdict(int)
-			for bgc in self.bgc_genes:
-				bgc_gene_counts[bgc] = len(self.bgc_genes[bgc])
+			for bgc in bgc_genes:
+				bgc_gene_counts[bgc] = len(bgc_genes[bgc])
 
+			bgc_gene_geometry = self.determineBGCGeneGeometry()
+			bgc_hg_layouts = self.determineBGCHgLayouts()
 			for i, item in enumerate(sorted(bgc_gene_counts.items(), key=itemgetter(1), reverse=True)):
 				bgc = item[0]
-				curr_bgc_genes = self.bgc_genes[bgc]
-				last_gene_end = max([self.comp_gene_info[lt]['end'] for lt in curr_bgc_genes])
+				geometry = bgc_gene_geometry[bgc]
+				last_gene_end = int(geometry['ends'].max())
 				printlist = [bgc, str(last_gene_end)]
-				hg_directions = {}
-				hg_lengths = defaultdict(list)
-				for lt in curr_bgc_genes:
-					ginfo = self.comp_gene_info[lt]
+				gene_labels = []
+				for lt, gstart, gend, gdir in zip(geometry['genes'], geometry['starts'].tolist(), geometry['ends'].tolist(), geometry['directions']):
 					hg = 'singleton'
-					if lt in self.gene_to_hg:
-						hg = self.gene_to_hg[lt]
+					if lt in gene_to_hg:
+						hg = gene_to_hg[lt]
 					shape = 'None'
-					if ginfo['direction'] == '+':
+					if gdir == '+':
 						shape = 'TR'
-					elif ginfo['direction'] == '-':
+					elif gdir == '-':
 						shape = 'TL'
-					gstart = ginfo['start']
-					gend = ginfo['end']
 					hg_color = "#dbdbdb"
-					if hg in self.hg_to_color:
-						hg_color = self.hg_to_color[hg]
+					if hg in hg_to_color:
+						hg_color = hg_to_color[hg]
 					gene_string = '|'.join([str(x) for x in [shape, gstart, gend, hg_color, hg]])
 					printlist.append(gene_string)
-					if hg != 'singleton':
-						hg_directions[hg] = ginfo['direction']
-						hg_lengths[hg].append(gend - gstart)
+					gene_labels.append(hg_color + '|' + hg)
 				if i == 0:
-					ref_hg_directions = hg_directions
-					track_handle.write('\t'.join(printlist) + '\n')
+					ref_bgc = bgc
+					track_rows.append(printlist)
 				else:
-					flip_support = 0
-					keep_support = 0
-					for c in ref_hg_directions:
-						if not c in hg_directions: continue
-						hg_weight = statistics.mean(hg_lengths[c])
-						if hg_directions[c] == ref_hg_directions[c]:
-							keep_support += hg_weight
-						else:
-							flip_support += hg_weight
-
 					# flip the genbank visual if necessary, first BGC processed is used as reference guide
-					if flip_support > keep_support:
+					if self.determineBGCFlip(bgc_hg_layouts, bgc, ref_bgc):
 						flip_printlist = printlist[:2]
-						for gene_string in printlist[2:]:
-							gene_info = gene_string.split('|')
-							new_shape = None
-							if gene_info[0] == 'TR':
+						new_gstarts = (last_gene_end - geometry['ends']).tolist()
+						new_gends = (last_gene_end - geometry['starts']).tolist()
+						for gi, gdir in enumerate(geometry['directions']):
+							new_shape = 'None'
+							if gdir == '+':
 								new_shape = 'TL'
-							elif gene_info[0] == 'TL':
+							elif gdir == '-':
 								new_shape = 'TR'
-							new_gstart = int(last_gene_end) - int(gene_info[2])
-							new_gend = int(last_gene_end) - int(gene_info[1])
-							new_gene_info = '|'.join([new_shape, str(new_gstart), str(new_gend)] + gene_info[-2:])
-							flip_printlist.append(new_gene_info)
-						track_handle.write('\t'.join(flip_printlist) + '\n')
+							flip_printlist.append('|'.join([new_shape, str(new_gstarts[gi]), str(new_gends[gi]), gene_labels[gi]]))
+						track_rows.append(flip_printlist)
 					else:
-						track_handle.write('\t'.join(printlist) + '\n')
+						track_rows.append(printlist)
+			csv.writer(track_handle, dialect='track').writerows(track_rows)
 			track_handle.close()
 		except Exception as e:
 			if self.logObject:
@@ -344,9 +438,9 @@ class GCF(Pan):
 		:param result_pdf_file: Path to PDF file where plots from bgSee.R will be written to.
 		"""
 		try:
-			if os.path.isfile(heatmap_track_file) or os.path.isfile(detection_track_file):
-				os.system('rm -f %s %s' % (detection_track_file, heatmap_track_file))
-			heatmap_track_handle = open(heatmap_track_file, 'w')
+			for track_file in [detection_track_file, heatmap_track_file]:
+				if os.path.isfile(track_file): os.remove(track_file)
+			heatmap_track_handle = open(heatmap_track_file, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE)
 			detection_track_handle = open(detection_track_file, 'w')
 
 			if self.logObject:
@@ -354,7 +448,8 @@ class GCF(Pan):
 				self.logObject.info("Writing detection-method input file to: %s" % detection_track_file)
 
 			# write header for track files
-			heatmap_track_handle.write('label\tog\tog_copy\n')
+			heatmap_track_writer = csv.writer(heatmap_track_handle, dialect='track')
+			heatmap_track_writer.writerow(['label', 'og', 'og_copy'])
 			detection_track_handle.write('name\tdetection_method\n')
 
 			gcf_relevant_hgs = set([])
@@ -405,16 +500,18 @@ class GCF(Pan):
 								sample_hg_counts[sname][hg] = num_lts
 
 			tree_obj = Tree(phylogeny_newick_file)
-			for node in tree_obj.traverse('postorder'):
+			for node in postorder_nodes(tree_obj):
 				if not node.is_leaf(): continue
 				sname = node.name
+				heatmap_track_rows = []
 				for hg in gcf_relevant_hgs:
 					copy_count = '0'
 					if sample_hg_counts[sname][hg] == 1:
 						copy_count = '1'
 					elif sample_hg_counts[sname][hg] > 1:
 						copy_count = 'Multi'
-					heatmap_track_handle.write(sname + '\t' + hg + '\t' + copy_count + '\n')
+					heatmap_track_rows.append([sname, hg, copy_count])
+				heatmap_track_writer.writerows(heatmap_track_rows)
 			heatmap_track_handle.close()
 
 		except Exception as e:
@@ -428,9 +525,8 @@ class GCF(Pan):
 		if self.logObject:
 			self.logObject.info('Running R-based plotting with the following command: %s' % ' '.join(rscript_plot_cmd))
 		try:
-			subprocess.call(' '.join(rscript_plot_cmd), shell=True, stdout=subprocess.DEVNULL,
-							stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(rscript_plot_cmd, stdout=subprocess.DEVNULL,
+							stderr=subprocess.DEVNULL)
 			assert(os.path.isfile(result_pdf_file))
 			self.logObject.info('Successfully ran: %s' % ' '.join(rscript_plot_cmd))
 		except Exception as e:
@@ -454,106 +550,106 @@ class GCF(Pan):
 		:param result_pdf_file: Path to PDF file where plots from bgSee.R will be written to.
 		"""
 		try:
-			if os.path.isfile(gggenes_track_file) or os.path.isfile(heatmap_track_file):
-				os.system('rm -f %s %s' % (gggenes_track_file, heatmap_track_file))
-			gggenes_track_handle = open(gggenes_track_file, 'w')
-			heatmap_track_handle = open(heatmap_track_file, 'w')
+			for track_file in [gggenes_track_file, heatmap_track_file]:
+				if os.path.isfile(track_file): os.remove(track_file)
+			gggenes_track_handle = open(gggenes_track_file, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE)
+			heatmap_track_handle = open(heatmap_track_file, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE)
 			if self.logObject:
 				self.logObject.info("Writing gggenes input file to: %s" % gggenes_track_file)
 				self.logObject.info("Writing heatmap input file to: %s" % heatmap_track_file)
-			# write header for track files
-			gggenes_track_handle.write('label\tgene\tstart\tend\tforward\tog\tog_color\n')
-			heatmap_track_handle.write('label\tog\tog_presence\tog_count\n')
+			# header for track files, track rows are gathered and written in one go at the end
+			gggenes_track_rows = [['label', 'gene', 'start', 'end', 'forward', 'og', 'og_color']]
+			heatmap_track_rows = [['label', 'og', 'og_presence', 'og_count']]
 
-			ref_hg_directions = {}
+			ref_bgc = None
+
+			bgc_genes = self.bgc_genes
+			gene_to_hg = self.gene_to_hg
+			hg_to_color = self.hg_to_color
 
 			bgc_gene_counts = defaultdict(int)
-			for bgc in self.bgc_genes:
-				bgc_gene_counts[bgc] = len(self.bgc_genes[bgc])
+			for bgc in bgc_genes:
+				bgc_gene_counts[bgc] = len(bgc_genes[bgc])
 
 			tree_obj = Tree(phylogeny_file)
-			bgc_weights = defaultdict(int)
-			all_bgcs_in_tree = set([])
-			for leaf in tree_obj:
-				all_bgcs_in_tree.add(str(leaf).strip('\n').lstrip('-'))
-				bgc_weights[str(leaf).strip('\n').lstrip('-')] += 1
-
-			bgc_hg_presence = defaultdict(lambda: defaultdict(lambda: 'Absent'))
+			leaf_names = tree_obj.get_leaf_names()
+			bgc_weights = Counter(leaf_names)
+			all_bgcs_in_tree = set(leaf_names)
+
+			# presence of homolog groups in BGCs is recorded as (row, column) indices of a dense BGC x HG matrix
+			bgc_rows = {}
+			hg_columns = {}
+			presence_rows = []
+			presence_columns = []
 			hg_counts = defaultdict(int)
+			bgc_gene_geometry = self.determineBGCGeneGeometry()
+			bgc_hg_layouts = self.determineBGCHgLayouts()
 			for i, item in enumerate(sorted(bgc_gene_counts.items(), key=itemgetter(1), reverse=True)):
 				bgc = item[0]
 				if not bgc in all_bgcs_in_tree: continue
-				curr_bgc_genes = self.bgc_genes[bgc]
-				last_gene_end = max([self.comp_gene_info[lt]['end'] for lt in curr_bgc_genes])
+				geometry = bgc_gene_geometry[bgc]
+				last_gene_end = int(geometry['ends'].max())
 				printlist = []
-				hg_directions = {}
-				hg_lengths = defaultdict(list)
-				for lt in curr_bgc_genes:
-					ginfo = self.comp_gene_info[lt]
+				gene_labels = []
+				for lt, gstart, gend, gdir in zip(geometry['genes'], geometry['starts'].tolist(), geometry['ends'].tolist(), geometry['directions']):
 					hg = 'singleton'
-					if lt in self.gene_to_hg:
-						hg = self.gene_to_hg[lt]
+					if lt in gene_to_hg:
+						hg = gene_to_hg[lt]
 
-					gstart = ginfo['start']
-					gend = ginfo['end']
 					forward = "FALSE"
-					if ginfo['direction'] == '+': forward = "TRUE"
+					if gdir == '+': forward = "TRUE"
 
 					hg_color = '"#dbdbdb"'
-					if hg in self.hg_to_color:
-						hg_color = '"' + self.hg_to_color[hg] + '"'
+					if hg in hg_to_color:
+						hg_color = '"' + hg_to_color[hg] + '"'
 
-					gene_string = '\t'.join([str(x) for x in [bgc, lt, gstart, gend, forward, hg, hg_color]])
-					printlist.append(gene_string)
+					printlist.append([bgc, lt, gstart, gend, forward, hg, hg_color])
+					gene_labels.append([hg, hg_color])
 					if hg != 'singleton':
-						bgc_hg_presence[bgc][hg] = hg
+						if not bgc in bgc_rows:
+							bgc_rows[bgc] = len(bgc_rows)
+						if not hg in hg_columns:
+							hg_columns[hg] = len(hg_columns)
+						presence_rows.append(bgc_rows[bgc])
+						presence_columns.append(hg_columns[hg])
 						hg_counts[hg] += bgc_weights[bgc]
-						hg_directions[hg] = ginfo['direction']
-						hg_lengths[hg].append(gend - gstart)
 				if i == 0:
-					ref_hg_directions = hg_directions
-					gggenes_track_handle.write('\n'.join(printlist) + '\n')
+					ref_bgc = bgc
+					gggenes_track_rows += printlist
 				else:
-					flip_support = 0
-					keep_support = 0
-					for c in ref_hg_directions:
-						if not c in hg_directions: continue
-						hg_weight = statistics.mean(hg_lengths[c])
-						if hg_directions[c] == ref_hg_directions[c]:
-							keep_support += hg_weight
-						else:
-							flip_support += hg_weight
-
 					# flip the genbank visual if necessary, first BGC processed is used as reference guide
-					if flip_support > keep_support:
+					if ref_bgc != None and self.determineBGCFlip(bgc_hg_layouts, bgc, ref_bgc):
 						flip_printlist = []
-						for gene_string in printlist:
-							gene_info = gene_string.split('\t')
+						new_gstarts = (last_gene_end - geometry['ends']).tolist()
+						new_gends = (last_gene_end - geometry['starts']).tolist()
+						for gi, lt in enumerate(geometry['genes']):
 							new_forward = 'TRUE'
-							if gene_info[4] == 'TRUE': new_forward = 'FALSE'
-							new_gstart = int(last_gene_end) - int(gene_info[3])
-							new_gend = int(last_gene_end) - int(gene_info[2])
-							new_gene_string = '\t'.join([str(x) for x in
-														 [gene_info[0], gene_info[1], new_gstart, new_gend, new_forward,
-															gene_info[-2], gene_info[-1]]])
-							flip_printlist.append(new_gene_string)
-						gggenes_track_handle.write('\n'.join(flip_printlist) + '\n')
+							if geometry['directions'][gi] == '+': new_forward = 'FALSE'
+							flip_printlist.append([bgc, lt, new_gstarts[gi], new_gends[gi], new_forward] + gene_labels[gi])
+						gggenes_track_rows += flip_printlist
 					else:
-						gggenes_track_handle.write('\n'.join(printlist) + '\n')
+						gggenes_track_rows += printlist
 
+			hg_list = list(hg_columns)
+			hg_count_list = [hg_counts[hg] for hg in hg_list]
+			bgc_hg_presence = np.zeros((len(bgc_rows), len(hg_list)), dtype=bool)
+			bgc_hg_presence[presence_rows, presence_columns] = True
 			dummy_hg = None
-			for bgc in bgc_hg_presence:
-				for hg in hg_counts:
-					dummy_hg = hg
-					heatmap_track_handle.write('\t'.join([bgc, hg, bgc_hg_presence[bgc][hg], str(hg_counts[hg])]) + '\n')
+			if len(bgc_rows) > 0 and len(hg_list) > 0:
+				dummy_hg = hg_list[-1]
+			for bgc, bi in bgc_rows.items():
+				heatmap_track_rows += [[bgc, hg, hg if present else 'Absent', hg_count]
+									   for hg, present, hg_count in zip(hg_list, bgc_hg_presence[bi].tolist(), hg_count_list)]
 
 			for i, bgc in enumerate(all_bgcs_in_tree):
 				if not bgc in bgc_gene_counts.keys():
-					gggenes_track_handle.write('\t'.join([bgc] + ['NA']*4 + ['Absent', '"#FFFFFF"']) + '\n')
-					heatmap_track_handle.write('\t'.join([bgc, dummy_hg, 'Absent', '1']) + '\n')
+					gggenes_track_rows.append([bgc] + ['NA']*4 + ['Absent', '"#FFFFFF"'])
+					heatmap_track_rows.append([bgc, dummy_hg, 'Absent', '1'])
 				elif i == 0:
-					gggenes_track_handle.write('\t'.join([bgc] + ['NA']*4 + ['Absent', '"#FFFFFF"']) + '\n')
+					gggenes_track_rows.append([bgc] + ['NA']*4 + ['Absent', '"#FFFFFF"'])
 
+			csv.writer(gggenes_track_handle, dialect='track').writerows(gggenes_track_rows)
+			csv.writer(heatmap_track_handle, dialect='track').writerows(heatmap_track_rows)
 			gggenes_track_handle.close()
 			heatmap_track_handle.close()
 		except Exception as e:
@@ -568,9 +664,8 @@ class GCF(Pan):
 		if self.logObject:
 			self.logObject.info('Running R-based plotting with the following command: %s' % ' '.join(rscript_plot_cmd))
 		try:
-			subprocess.call(' '.join(rscript_plot_cmd), shell=True, stdout=subprocess.DEVNULL,
-							stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(rscript_plot_cmd, stdout=subprocess.DEVNULL,
+							stderr=subprocess.DEVNULL)
 			assert(os.path.isfile(result_pdf_file))
 			self.logObject.info('Successfully ran: %s' % ' '.join(rscript_plot_cmd))
 		except Exception as e:
@@ -582,7 +677,7 @@ class GCF(Pan):
 		if self.logObject:
 			self.logObject.info('Plotting completed (I think successfully)!')
 
-	def constructCodonAlignments(self, outdir, cpus=1, only_scc=False, list_alignments=False, filter_outliers=False, use_ms5=True):
+	def constructCodonAlignments(self, outdir, cpus=1, only_scc=False, list_alignments=False, filter_outliers=False, use_ms5=True, keep_protein_msas=False):
 		"""
 		Function to automate construction of codon alignments. This function first extracts protein and nucleotide sequnces
 		from BGC Genbanks, then creates protein alignments for each homolog group using MAFFT, and finally converts those
@@ -596,6 +691,8 @@ class GCF(Pan):
 						 single copy for samples with the GCF. Note, if working with draft genomes and the BGC is fragmented
 						 this should be able to still identify SCC homolog groups across the BGC instances belonging to the
 						 GCF.
+		:param keep_protein_msas: Whether to also write the intermediate protein alignments to disk. By default they are
+						 piped directly into PAL2NAL.
 		"""
 
 		nucl_seq_dir = os.path.abspath(outdir) + '/Nucleotide_Sequences/'
@@ -608,27 +705,36 @@ class GCF(Pan):
 			prot_alg_dir = os.path.abspath(outdir) + '/Protein_Alignments_MAD_Refined/'
 			codo_alg_dir = os.path.abspath(outdir) + '/Codon_Alignments_MAD_Refined/'
 
-		if not os.path.isdir(nucl_seq_dir): os.system('mkdir %s' % nucl_seq_dir)
-		if not os.path.isdir(prot_seq_dir): os.system('mkdir %s' % prot_seq_dir)
-		if not os.path.isdir(prot_alg_dir): os.system('mkdir %s' % prot_alg_dir)
-		if not os.path.isdir(codo_alg_dir): os.system('mkdir %s' % codo_alg_dir)
+		os.makedirs(nucl_seq_dir, exist_ok=True)
+		os.makedirs(prot_seq_dir, exist_ok=True)
+		os.makedirs(prot_alg_dir, exist_ok=True)
+		os.makedirs(codo_alg_dir, exist_ok=True)
 
+		# homolog groups with few sequences gain little from threading within MAFFT/MUSCLE, so they are aligned
+		# single-threaded with one worker per cpu. Larger homolog groups are aligned by fewer workers which each use
+		# multiple threads, such that workers x threads per worker does not exceed cpus.
 		pool_size = 1
+		msa_threads = cpus
 		if cpus > 10:
 			pool_size = math.floor(cpus / 10)
-			cpus = 10
+			msa_threads = 10
 
-		all_samples = set(self.bgc_sample.values())
+		hg_genes = self.hg_genes
+		comp_gene_info = self.comp_gene_info
+		bgc_sample = self.bgc_sample
+		logObject = self.logObject
+		all_samples = set(bgc_sample.values())
 		try:
-			inputs = []
-			for hg in self.hg_genes:
-				# if len(self.hg_genes[hg]) < 2: continue
+			single_threaded_inputs = []
+			multi_threaded_inputs = []
+			for hg in hg_genes:
+				# if len(hg_genes[hg]) < 2: continue
 				sample_counts = defaultdict(int)
 				gene_sequences = {}
-				for gene in self.hg_genes[hg]:
-					gene_info = self.comp_gene_info[gene]
+				for gene in hg_genes[hg]:
+					gene_info = comp_gene_info[gene]
 					bgc_id = gene_info['bgc_name']
-					sample_id = self.bgc_sample[bgc_id]
+					sample_id = bgc_sample[bgc_id]
 					nucl_seq = gene_info['nucl_seq']
 					prot_seq = gene_info['prot_seq']
 					sample_counts[sample_id] += 1
@@ -640,16 +746,24 @@ class GCF(Pan):
 				# check that hg is single-copy-core
 				if only_scc and len(samples_with_single_copy.symmetric_difference(all_samples)) > 0:
 					continue
-				elif only_scc and self.logObject:
-					self.logObject.info('Homolog group %s detected as SCC across samples (not individual BGCs).' % hg)
+				elif only_scc and logObject:
+					logObject.info('Homolog group %s detected as SCC across samples (not individual BGCs).' % hg)
 				# check that hg is present in the original instances of GCF
 				#if len([x for x in gene_sequences.keys() if len(x.split('|')[1].split('_')[0]) == 3]) == 0: continue
 				if filter_outliers:
-					gene_sequences = util.determineOutliersByGeneLength(gene_sequences, self.logObject)
-				inputs.append([hg, gene_sequences, nucl_seq_dir, prot_seq_dir, prot_alg_dir, codo_alg_dir, cpus, use_ms5, self.logObject])
+					gene_sequences = util.determineOutliersByGeneLength(gene_sequences, logObject)
+				if len(gene_sequences) >= MULTITHREADED_MSA_MIN_SEQUENCES:
+					multi_threaded_inputs.append([hg, gene_sequences, nucl_seq_dir, prot_seq_dir, prot_alg_dir, codo_alg_dir, msa_threads, use_ms5, keep_protein_msas, logObject])
+				else:
+					single_threaded_inputs.append([hg, gene_sequences, nucl_seq_dir, prot_seq_dir, prot_alg_dir, codo_alg_dir, 1, use_ms5, keep_protein_msas, logObject])
+
+			with multiprocessing.Pool(cpus) as p:
+				for _ in p.imap_unordered(create_codon_msas, single_threaded_inputs, chunksize=max(1, len(single_threaded_inputs) // (cpus * 4))):
+					pass
 
-			p = multiprocessing.Pool(pool_size)
-			p.map(create_codon_msas, inputs)
+			with multiprocessing.Pool(pool_size) as p:
+				for _ in p.imap_unordered(create_codon_msas, multi_threaded_inputs, chunksize=max(1, len(multi_threaded_inputs) // (pool_size * 4))):
+					pass
 
 			if not filter_outliers:
 				self.nucl_seq_dir = nucl_seq_dir
@@ -686,76 +800,49 @@ class GCF(Pan):
 									 concatenated SCC homolog group alignment.
 		"""
 		try:
+			# per-record chunks of the concatenated alignment, one chunk per homolog group
+			bgc_sccs = defaultdict(list)
 			if only_scc:
-				bgc_sccs = defaultdict(lambda: "")
-				fasta_data = []
-				fasta_data_tr = []
-
+				gap_cutoff = 0.1
 				for f in os.listdir(self.codo_alg_dir):
 					hg_align_msa = self.codo_alg_dir + f
 					# concatenate gene alignments
-					with open(hg_align_msa) as opm:
-						for rec in SeqIO.parse(opm, 'fasta'):
-							bgc_sccs['>' + rec.id] += str(rec.seq).upper()
-
-				for b in bgc_sccs:
-					fasta_data.append([b] + list(bgc_sccs[b]))
-
-				for i, ls in enumerate(zip(*fasta_data)):
-					if i == 0:
-						fasta_data_tr.append(ls)
-					else:
-						n_count = len([x for x in ls if x == '-'])
-						if (float(n_count) / len(ls)) < 0.1:
-							fasta_data_tr.append(list(ls))
-
-				scc_handle = open(output_alignment, 'w')
-
-				for rec in zip(*fasta_data_tr):
-					scc_handle.write(rec[0] + '\n' + ''.join(rec[1:]) + '\n')
-				scc_handle.close()
+					for rec_id, rec_seq in read_fasta_bytes(hg_align_msa):
+						bgc_sccs['>' + rec_id].append(rec_seq)
 			else:
-				bgc_sccs = defaultdict(lambda: "")
-				fasta_data = []
-				fasta_data_tr = []
-
+				gap_cutoff = ambiguious_position_cutoff
 				for f in os.listdir(self.codo_alg_dir):
 					hg_align_msa = self.codo_alg_dir + f
 					#print(f)
 					# perform consensus calling
 					sample_seqs = defaultdict(list)
-					with open(hg_align_msa) as opm:
-						for rec in SeqIO.parse(opm, 'fasta'):
-							sample = rec.id.split('|')[0]
-							sample_seqs[sample].append(list(str(rec.seq).upper()))
+					for rec_id, rec_seq in read_fasta_bytes(hg_align_msa):
+						sample = rec_id.split('|')[0]
+						sample_seqs[sample].append(rec_seq)
 
+					# consensus allele is called where all of a sample's sequences with a nucleotide agree on it
 					for samp in sample_seqs:
 						samp_seqs = sample_seqs[samp]
-						consensus_seq = []
-						for alleles in zip(*samp_seqs):
-							valid_alleles = set([a for a in list(alleles) if a in set(['A', 'C', 'G', 'T'])])
-							if len(valid_alleles) == 1:
-								consensus_seq.append(list(valid_alleles)[0])
-							else:
-								consensus_seq.append('-')
-						bgc_sccs['>' + samp] += "".join(consensus_seq)
-
-				for b in bgc_sccs:
-					fasta_data.append([b] + list(bgc_sccs[b]))
-
-				for i, ls in enumerate(zip(*fasta_data)):
-					if i == 0:
-						fasta_data_tr.append(ls)
-					else:
-						n_count = len([x for x in ls if x == '-'])
-						if (float(n_count) / len(ls)) < ambiguious_position_cutoff:
-							fasta_data_tr.append(list(ls))
-
-				scc_handle = open(output_alignment, 'w')
-
-				for rec in zip(*fasta_data_tr):
-					scc_handle.write(rec[0] + '\n' + ''.join(rec[1:]) + '\n')
-				scc_handle.close()
+						samp_seq_length = min([len(sq) for sq in samp_seqs])
+						samp_matrix = np.array([np.frombuffer(sq[:samp_seq_length], dtype=np.uint8) for sq in samp_seqs]).reshape(len(samp_seqs), samp_seq_length)
+						valid_matrix = nucleotide_base_lut[samp_matrix]
+						min_alleles = np.where(valid_matrix, samp_matrix, 255).min(axis=0)
+						max_alleles = np.where(valid_matrix, samp_matrix, 0).max(axis=0)
+						consensus_seq = np.where(valid_matrix.any(axis=0) & (min_alleles == max_alleles), min_alleles, ord('-')).astype(np.uint8)
+						bgc_sccs['>' + samp].append(consensus_seq.tobytes())
+
+			# filter out columns of the concatenated alignment with too many gaps, across all columns at once
+			record_ids = list(bgc_sccs.keys())
+			record_seqs = [b''.join(bgc_sccs[b]) for b in record_ids]
+			scc_handle = open(output_alignment, 'w')
+			if len(record_ids) > 0:
+				alignment_length = min([len(sq) for sq in record_seqs])
+				alignment_matrix = np.array([np.frombuffer(sq[:alignment_length], dtype=np.uint8) for sq in record_seqs]).reshape(len(record_ids), alignment_length)
+				gap_freqs = (alignment_matrix == ord('-')).sum(axis=0) / float(len(record_ids))
+				alignment_matrix = alignment_matrix[:, gap_freqs < gap_cutoff]
+				for ri, b in enumerate(record_ids):
+					scc_handle.write(b + '\n' + alignment_matrix[ri].tobytes().decode('ascii') + '\n')
+			scc_handle.close()
 
 		except Exception as e:
 			if self.logObject:
@@ -764,12 +851,13 @@ class GCF(Pan):
 			raise RuntimeError(traceback.format_exc())
 
 		# use FastTree2 to construct phylogeny
-		fasttree_cmd = ['fasttree', '-nt', output_alignment, '>', output_phylogeny]
+		fasttree_cmd = ['fasttree', '-nt', output_alignment]
 		if self.logObject:
-			self.logObject.info('Running FastTree2 with the following command: %s' % ' '.join(fasttree_cmd))
+			self.logObject.info('Running FastTree2 with the following command: %s > %s' % (' '.join(fasttree_cmd), output_phylogeny))
 		try:
-			subprocess.call(' '.join(fasttree_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			# the phylogeny is written to stdout, which is redirected to the output file directly rather than via a shell
+			with open(output_phylogeny, 'wb', buffering=OUTPUT_BUFFER_SIZE) as output_phylogeny_handle:
+				subprocess.call(fasttree_cmd, stdout=output_phylogeny_handle, stderr=subprocess.DEVNULL)
 			if self.logObject:
 				self.logObject.info('Successfully ran: %s' % ' '.join(fasttree_cmd))
 		except Exception as e:
@@ -791,7 +879,7 @@ class GCF(Pan):
 		"""
 		try:
 			refined_gbks_dir = outdir + 'Refined_Genbanks/'
-			if not os.path.isdir(refined_gbks_dir): os.system('mkdir %s' % refined_gbks_dir)
+			os.makedirs(refined_gbks_dir, exist_ok=True)
 
 			nglf_handle = open(new_gcf_listing_file, 'w')
 
@@ -845,45 +933,21 @@ class GCF(Pan):
 					break
 
 			bgcs_ref_first = [ref_bgc] + sorted(list(set(self.bgc_genes.keys()).difference(set([ref_bgc]))))
-			ref_hg_directions = {}
 			hg_pair_scpus = defaultdict(int)
 			hg_preceding_scpus = defaultdict(lambda: defaultdict(int))
 			hg_following_scpus = defaultdict(lambda: defaultdict(int))
 			all_hgs = set(['start', 'end'])
 			direction_forward_support = defaultdict(int)
 			direction_reverse_support = defaultdict(int)
+			bgc_hg_layouts = self.determineBGCHgLayouts(sort_genes=True)
 			for i, bgc in enumerate(bgcs_ref_first):
-				curr_bgc_genes = self.bgc_genes[bgc]
-				hg_directions = {}
-				hg_lengths = defaultdict(list)
-				hg_starts = {}
-				for g in sorted(curr_bgc_genes):
-					ginfo = self.comp_gene_info[g]
-					gstart = ginfo['start']
-					gend = ginfo['end']
-					if g in self.gene_to_hg:
-						hg = self.gene_to_hg[g]
-						hg_directions[hg] = ginfo['direction']
-						hg_lengths[hg].append(abs(gend - gstart))
-						hg_starts[hg] = ginfo['start']
+				hg_directions = bgc_hg_layouts[bgc]['hg_directions']
+				hg_starts = bgc_hg_layouts[bgc]['hg_starts']
 
+				# reverse ordering
 				reverse_flag = False
-				if i == 0:
-					ref_hg_directions = hg_directions
-				else:
-					flip_support = 0
-					keep_support = 0
-					for c in ref_hg_directions:
-						if not c in hg_directions: continue
-						hg_weight = statistics.mean(hg_lengths[c])
-						if hg_directions[c] == ref_hg_directions[c]:
-							keep_support += hg_weight
-						else:
-							flip_support += hg_weight
-
-					# reverse ordering
-					if flip_support > keep_support:
-						reverse_flag = True
+				if i > 0 and self.determineBGCFlip(bgc_hg_layouts, bgc, ref_bgc):
+					reverse_flag = True
 
 				hgs = []
 				for c in sorted(hg_starts.items(), key=itemgetter(1), reverse=reverse_flag):
@@ -1050,8 +1114,8 @@ class GCF(Pan):
 			popgen_dir += '/'
 			plots_dir += '/'
 
-		if not os.path.isdir(popgen_dir): os.system('mkdir %s' % popgen_dir)
-		if not os.path.isdir(plots_dir): os.system('mkdir %s' % plots_dir)
+		os.makedirs(popgen_dir, exist_ok=True)
+		os.makedirs(plots_dir, exist_ok=True)
 
 		final_output_handle = open(final_output_file, 'w')
 		header = ['gcf_id', 'gcf_annotation', 'homolog_group', 'annotation', 'hg_order_index', 'hg_consensus_direction',
@@ -1083,21 +1147,39 @@ class GCF(Pan):
 				products[prod] += 1.0 / len(self.bgc_product[bgc])
 		gcf_product_summary = '; '.join([x[0] + ':' + str(x[1]) for x in products.items()])
 
+		# invariants across homolog groups are determined once here, rather than within each homolog group's analysis
+		total_bgc_samples = len(set(self.bgc_sample.values()))
+		hg_order_scores = dict(self.hg_order_scores)
+		if gw_pairwise_similarities != None:
+			gw_pairwise_similarities = dict(gw_pairwise_similarities)
+		sample_population_local = self.sample_population
+		population_counts = None
+		population_samples = None
+		if sample_population_local != None:
+			sample_population_local = dict(sample_population_local)
+			population_counts = Counter()
+			population_samples = defaultdict(set)
+			for s, p in sample_population_local.items():
+				population_counts[p] += 1
+				population_samples[p].add(s)
+
+		# data shared by all homolog groups is handed to each worker process once, when it starts, rather than being
+		# pickled along with the inputs of every homolog group
+		popgen_worker_data = {'comp_gene_info': self.comp_gene_info, 'total_bgc_samples': total_bgc_samples,
+							  'hg_prop_multi_copy': self.hg_prop_multi_copy, 'hg_order_scpus': hg_order_scores,
+							  'gw_pairwise_similarities': gw_pairwise_similarities,
+							  'sample_population': sample_population_local, 'population_counts': population_counts,
+							  'population_samples': population_samples}
+
 		for f in os.listdir(input_codon_dir):
 			hg = f.split('.msa.fna')[0]
 			codon_alignment_fasta = input_codon_dir + f
-			if gw_pairwise_similarities != None:
-				gw_pairwise_similarities = dict(gw_pairwise_similarities)
-			sample_population_local = self.sample_population
-			if sample_population_local != None:
-				sample_population_local = dict(sample_population_local)
-			inputs.append([self.gcf_id, gcf_product_summary, hg, codon_alignment_fasta, popgen_dir, plots_dir, self.comp_gene_info,
-						   self.hg_genes, self.bgc_sample, self.hg_prop_multi_copy, dict(self.hg_order_scores),
-						   gw_pairwise_similarities, use_translation, sample_population_local, population,
-						   species_phylogeny, sample_size, self.logObject])
-
-		p = multiprocessing.Pool(cpus)
-		p.map(popgen_analysis_of_hg, inputs)
+			inputs.append([self.gcf_id, gcf_product_summary, hg, codon_alignment_fasta, popgen_dir, plots_dir,
+						   use_translation, population, species_phylogeny, sample_size, self.logObject])
+
+		with multiprocessing.Pool(cpus, initializer=init_popgen_worker, initargs=(popgen_worker_data,)) as p:
+			for _ in p.imap_unordered(popgen_analysis_of_hg, inputs, chunksize=max(1, len(inputs) // (cpus * 4))):
+				pass
 
 		final_output_handle = open(final_output_file, 'a+')
 		data = []
@@ -1127,8 +1209,7 @@ class GCF(Pan):
 				con_order = int(ls[4])
 			data_for_sorting.append([con_order, newline])
 
-		for ls in sorted(data_for_sorting, key=itemgetter(0)):
-			final_output_handle.write(ls[1] + '\n')
+		final_output_handle.writelines([ls[1] + '\n' for ls in sorted(data_for_sorting, key=itemgetter(0))])
 		final_output_handle.close()
 
 	def identifyGCFInstances(self, outdir, sample_prokka_data, orthofinder_matrix_file, min_size=5, min_core_size=3,
@@ -1148,8 +1229,8 @@ class GCF(Pan):
 
 		bgc_genbanks_dir = os.path.abspath(outdir + 'BGC_Genbanks') + '/'
 		bgc_info_dir = os.path.abspath(outdir + 'BGC_Sample_Info') + '/'
-		if not os.path.isdir(bgc_genbanks_dir): os.system('mkdir %s' % bgc_genbanks_dir)
-		if not os.path.isdir(bgc_info_dir): os.system('mkdir %s' % bgc_info_dir)
+		os.makedirs(bgc_genbanks_dir, exist_ok=True)
+		os.makedirs(bgc_info_dir, exist_ok=True)
 
 		# Estimate HMM parameters
 		gcf_hg_probabilities = defaultdict(lambda: 0.0)
@@ -1226,8 +1307,7 @@ class GCF(Pan):
 		# open handle to file where expanded GCF listings will be written
 		expanded_gcf_list_handle = open(expanded_gcf_list_file, 'w')
 		with open(self.bgc_genbanks_listing) as obglf:
-			for line in obglf:
-				expanded_gcf_list_handle.write(line)
+			expanded_gcf_list_handle.write(obglf.read())
 		expanded_gcf_list_handle.close()
 
 		total_samples = sorted(sample_prokka_data.keys())
@@ -1239,11 +1319,11 @@ class GCF(Pan):
 			sample_hgs = defaultdict(set)
 			sample_lt_to_evalue = defaultdict(dict)
 			for lt in self.hmmscan_results:
-				for i, hits in enumerate(sorted(self.hmmscan_results[lt], key=itemgetter(4))):
-					if i == 0 and hits[2] in block_samp_set:
-						sample_lt_to_hg[hits[2]][lt] = hits[0]
-						sample_hgs[hits[2]].add(hits[0])
-						sample_lt_to_evalue[hits[2]][lt] = decimal.Decimal(hits[1])
+				hits = min(self.hmmscan_results[lt], key=itemgetter(4))
+				if hits[2] in block_samp_set:
+					sample_lt_to_hg[hits[2]][lt] = hits[0]
+					sample_hgs[hits[2]].add(hits[0])
+					sample_lt_to_evalue[hits[2]][lt] = decimal.Decimal(hits[1])
 
 			simplified_comp_gene_info = defaultdict(dict)
 			for g in self.comp_gene_info:
@@ -1317,32 +1397,31 @@ class GCF(Pan):
 							sample_hg_proteins[sample][hg].add(lt)
 					all_samples.add(sample)
 
-			original_samples = []
-			all_hgs = set([])
-			with open(orthofinder_matrix_file) as omf:
-				for i, line in enumerate(omf):
-					line = line.strip('\n')
-					ls = line.split('\t')
-					if i == 0:
-						original_samples = [util.cleanUpSampleName(x) for x in ls[1:]]
-						all_samples = all_samples.union(set(original_samples))
+			# the OrthoFinder matrix is parsed in bulk by pandas, with empty cells kept as empty strings
+			import pandas as pd
+			orthofinder_matrix = pd.read_csv(orthofinder_matrix_file, sep='\t', dtype=str, keep_default_na=False,
+											 na_filter=False, quoting=csv.QUOTE_NONE)
+			original_samples = [util.cleanUpSampleName(x) for x in orthofinder_matrix.columns[1:]]
+			all_samples = all_samples.union(set(original_samples))
+			matrix_hgs = orthofinder_matrix.iloc[:, 0].tolist()
+			all_hgs = set(matrix_hgs)
+			for j, sample in enumerate(original_samples):
+				for hg, prot in zip(matrix_hgs, orthofinder_matrix.iloc[:, j+1].tolist()):
+					if prot.strip() == '': continue
+					if ', ' in prot:
+						sample_hg_proteins[sample][hg].update(prot.split(', '))
 					else:
-						hg = ls[0]
-						all_hgs.add(hg)
-						for j, prot in enumerate(ls[1:]):
-							if prot.strip() != '':
-								sample_hg_proteins[original_samples[j]][hg] = sample_hg_proteins[original_samples[j]][hg].union(set(prot.split(', ')))
+						sample_hg_proteins[sample][hg].add(prot)
 
 			expanded_orthofinder_matrix_file = outdir + 'Orthogroups.expanded.tsv'
 			expanded_orthofinder_matrix_handle = open(expanded_orthofinder_matrix_file, 'w')
 
-			header = [''] + [s for s in sorted(all_samples)]
-			expanded_orthofinder_matrix_handle.write('\t'.join(header) + '\n')
+			sorted_samples = sorted(all_samples)
+			header = [''] + sorted_samples
+			matrix_lines = ['\t'.join(header)]
 			for hg in sorted(all_hgs):
-				printlist = [hg]
-				for s in sorted(all_samples):
-					printlist.append(', '.join(sample_hg_proteins[s][hg]))
-				expanded_orthofinder_matrix_handle.write('\t'.join(printlist) + '\n')
+				matrix_lines.append('\t'.join([hg] + [', '.join(sample_hg_proteins[s][hg]) for s in sorted_samples]))
+			expanded_orthofinder_matrix_handle.write('\n'.join(matrix_lines) + '\n')
 			expanded_orthofinder_matrix_handle.close()
 
 	def extractGenesAndCluster(self, genes_representative_fasta, genes_fasta, codon_alignments_file, bowtie2_db_prefix):
@@ -1364,7 +1443,7 @@ class GCF(Pan):
 				for line in ocaf:
 					line = line.strip()
 					hg, cod_alignment_fasta = line.split('\t')
-					alleles_clustered, pair_matching = util.determineAllelesFromCodonAlignment(cod_alignment_fasta)
+					alleles_clustered, pair_matching, allele_gene_index = util.determineAllelesFromCodonAlignment(cod_alignment_fasta)
 					all_genes_in_codon_alignments = set([])
 					for ac in alleles_clustered:
 						for gid in alleles_clustered[ac]:
@@ -1379,12 +1458,14 @@ class GCF(Pan):
 						self.logObject.warning("Not all genes featured in codon alignment for homolog group %s, these will be excluded." % hg)
 
 					for allele_cluster in alleles_clustered:
-						best_rep_score = defaultdict(float)
-						for ag1 in alleles_clustered[allele_cluster]:
+						allele_cluster_genes = list(alleles_clustered[allele_cluster])
+						for ag1 in allele_cluster_genes:
 							gf_handle.write('>' + hg + '|' + allele_cluster + '|' + ag1 + '\n' + str(self.comp_gene_info[ag1.split('|')[-1]]['nucl_seq']) + '\n')
-							for ag2 in alleles_clustered[allele_cluster]:
-								best_rep_score[ag1] += pair_matching[ag1][ag2]
-						representative_gene = sorted([x for x in best_rep_score if best_rep_score[x] == max(best_rep_score.values())])[0]
+						# the representative gene has the highest summed matching proportion to the other genes of the allele cluster
+						allele_cluster_indices = [allele_gene_index[ag] for ag in allele_cluster_genes]
+						rep_scores = pair_matching[np.ix_(allele_cluster_indices, allele_cluster_indices)].sum(axis=1).tolist()
+						max_rep_score = max(rep_scores)
+						representative_gene = sorted([ag for ag, rep_score in zip(allele_cluster_genes, rep_scores) if rep_score == max_rep_score])[0]
 						for ag in alleles_clustered[allele_cluster]:
 							self.instance_to_haplotype[hg + '|' + allele_cluster + '|' + ag] = hg + '|' + allele_cluster + '|' + representative_gene
 						grf_handle.write('>' + hg + '|' + allele_cluster + '|' + representative_gene + '\n' + str(self.comp_gene_info[representative_gene.split('|')[-1]]['nucl_seq']) + '\n')
@@ -1395,8 +1476,7 @@ class GCF(Pan):
 			if self.logObject:
 				self.logObject.info('Running the following command: %s' % ' '.join(bowtie2_build))
 			try:
-				subprocess.call(' '.join(bowtie2_build), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-								executable='/bin/bash')
+				subprocess.call(bowtie2_build, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 				if self.logObject:
 					self.logObject.info('Successfully ran: %s' % ' '.join(bowtie2_build))
 			except:
@@ -1444,8 +1524,7 @@ class GCF(Pan):
 		if self.logObject:
 			self.logObject.info('Running the following command: %s' % ' '.join(cd_hit_nr))
 		try:
-			subprocess.call(' '.join(cd_hit_nr), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(cd_hit_nr, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			if self.logObject:
 				self.logObject.info('Successfully ran: %s' % ' '.join(cd_hit_nr))
 		except Exception as e:
@@ -1462,8 +1541,7 @@ class GCF(Pan):
 		if self.logObject:
 			self.logObject.info('Running the following command: %s' % ' '.join(cd_hit_cluster))
 		try:
-			subprocess.call(' '.join(cd_hit_cluster), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(cd_hit_cluster, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			if self.logObject:
 				self.logObject.info('Successfully ran: %s' % ' '.join(cd_hit_cluster))
 		except:
@@ -1477,8 +1555,7 @@ class GCF(Pan):
 		if self.logObject:
 			self.logObject.info('Running the following command: %s' % ' '.join(bowtie2_build))
 		try:
-			subprocess.call(' '.join(bowtie2_build), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(bowtie2_build, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			if self.logObject:
 				self.logObject.info('Successfully ran: %s' % ' '.join(bowtie2_build))
 		except:
@@ -1542,10 +1619,10 @@ class GCF(Pan):
 					hg, cod_alignment = line.split('\t')
 					seq_count = 0
 					with open(cod_alignment) as oca:
-						for j, rec in enumerate(SeqIO.parse(oca, 'fasta')):
-							sample_id, gene_id = rec.id.split('|')
+						for j, (rec_title, rec_seq) in enumerate(SimpleFastaParser(oca)):
+							sample_id, gene_id = rec_title.split(None, 1)[0].split('|')
 							real_pos = 1
-							for msa_pos, bp in enumerate(str(rec.seq)):
+							for msa_pos, bp in enumerate(rec_seq):
 								if j == 0:
 									codon_alignment_lengths[hg] += 1
 								if bp != '-':
@@ -1607,29 +1684,45 @@ class GCF(Pan):
 			sample_information_handle.write('\t'.join(['sample_id', 'sample_depth']) + '\n')
 			pairwise_distances_storage = defaultdict(lambda: defaultdict(lambda: 0.0))
 
-			for si1, s1 in enumerate(sample_profiles):
-				s1_hps = set(sample_profiles[s1].keys())
+			depth_samples = []
+			for s1 in sample_profiles:
 				s1_depth = sum(sample_depths[s1].values())/float(len(sample_depths[s1].keys()))
 				if s1_depth < 10.0: continue
 				sample_information_handle.write('\t'.join([s1, str(s1_depth)]) + '\n')
-				for si2, s2 in enumerate(sample_profiles):
-					if si1 == si2: continue
-					s2_depth = sum(sample_depths[s2].values()) / float(len(sample_depths[s2].keys()))
-					if s2_depth < 10.0: continue
-					s2_hps = set(sample_profiles[s2].keys())
-					total_intersect_positions = 0
-					stat_pos = 0.0
-					for hp in s1_hps.intersection(s2_hps):
-						for bi, s1b in enumerate(sample_profiles[s1][hp]):
-							s2b = sample_profiles[s2][hp][bi]
-							stat_pos += abs(s1b - s2b)
-						total_intersect_positions += 1
-					distance_stat = 1.0
-					if total_intersect_positions > 0:
-						distance_stat = float(stat_pos)/float(total_intersect_positions)
-					pairwise_distances_storage[s1][s2] = distance_stat
+				depth_samples.append(s1)
 			sample_information_handle.close()
 
+			# base frequency profiles of samples with sufficient depth are stacked into a (samples x positions x bases)
+			# array, alongside a mask of which positions have a profile for each sample.
+			position_index = {}
+			for s1 in depth_samples:
+				for hp in sample_profiles[s1]:
+					if not hp in position_index:
+						position_index[hp] = len(position_index)
+			sample_freqs = np.zeros((len(depth_samples), len(position_index), 4))
+			sample_covered = np.zeros((len(depth_samples), len(position_index)), dtype=bool)
+			for si, s1 in enumerate(depth_samples):
+				s1_positions = [position_index[hp] for hp in sample_profiles[s1]]
+				sample_freqs[si, s1_positions] = list(sample_profiles[s1].values())
+				sample_covered[si, s1_positions] = True
+
+			# the distance between two samples is the mean, over positions profiled in both, of the summed absolute
+			# differences in base frequencies. Each sample is compared against blocks of the other samples at once.
+			block_size = max(1, PAIRWISE_BLOCK_ELEMENTS // max(1, len(position_index) * 4))
+			for si1, s1 in enumerate(depth_samples):
+				for block_start in range(0, len(depth_samples), block_size):
+					block_end = min(block_start + block_size, len(depth_samples))
+					shared_positions = sample_covered[block_start:block_end] & sample_covered[si1]
+					freq_diffs = np.abs(sample_freqs[block_start:block_end] - sample_freqs[si1]).sum(axis=2)
+					stat_pos = np.where(shared_positions, freq_diffs, 0.0).sum(axis=1).tolist()
+					total_intersect_positions = shared_positions.sum(axis=1).tolist()
+					for bi, si2 in enumerate(range(block_start, block_end)):
+						if si1 == si2: continue
+						distance_stat = 1.0
+						if total_intersect_positions[bi] > 0:
+							distance_stat = float(stat_pos[bi])/float(total_intersect_positions[bi])
+						pairwise_distances_storage[s1][depth_samples[si2]] = distance_stat
+
 			pairwise_distance_handle.write('samples\t' + '\t'.join(sorted(sample_profiles)) + '\n')
 			for s1 in sorted(sample_profiles):
 				printlist = [s1]
@@ -1645,9 +1738,8 @@ class GCF(Pan):
 			if self.logObject:
 				self.logObject.info('Running Rscript with the following command: %s' % ' '.join(plot_cmd))
 			try:
-				subprocess.call(' '.join(plot_cmd), shell=True, stdout=subprocess.DEVNULL,
-								stderr=subprocess.DEVNULL,
-								executable='/bin/bash')
+				subprocess.call(plot_cmd, stdout=subprocess.DEVNULL,
+								stderr=subprocess.DEVNULL)
 				if self.logObject:
 					self.logObject.info('Successfully ran: %s' % ' '.join(plot_cmd))
 			except Exception as e:
@@ -1678,9 +1770,9 @@ class GCF(Pan):
 				ids = []
 				types = []
 				with open(codon_alignment_paths[hg]) as of:
-					for rec in SeqIO.parse(of, 'fasta'):
-						ids.append(rec.id)
-						seqs.append(list(str(rec.seq).upper()))
+					for rec_title, rec_seq in SimpleFastaParser(of):
+						ids.append(rec_title.split(None, 1)[0])
+						seqs.append(list(rec_seq.upper()))
 						types.append('Database')
 
 				cod_alg_len = len(seqs[0])
@@ -1700,8 +1792,8 @@ class GCF(Pan):
 				ambiguous_positions_in_og_alignment = ambiguous_positions_in_og_alignment.union(hg_nonunique_positions[hg])
 
 				with open(phased_alleles_outdir + f) as of:
-					for rec in SeqIO.parse(of, 'fasta'):
-						seqlist = list(str(rec.seq).upper())
+					for rec_title, rec_seq in SimpleFastaParser(of):
+						seqlist = list(rec_seq.upper())
 						gap_count = 0
 						tot_count = 0
 						for i, bp in enumerate(seqlist):
@@ -1712,7 +1804,7 @@ class GCF(Pan):
 									gap_count += 1
 						amb_prop = float(gap_count)/float(tot_count)
 						if amb_prop < sequence_filter:
-							ids.append(rec.id)
+							ids.append(rec_title.split(None, 1)[0])
 							seqs.append(seqlist)
 							types.append('Query')
 
@@ -1748,18 +1840,17 @@ class GCF(Pan):
 				gene_alignment_with_refs_filtered_handle.close()
 				gene_phylogeny_track_handle.close()
 				if too_few_sites_flag:
-					os.system('rm -f %s %s' % (gene_alignment_with_refs_filtered_file, gene_phylogeny_track_file))
+					for filtered_file in [gene_alignment_with_refs_filtered_file, gene_phylogeny_track_file]:
+						if os.path.isfile(filtered_file): os.remove(filtered_file)
 					continue
 
 				# use FastTree2 to construct gene-specific phylogeny
-				fasttree_cmd = ['fasttree', '-nt', gene_alignment_with_refs_filtered_file, '>',
-								gene_phylogeny_with_refs_filtered_file]
+				fasttree_cmd = ['fasttree', '-nt', gene_alignment_with_refs_filtered_file]
 				if self.logObject:
-					self.logObject.info('Running FastTree2 with the following command: %s' % ' '.join(fasttree_cmd))
+					self.logObject.info('Running FastTree2 with the following command: %s > %s' % (' '.join(fasttree_cmd), gene_phylogeny_with_refs_filtered_file))
 				try:
-					subprocess.call(' '.join(fasttree_cmd), shell=True, stdout=subprocess.DEVNULL,
-									stderr=subprocess.DEVNULL,
-									executable='/bin/bash')
+					with open(gene_phylogeny_with_refs_filtered_file, 'wb', buffering=OUTPUT_BUFFER_SIZE) as gene_phylogeny_handle:
+						subprocess.call(fasttree_cmd, stdout=gene_phylogeny_handle, stderr=subprocess.DEVNULL)
 					if self.logObject:
 						self.logObject.info('Successfully ran: %s' % ' '.join(fasttree_cmd))
 				except Exception as e:
@@ -1774,9 +1865,8 @@ class GCF(Pan):
 				if self.logObject:
 					self.logObject.info('Running Rscript with the following command: %s' % ' '.join(plot_cmd))
 				try:
-					subprocess.call(' '.join(plot_cmd), shell=True, stdout=subprocess.DEVNULL,
-									stderr=subprocess.DEVNULL,
-									executable='/bin/bash')
+					subprocess.call(plot_cmd, stdout=subprocess.DEVNULL,
+									stderr=subprocess.DEVNULL)
 					if self.logObject:
 						self.logObject.info('Successfully ran: %s' % ' '.join(plot_cmd))
 				except Exception as e:
@@ -1818,9 +1908,9 @@ class GCF(Pan):
 					msa_positions = set([])
 					core_genomes_with_hg = set([])
 					with open(cod_alignment) as oca:
-						for rec in SeqIO.parse(oca, 'fasta'):
-							sequence_without_gaps = str(rec.seq).upper().replace('-', '')
-							sample_id, gene_id = rec.id.split('|')
+						for rec_title, rec_seq in SimpleFastaParser(oca):
+							sequence_without_gaps = rec_seq.upper().replace('-', '')
+							sample_id, gene_id = rec_title.split(None, 1)[0].split('|')
 							if len(gene_id.split('_')[0]) == 3:
 								core_genomes_with_hg.add(gene_id.split('_')[0])
 								total_core_genomes.add(gene_id.split('_')[0])
@@ -1830,7 +1920,7 @@ class GCF(Pan):
 							seqlen_information[gene_id] = [seqlen, seqlen_lower, seqlen_upper]
 
 							real_pos = 1
-							for msa_pos, bp in enumerate(str(rec.seq)):
+							for msa_pos, bp in enumerate(rec_seq):
 								msa_positions.add(msa_pos+1)
 								msa_pos_to_gene_allele[hg][gene_id][msa_pos + 1] = bp.upper()
 								if bp != '-':
@@ -1924,6 +2014,104 @@ class GCF(Pan):
 			raise RuntimeError(traceback.format_exc())
 
 
+def postorder_nodes(tree):
+	"""
+	Function to list the nodes of an ete3 tree in postorder using an explicit stack, rather than ete3's recursive
+	traversal generator. Since the listing is complete before it is returned, the tree can be safely modified while
+	looping over it.
+	"""
+	nodes = []
+	stack = deque([tree])
+	while stack:
+		node = stack.pop()
+		nodes.append(node)
+		stack.extend(node.children)
+	nodes.reverse()
+	return nodes
+
+def read_fasta_bytes(fasta_file):
+	"""
+	Function to iterate over the records of a plain FASTA file, such as a MSA, yielding the identifier of each record
+	(header up to the first whitespace) alongside its uppercased sequence as bytes, without building SeqRecord objects.
+	"""
+	with open(fasta_file) as of:
+		for rec_title, rec_seq in SimpleFastaParser(of):
+			yield rec_title.split(None, 1)[0], rec_seq.upper().encode('ascii')
+
+def translate_codon(codon):
+	"""
+	Function to translate a single codon using the standard genetic code lookup, falling back to Biopython for
+	ambiguous codons not featured in the lookup. Such fallback translations are added to the lookup so that each
+	ambiguous codon is only ever translated through a Seq object once.
+	"""
+	try:
+		return codon_to_aa[codon]
+	except KeyError:
+		aa = str(Seq(codon).translate())
+		codon_to_aa[codon] = aa
+		return aa
+
+def find_first_stop_codon(seq):
+	"""
+	Function to find the first in-frame stop codon of a sequence, by looking up the index of all complete codons at once.
+
+	:param seq: nucleotide sequence (string), where gaps and ambiguous bases never form stop codons.
+	:return: the 0-based index of the first stop codon, or None if there is none.
+	"""
+	num_codons = len(seq) // 3
+	if num_codons == 0:
+		return None
+	codon_codes = nucleotide_code_lut[np.frombuffer(seq[:3*num_codons].encode(), dtype=np.uint8)].reshape(num_codons, 3)
+	codon_indices = 16*codon_codes[:, 0] + 4*codon_codes[:, 1] + codon_codes[:, 2]
+	codon_indices[(codon_codes == 64).any(axis=1)] = 64
+	stop_codon_indices = np.flatnonzero(stop_codon_lut[codon_indices])
+	if len(stop_codon_indices) == 0:
+		return None
+	return int(stop_codon_indices[0])
+
+def back_thread_codons(prot_msa_records, nucl_seqs):
+	"""
+	Function to thread the codons of nucleotide sequences onto their aligned protein sequences (as PAL2NAL does), such
+	that each residue is replaced by its codon and each gap by a codon gap. A terminal stop codon (TAA/TAG/TGA)
+	lacking from the protein sequence is left out.
+
+	:param prot_msa_records: iterable of (title, aligned protein sequence) pairs.
+	:param nucl_seqs: dictionary of nucleotide sequences keyed by sequence identifier.
+	:return: list of FASTA lines of the codon alignment, or None if any protein sequence and its nucleotide sequence
+	         are not consistent with each other.
+	"""
+	codon_msa_lines = []
+	for rec_title, rec_seq in prot_msa_records:
+		rec_id = rec_title.split(None, 1)[0] if rec_title else rec_title
+		if not rec_id in nucl_seqs:
+			return None
+		nucl_seq = nucl_seqs[rec_id]
+		residues = len(rec_seq) - rec_seq.count('-')
+		if len(nucl_seq) == 3 * (residues + 1):
+			if not nucl_seq[-3:].upper() in stop_codons:
+				return None
+		elif len(nucl_seq) != 3 * residues:
+			return None
+		codons = iter([nucl_seq[k:k + 3] for k in range(0, 3 * residues, 3)])
+		codon_msa_lines.extend(['>', rec_id, '\n', ''.join(['---' if aa == '-' else next(codons) for aa in rec_seq]), '\n'])
+	if len(codon_msa_lines) == 0:
+		return None
+	return codon_msa_lines
+
+def pairwise_min_differences(diffs_a, diffs_b):
+	"""
+	Function to get the minimum absolute difference between the gene-to-consensus differences of each sample in one
+	set and each sample in another. Inputs are (samples x max genes per sample) matrices padded with infinity and the
+	result is a (samples in a x samples in b) matrix, which is infinite for pairs where a sample lacks genes.
+	"""
+	min_diffs = np.full((diffs_a.shape[0], diffs_b.shape[0]), np.inf)
+	with np.errstate(invalid='ignore'):
+		for g1 in range(diffs_a.shape[1]):
+			for g2 in range(diffs_b.shape[1]):
+				# fmin ignores the NaNs arising from differences between two padding values
+				min_diffs = np.fmin(min_diffs, np.abs(diffs_a[:, g1, None] - diffs_b[None, :, g2]))
+	return min_diffs
+
 def phase_and_id_snvs(input_args):
 	pe_sample, pe_sample_reads, snv_mining_outdir, phased_alleles_outdir, gene_ignore_positions, gene_core_positions, gene_pos_to_msa_pos, msa_pos_to_gene_allele, gene_pos_to_allele, msa_pos_alleles, msa_pos_ambiguous_freqs, min_hetero_prop, min_allele_depth, allow_phasing, metagenomic, specific_homolog_groups, core_homologs, hg_genes, comp_gene_info, hg_prop_multi_copy, protocluster_core_homologs, rare_hgs_in_core_genomes, gcf_id, logObject = input_args
 	try:
@@ -1935,8 +2123,8 @@ def phase_and_id_snvs(input_args):
 
 		novelty_report_file = snv_mining_outdir + pe_sample + '.novel_snvs_report.txt'
 		homolog_presence_report_file = snv_mining_outdir + pe_sample + '.homolog_group_coverage.txt'
-		no_handle = open(novelty_report_file, 'w')
-		hpr_handle = open(homolog_presence_report_file, 'w')
+		no_handle = open(novelty_report_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
+		hpr_handle = open(homolog_presence_report_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
 		no_handle.write('\t'.join(['gcf_id', 'sample', 'homolog_group', 'position_along_msa', 'site_total_coverage_standardized',
 									'site_allele_coverage_standardized', 'alternate_allele_is_major_allele', 'alternate_allele',
 								   'codon_position', 'alternate_codon', 'alternate_aa', 'alternate_aa_is_novel', 'dn_or_ds', 'ts_or_tv',
@@ -1981,7 +2169,7 @@ def phase_and_id_snvs(input_args):
 							for al2 in previous_positions[1]:
 								for al3 in adequate_coverage_alleles:
 									codon = al1 + al2 + al3
-									if codon in set(['TAG', 'TGA', 'TAA']):
+									if codon in stop_codons:
 										if not homolog_group in hg_first_position_of_stop_codon:
 											hg_first_position_of_stop_codon[homolog_group] = position-2
 					previous_positions = []
@@ -2073,7 +2261,7 @@ def phase_and_id_snvs(input_args):
 		hpr_handle.write('\n'.join(report_lines) + '\n')
 
 		filt_result_file = snv_mining_outdir + pe_sample + '.filt.txt'
-		filt_result_handle = open(filt_result_file, 'w')
+		filt_result_handle = open(filt_result_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
 		pos_allele_support = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
 		with open(result_file) as orf:
 			for linenum, line in enumerate(orf):
@@ -2102,25 +2290,23 @@ def phase_and_id_snvs(input_args):
 
 		if float(hetero_sites)/total_sites >= min_hetero_prop and allow_phasing and metagenomic:
 			# perform phasing using desman
-			cwd = os.getcwd()
-
 			desman_general_dir = snv_mining_outdir + pe_sample + '_Desman_Dir/'
 			desman_variants_dir = desman_general_dir + 'Variants/'
 			desman_inferstrains_dir = desman_general_dir + 'InferStrains/'
 
-			if not os.path.isdir(desman_general_dir): os.system('mkdir %s' % desman_general_dir)
-			if not os.path.isdir(desman_variants_dir): os.system('mkdir %s' % desman_variants_dir)
-			if not os.path.isdir(desman_inferstrains_dir): os.system('mkdir %s' % desman_inferstrains_dir)
+			os.makedirs(desman_general_dir, exist_ok=True)
+			os.makedirs(desman_variants_dir, exist_ok=True)
+			os.makedirs(desman_inferstrains_dir, exist_ok=True)
 
-			desman_variant_filter_cmd = ['cd', desman_variants_dir, ';', 'Variant_Filter.py', filt_result_file,
-										 ';', 'cd', cwd]
+			# Desman commands are run from within their working directories by setting the cwd of the process
+			desman_variant_filter_cmd = ['Variant_Filter.py', filt_result_file]
 
 			if logObject:
 				logObject.info(
-					'Running Desman variant filtering with the following command: %s' % ' '.join(desman_variant_filter_cmd))
+					'Running Desman variant filtering with the following command (in %s): %s' % (desman_variants_dir, ' '.join(desman_variant_filter_cmd)))
 			desman_issue = False
 			try:
-				subprocess.call(' '.join(desman_variant_filter_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, executable='/bin/bash')
+				subprocess.call(desman_variant_filter_cmd, cwd=desman_variants_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 				logObject.info('Successfully ran: %s' % ' '.join(desman_variant_filter_cmd))
 			except Exception as e:
 				if logObject:
@@ -2133,18 +2319,19 @@ def phase_and_id_snvs(input_args):
 				try:
 					for g in [2, 3, 4, 5, 6, 7, 8]:
 						for r in [0, 1, 2, 3, 4]:
-							desmand_inferstrains_cmd = ['cd', desman_inferstrains_dir, ';', 'desman', '-e',
+							desmand_inferstrains_cmd = ['desman', '-e',
 														desman_variants_dir + 'outputtran_df.csv', '-o',
 														'ClusterEC_' + str(g) + '_' + str(r), '-r', '1000', '-i',
 														'100', '-g', str(g), '-s', str(r),
-														desman_variants_dir + 'outputsel_var.csv', '>',
-														desman_inferstrains_dir + 'ClusterEC_' + str(g) + '_' + str(r) + '.out']
+														desman_variants_dir + 'outputsel_var.csv']
+							desmand_inferstrains_out = desman_inferstrains_dir + 'ClusterEC_' + str(g) + '_' + str(r) + '.out'
 
 							if logObject:
 								logObject.info(
-									'Running Desman for strain inference with the following command: %s' % ' '.join(desmand_inferstrains_cmd))
+									'Running Desman for strain inference with the following command (in %s): %s > %s' % (desman_inferstrains_dir, ' '.join(desmand_inferstrains_cmd), desmand_inferstrains_out))
 							try:
-								subprocess.call(' '.join(desmand_inferstrains_cmd), shell=True, stdout=sys.stderr, stderr=sys.stderr, executable='/bin/bash')
+								with open(desmand_inferstrains_out, 'w') as desmand_inferstrains_handle:
+									subprocess.call(desmand_inferstrains_cmd, cwd=desman_inferstrains_dir, stdout=desmand_inferstrains_handle, stderr=sys.stderr)
 								logObject.info('Successfully ran: %s' % ' '.join(desmand_inferstrains_cmd))
 							except Exception as e:
 								if logObject:
@@ -2153,14 +2340,15 @@ def phase_and_id_snvs(input_args):
 									logObject.error(traceback.format_exc())
 								raise RuntimeError('Had an issue running: %s' % ' '.join(desmand_inferstrains_cmd))
 
-					desman_resolvehap_cmd = ['cd', desman_inferstrains_dir, ';', 'resolvenhap.py', 'ClusterEC', '>',
-											 desman_general_dir + 'Best_Parameter_Combo.txt']
+					desman_resolvehap_cmd = ['resolvenhap.py', 'ClusterEC']
+					desman_resolvehap_out = desman_general_dir + 'Best_Parameter_Combo.txt'
 					if logObject:
 						logObject.info(
-							'Assessing Desman runs for strain inference with the following command: %s' % ' '.join(
-								desman_resolvehap_cmd))
+							'Assessing Desman runs for strain inference with the following command (in %s): %s > %s' % (
+								desman_inferstrains_dir, ' '.join(desman_resolvehap_cmd), desman_resolvehap_out))
 					try:
-						subprocess.call(' '.join(desman_resolvehap_cmd), shell=True, stdout=sys.stderr, stderr=sys.stderr, executable='/bin/bash')
+						with open(desman_resolvehap_out, 'w') as desman_resolvehap_handle:
+							subprocess.call(desman_resolvehap_cmd, cwd=desman_inferstrains_dir, stdout=desman_resolvehap_handle, stderr=sys.stderr)
 						logObject.info('Successfully ran: %s' % ' '.join(desman_resolvehap_cmd))
 					except Exception as e:
 						if logObject:
@@ -2272,19 +2460,18 @@ def phase_and_id_snvs(input_args):
 			bgc_fasta_handle = open(bgc_fasta_file, 'a+')
 			for hi in haplotype_sequences[hg]:
 				seq = haplotype_sequences[hg][hi]
-				codons = [str(seq)[i:i + 3] for i in range(0, len(str(seq)), 3)]
-				first_stop_codon = None
-				for cod_i, cod in enumerate(codons):
-					if cod in set(['TAG', 'TGA', 'TAA']):
-						first_stop_codon = 3*(cod_i+1)
-						break
+				first_stop_codon = find_first_stop_codon(seq)
 				if first_stop_codon is not None:
+					first_stop_codon = 3*(first_stop_codon+1)
 					seq = seq[:first_stop_codon] + ''.join(['-']*len(seq[first_stop_codon:]))
 				bgc_fasta_handle.write('>' + pe_sample + '_|_' + str(hi+1) + '\n' + seq + '\n')
 			bgc_fasta_handle.close()
 
 
 		all_snv_supporting_reads = set([])
+		gene_sequences_ungapped = {}
+		# amino acids encoded across all genes of a homolog group at each codon frame of the MSA
+		hg_frame_amino_acids = {}
 		with open(snv_file) as of:
 			for i, line in enumerate(of):
 				line = line.strip()
@@ -2298,12 +2485,14 @@ def phase_and_id_snvs(input_args):
 
 				# check whether to regard this SNV as potentially legit
 				if not hg in refined_present_homolog_groups or hg_prop_multi_copy[hg] >= 0.05: continue
-				if not ref_pos in gene_pos_to_msa_pos[hg][gene]: continue
-				msa_pos = gene_pos_to_msa_pos[hg][gene][ref_pos]
+				gene_msa_positions = gene_pos_to_msa_pos[hg][gene]
+				if not ref_pos in gene_msa_positions: continue
+				msa_pos = gene_msa_positions[ref_pos]
 				msa_pos_als = msa_pos_alleles[hg][msa_pos]
 				if hg_first_position_of_stop_codon[hg] != None and msa_pos >= hg_first_position_of_stop_codon[hg]: continue
 				if int(snv_support_count) >= min_allele_depth and int(homolog_group_depths[hg][msa_pos-1]) <= (trimmed_depth_median+(2*trimmed_depth_mad)) and int(homolog_group_depths[hg][msa_pos-1]) >= trimmed_depth_median-(3*trimmed_depth_mad):
-					assert (ref_al in msa_pos_alleles[hg][msa_pos] and ref_al == gene_pos_to_allele[hg][gene][ref_pos])
+					gene_alleles = gene_pos_to_allele[hg][gene]
+					assert (ref_al in msa_pos_als and ref_al == gene_alleles[ref_pos])
 					if not alt_al in msa_pos_als and not msa_pos in gene_ignore_positions[hg]:
 						#if not alt_al in msa_pos_als and not msa_pos in gene_edgy_positions[hg] and msa_pos_ambiguous_freqs[hg][msa_pos] <= 0.1:
 						codon_position = None
@@ -2313,60 +2502,30 @@ def phase_and_id_snvs(input_args):
 						alt_aa = None
 						alt_aa_novel = True
 						dn_or_ds = None
-						ts_or_tv = "transition"
-						if (ref_al in purine_alleles) != (alt_al in purine_alleles):
-							ts_or_tv = "transversion"
-						if ref_pos % 3 == 1:
-							codon_position = 1
-							ref_codon = ref_al + gene_pos_to_allele[hg][gene][ref_pos + 1] + \
-										gene_pos_to_allele[hg][gene][ref_pos + 2]
-							alt_codon = alt_al + gene_pos_to_allele[hg][gene][ref_pos + 1] + \
-										gene_pos_to_allele[hg][gene][ref_pos + 2]
-							ref_aa = str(Seq(ref_codon).translate())
-							alt_aa = str(Seq(alt_codon).translate())
-
-							for g in gene_pos_to_allele[hg]:
-								gene_codon = msa_pos_to_gene_allele[hg][g][msa_pos] + \
-										   msa_pos_to_gene_allele[hg][g][msa_pos + 1] + \
-										   msa_pos_to_gene_allele[hg][g][msa_pos + 2]
-								if g == gene:
-									assert(gene_codon == ref_codon)
-								gene_aa = str(Seq(gene_codon).translate())
-								if alt_aa == gene_aa: alt_aa_novel = False
-						elif ref_pos % 3 == 2:
-							codon_position = 2
-							ref_codon = gene_pos_to_allele[hg][gene][ref_pos - 1] + ref_al + \
-										gene_pos_to_allele[hg][gene][ref_pos + 1]
-							alt_codon = gene_pos_to_allele[hg][gene][ref_pos - 1] + alt_al + \
-										gene_pos_to_allele[hg][gene][ref_pos + 1]
-							ref_aa = str(Seq(ref_codon).translate())
-							alt_aa = str(Seq(alt_codon).translate())
-
+						ts_or_tv = "transversion" if purine_mask.get(ref_al.upper(), 0) ^ purine_mask.get(alt_al.upper(), 0) else "transition"
+						if not (hg, gene) in gene_sequences_ungapped:
+							gene_sequences_ungapped[(hg, gene)] = ''.join([gene_alleles[p] for p in range(1, len(gene_alleles)+1)])
+						gene_seq = gene_sequences_ungapped[(hg, gene)]
+						codon_offset = (ref_pos - 1) % 3
+						codon_position = codon_offset + 1
+						frame_start = ref_pos - 1 - codon_offset
+						ref_codon = gene_seq[frame_start:frame_start + 3]
+						alt_codon = ref_codon[:codon_offset] + alt_al + ref_codon[codon_offset + 1:]
+						ref_aa = translate_codon(ref_codon)
+						alt_aa = translate_codon(alt_codon)
+
+						msa_frame_start = msa_pos - codon_offset
+						if not (hg, msa_frame_start) in hg_frame_amino_acids:
+							frame_amino_acids = set([])
 							for g in gene_pos_to_allele[hg]:
-								gene_codon = msa_pos_to_gene_allele[hg][g][msa_pos - 1] + \
-										   msa_pos_to_gene_allele[hg][g][msa_pos] + \
-										   msa_pos_to_gene_allele[hg][g][msa_pos + 1]
+								g_msa_alleles = msa_pos_to_gene_allele[hg][g]
+								gene_codon = g_msa_alleles[msa_frame_start] + g_msa_alleles[msa_frame_start + 1] + \
+											 g_msa_alleles[msa_frame_start + 2]
 								if g == gene:
 									assert(gene_codon == ref_codon)
-								gene_aa = str(Seq(gene_codon).translate())
-								if alt_aa == gene_aa: alt_aa_novel = False
-						elif ref_pos % 3 == 0:
-							codon_position = 3
-							ref_codon = gene_pos_to_allele[hg][gene][ref_pos - 2] + \
-										gene_pos_to_allele[hg][gene][ref_pos - 1] + ref_al
-							alt_codon = gene_pos_to_allele[hg][gene][ref_pos - 2] + \
-										gene_pos_to_allele[hg][gene][ref_pos - 1] + alt_al
-							ref_aa = str(Seq(ref_codon).translate())
-							alt_aa = str(Seq(alt_codon).translate())
-
-							for g in gene_pos_to_allele[hg]:
-								gene_codon = msa_pos_to_gene_allele[hg][g][msa_pos - 2] + \
-										   msa_pos_to_gene_allele[hg][g][msa_pos - 1] + \
-										   msa_pos_to_gene_allele[hg][g][msa_pos]
-								if g == gene:
-									assert(gene_codon == ref_codon)
-								gene_aa = str(Seq(gene_codon).translate())
-								if alt_aa == gene_aa: alt_aa_novel = False
+								frame_amino_acids.add(translate_codon(gene_codon))
+							hg_frame_amino_acids[(hg, msa_frame_start)] = frame_amino_acids
+						if alt_aa in hg_frame_amino_acids[(hg, msa_frame_start)]: alt_aa_novel = False
 
 						if ref_aa != alt_aa:
 							dn_or_ds = "non-synonymous"
@@ -2387,16 +2546,16 @@ def phase_and_id_snvs(input_args):
 						if site_major_allele_count == site_allele_coverage:
 							snv_is_major_allele = True
 
-						no_handle.write('\t'.join([str(x) for x in [gcf_id, pe_sample, hg, msa_pos,
+						no_handle.write(novel_snv_report_line % (gcf_id, pe_sample, hg, msa_pos,
 															round(site_total_coverage_standardized,3),
 															round(site_allele_coverage_standardized,3), snv_is_major_allele,
 															alt_al, codon_position, alt_codon, alt_aa, alt_aa_novel, dn_or_ds,
 															ts_or_tv, ref_al, sample, gene, ref_pos,
-															ref_codon, ref_aa, snv_support_count, snv_support_reads]]) + '\n')
+															ref_codon, ref_aa, snv_support_count, snv_support_reads))
 						all_snv_supporting_reads = all_snv_supporting_reads.union(set(snv_support_reads.split(', ')))
 
 		snv_support_fastq_file = snv_mining_outdir + pe_sample + '.snv_support.fastq'
-		snv_support_fastq_handle = open(snv_support_fastq_file, 'w')
+		snv_support_fastq_handle = open(snv_support_fastq_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
 		visited = set([])
 		for read_file in pe_sample_reads:
 			if read_file.endswith('.gz'):
@@ -2415,11 +2574,9 @@ def phase_and_id_snvs(input_args):
 
 			fastq_handle.close()
 
-		"""
-		for r in all_snv_supporting_reads:
-			if not r in visited:
-				print(pe_sample + '\t' + r)
-		"""
+		missing_snv_supporting_reads = all_snv_supporting_reads.difference(visited)
+		if logObject and len(missing_snv_supporting_reads) > 0:
+			logObject.info('%d reads supporting SNVs for sample %s were not found in its FASTQ files.' % (len(missing_snv_supporting_reads), pe_sample))
 		snv_support_fastq_handle.close()
 		os.system('gzip %s' % snv_support_fastq_file)
 		no_handle.close()
@@ -2444,31 +2601,36 @@ def snv_miner_single(input_args):
 		snvs_file = res_dir + sample + '.snvs'
 		result_file = res_dir + sample + '.txt'
 		details_file = res_dir + sample + '.full.txt'
-		snv_outf = open(snvs_file, 'w')
-		res_outf = open(result_file, 'w')
+		snv_outf = open(snvs_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
+		res_outf = open(result_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
 		det_outf = None
 		if debug_mode:
-			det_outf = open(details_file, 'w')
+			det_outf = open(details_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
 
 		res_outf.write('Contig,Position,Sample-A,Sample-C,Sample-G,Sample-T\n')
 
-		bam_handle = pysam.AlignmentFile(bam_alignment, 'rb')
+		bam_handle = pysam.AlignmentFile(bam_alignment, 'rb', threads=4)
 
 		topaligns_file = res_dir + sample + '_topaligns.bam'
 		topaligns_file_sorted = res_dir + sample + '_topaligns.sorted.bam'
-		topaligns_handle = pysam.AlignmentFile(topaligns_file, "wb", template=bam_handle)
+		topaligns_handle = pysam.AlignmentFile(topaligns_file, "wb", template=bam_handle, threads=2)
 
 		for hg, hg_genes in bgc_hg_genes.items():
 			read_ascpus_per_allele = defaultdict(list)
 			hg_genes_covered = 0
 			gene_sequence = {}
+			gene_sequence_upper = {}
+			gene_sequence_length = {}
 			total_reads = set([])
 			with open(ref_fasta) as opff:
-				for rec in SeqIO.parse(opff, 'fasta'):
-					if rec.id.split('|')[0] != hg: continue
-					_, allele_cluster, _, g = rec.id.split('|')
+				for rec_title, rec_seq in SimpleFastaParser(opff):
+					rec_id = rec_title.split(None, 1)[0]
+					if rec_id.split('|')[0] != hg: continue
+					_, allele_cluster, _, g = rec_id.split('|')
 					ginfo = comp_gene_info[g]
-					gene_sequence[g] = str(rec.seq)
+					gene_sequence[g] = rec_seq
+					gene_sequence_upper[g] = gene_sequence[g].upper()
+					gene_sequence_length[g] = len(gene_sequence[g])
 					gstart = ginfo['start']
 					gend = ginfo['end']
 
@@ -2477,7 +2639,7 @@ def snv_miner_single(input_args):
 					gene_covered_1 = 0
 
 					try:
-						for pileupcolumn in bam_handle.pileup(contig=rec.id, stepper="nofilter"):
+						for pileupcolumn in bam_handle.pileup(contig=rec_id, stepper="nofilter"):
 							pos_depth = 0
 							for pileupread in pileupcolumn.pileups:
 								if pileupread.is_del or pileupread.is_refskip: continue
@@ -2492,14 +2654,23 @@ def snv_miner_single(input_args):
 					gene_coverage_1 = gene_covered_1 / float(gene_length)
 					if gene_coverage_1 < 0.90: continue
 					hg_genes_covered += 1
-					#print('\t'.join([sample, hg, rec.id, str(gene_coverage_1), str(gene_coverage_3)]))
+					#print('\t'.join([sample, hg, rec_id, str(gene_coverage_1), str(gene_coverage_3)]))
 
-					for read_alignment in bam_handle.fetch(rec.id):
+					for read_alignment in bam_handle.fetch(rec_id):
 						read_name = read_alignment.query_name
 						total_reads.add(read_name)
 						read_ascore = read_alignment.tags[0][1]
 
-						read_ref_positions = set(read_alignment.get_reference_positions())
+						# use CIGAR/NM statistics to skip walking aligned pairs of alignments which cannot pass the filters
+						# applied downstream - their score is still retained since it can define the top score for the read.
+						cigar_counts = read_alignment.get_cigar_stats()[0]
+						aligned_bases = cigar_counts[0] + cigar_counts[7] + cigar_counts[8]
+						deleted_bases = cigar_counts[2] + cigar_counts[3]
+						mismatched_bases = max(cigar_counts[10] - cigar_counts[1] - cigar_counts[2], 0)
+						if deleted_bases > 5 or read_alignment.reference_length < 60 or aligned_bases == 0 or \
+								(aligned_bases - mismatched_bases) < 0.95*aligned_bases:
+							read_ascpus_per_allele[read_name].append([g, read_ascore, 0.0, 0, deleted_bases, read_alignment])
+							continue
 
 						first_real_alignment_pos = None
 						last_real_alignment_pos = None
@@ -2515,43 +2686,47 @@ def snv_miner_single(input_args):
 							else:
 								indel_positions.add(b[1])
 
-						main_alignment_positions = set(range(first_real_alignment_pos, last_real_alignment_pos + 1))
-						sum_indel_len = len(main_alignment_positions.intersection(indel_positions))
-						matching_percentage = float(len(matches))/float(len(main_alignment_positions))
+						main_alignment_length = last_real_alignment_pos - first_real_alignment_pos + 1
+						sum_indel_len = len([p for p in indel_positions if p != None and first_real_alignment_pos <= p <= last_real_alignment_pos])
+						matching_percentage = float(len(matches))/float(main_alignment_length)
 
-						read_ascpus_per_allele[read_name].append([g, read_ascore, matching_percentage, len(main_alignment_positions), sum_indel_len, read_alignment])
+						read_ascpus_per_allele[read_name].append([g, read_ascore, matching_percentage, main_alignment_length, sum_indel_len, read_alignment])
 
 			accounted_reads = set([])
-			hg_align_pos_alleles = defaultdict(lambda: defaultdict(set))
+			hg_align_pos_allele_counts = np.zeros((codon_alignment_lengths[hg]+1, 4), dtype=np.int32)
+			hg_align_pos_allele_reads = set([])
 			supported_snvs = defaultdict(lambda: defaultdict(set))
 			for read in read_ascpus_per_allele:
-				top_score = -1000000
-				score_sorted_alignments = sorted(read_ascpus_per_allele[read], key=itemgetter(1), reverse=True)
-				for i, align in enumerate(score_sorted_alignments):
-					if i == 0: top_score = align[1]
+				read_alignments = read_ascpus_per_allele[read]
+				top_score = max([align[1] for align in read_alignments])
+				for align in read_alignments:
 					if align[1] == top_score and ((align[2] >= 0.99 and align[3] >= 60) or (align[2] >= 0.95 and align[3] >= 100)) and align[4] <= 5:
 						read_alignment = align[-1]
 						topaligns_handle.write(read_alignment)
 
-						min_read_ref_pos = min(read_alignment.get_reference_positions())
-						read_referseq = read_alignment.get_reference_sequence().upper()
-						read_queryseq = read_alignment.query_sequence
+						read_queryseq = read_alignment.query_sequence.upper()
 						read_queryqua = read_alignment.query_qualities
+						align_gene_seq = gene_sequence_upper[align[0]]
+						align_gene_seq_len = gene_sequence_length[align[0]]
+						align_gene_msa_pos = gene_pos_to_msa_pos[hg][align[0]]
 
-						for b in read_alignment.get_aligned_pairs(with_seq=True):
-							if b[0] == None or b[1] == None: continue
+						# only aligned (non-indel) positions are needed and the reference allele is taken from the MD-based base
+						# reported alongside each position, rather than decoding the reference sequence of the read separately
+						for b in read_alignment.get_aligned_pairs(matches_only=True, with_seq=True):
 							ref_pos = b[1]+1
-							alt_al = read_queryseq[b[0]].upper()
-							ref_al = read_referseq[b[1] - min_read_ref_pos].upper()
-							assert (ref_al == str(gene_sequence[align[0]]).upper()[b[1]])
+							alt_al = read_queryseq[b[0]]
+							ref_al = b[2].upper()
+							assert (ref_al == align_gene_seq[b[1]])
 							if b[2] == 'n' or ref_al == 'N' or alt_al == 'N': continue
 							que_qual = read_queryqua[b[0]]
-							if (que_qual >= 30) and ((ref_pos+3) < len(gene_sequence[align[0]])):
-								cod_pos = gene_pos_to_msa_pos[hg][align[0]][ref_pos]
-								hg_align_pos_alleles[cod_pos][alt_al].add(read)
+							if (que_qual >= 30) and ((ref_pos+3) < align_gene_seq_len):
+								cod_pos = align_gene_msa_pos[ref_pos]
+								if alt_al in allele_index and not (cod_pos, alt_al, read) in hg_align_pos_allele_reads:
+									hg_align_pos_allele_reads.add((cod_pos, alt_al, read))
+									hg_align_pos_allele_counts[cod_pos, allele_index[alt_al]] += 1
 								accounted_reads.add(read)
 								if debug_mode:
-									det_outf.write('\t'.join([str(x) for x in [sample, hg, align[0], ref_pos, cod_pos, ref_al, alt_al, read, align[1], align[2], align[3], align[4]]]) + '\n')
+									det_outf.write('%s\t%s\t%s\t%d\t%d\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (sample, hg, align[0], ref_pos, cod_pos, ref_al, alt_al, read, align[1], align[2], align[3], align[4]))
 								if b[2].islower():
 									assert (alt_al != ref_al)
 									# because reads with at most 5 indel positions allowed above, a base might appear in the consensus/phased haplotypes
@@ -2560,11 +2735,9 @@ def snv_miner_single(input_args):
 										snv_id = str(read_alignment.reference_name) + '_|_' + str(ref_pos) + '_|_' + ref_al + '_|_' + alt_al
 										supported_snvs[snv_id][read].add(align[1])
 
-			for pos in range(1, codon_alignment_lengths[hg]+1):
-				printlist = [hg, str(pos)]
-				for al in ['A', 'C', 'G', 'T']:
-					printlist.append(str(len(hg_align_pos_alleles[pos][al])))
-				res_outf.write(','.join(printlist) + '\n')
+			for pos, (a_count, c_count, g_count, t_count) in enumerate(hg_align_pos_allele_counts.tolist()):
+				if pos == 0: continue
+				res_outf.write('%s,%d,%d,%d,%d,%d\n' % (hg, pos, a_count, c_count, g_count, t_count))
 
 			for snv in supported_snvs:
 				support_info = []
@@ -2581,8 +2754,9 @@ def snv_miner_single(input_args):
 		topaligns_handle.close()
 		bam_handle.close()
 
-		os.system("samtools sort -@ %d %s -o %s" % (1, topaligns_file, topaligns_file_sorted))
-		os.system("samtools index %s" % topaligns_file_sorted)
+		pysam.sort('-@', '4', '-m', '256M', '-o', topaligns_file_sorted, topaligns_file)
+		pysam.index('-@', '4', topaligns_file_sorted)
+		os.remove(topaligns_file)
 
 	except Exception as e:
 		if logObject:
@@ -2606,29 +2780,34 @@ def snv_miner_paired(input_args):
 		snvs_file = res_dir + sample + '.snvs'
 		result_file = res_dir + sample + '.txt'
 		details_file = res_dir + sample + '.full.txt'
-		snv_outf = open(snvs_file, 'w')
-		res_outf = open(result_file, 'w')
-		det_outf = open(details_file, 'w')
+		snv_outf = open(snvs_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
+		res_outf = open(result_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
+		det_outf = open(details_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
 
 		res_outf.write('Contig,Position,Sample-A,Sample-C,Sample-G,Sample-T\n')
 
-		bam_handle = pysam.AlignmentFile(bam_alignment, 'rb')
+		bam_handle = pysam.AlignmentFile(bam_alignment, 'rb', threads=4)
 
 		topaligns_file = res_dir + sample + '_topaligns.bam'
 		topaligns_file_sorted = res_dir + sample + '_topaligns.sorted.bam'
-		topaligns_handle = pysam.AlignmentFile(topaligns_file, "wb", template=bam_handle)
+		topaligns_handle = pysam.AlignmentFile(topaligns_file, "wb", template=bam_handle, threads=2)
 
 		for hg, hg_genes in bgc_hg_genes.items():
 			read_ascpus_per_allele = defaultdict(list)
 			hg_genes_covered = 0
 			gene_sequence = {}
+			gene_sequence_upper = {}
+			gene_sequence_length = {}
 			total_reads = set([])
 			with open(ref_fasta) as opff:
-				for rec in SeqIO.parse(opff, 'fasta'):
-					if rec.id.split('|')[0] != hg: continue
-					_, allele_cluster, _, g = rec.id.split('|')
+				for rec_title, rec_seq in SimpleFastaParser(opff):
+					rec_id = rec_title.split(None, 1)[0]
+					if rec_id.split('|')[0] != hg: continue
+					_, allele_cluster, _, g = rec_id.split('|')
 					ginfo = comp_gene_info[g]
-					gene_sequence[g] = str(rec.seq)
+					gene_sequence[g] = rec_seq
+					gene_sequence_upper[g] = gene_sequence[g].upper()
+					gene_sequence_length[g] = len(gene_sequence[g])
 					gstart = ginfo['start']
 					gend = ginfo['end']
 
@@ -2637,7 +2816,7 @@ def snv_miner_paired(input_args):
 					gene_covered_1 = 0
 
 					try:
-						for pileupcolumn in bam_handle.pileup(contig=rec.id, stepper="nofilter"):
+						for pileupcolumn in bam_handle.pileup(contig=rec_id, stepper="nofilter"):
 							pos_depth = 0
 							for pileupread in pileupcolumn.pileups:
 								if pileupread.is_del or pileupread.is_refskip: continue
@@ -2652,13 +2831,21 @@ def snv_miner_paired(input_args):
 					gene_coverage_1 = gene_covered_1 / float(gene_length)
 					if gene_coverage_1 < 0.90: continue
 					hg_genes_covered += 1
-					#print('\t'.join([sample, hg, rec.id, str(gene_coverage_1), str(gene_coverage_3)]))
+					#print('\t'.join([sample, hg, rec_id, str(gene_coverage_1), str(gene_coverage_3)]))
 
-					for read1_alignment, read2_alignment in util.read_pair_generator(bam_handle, rec.id, gene_length):
+					for read1_alignment, read2_alignment in util.read_pair_generator(bam_handle, rec_id, gene_length):
 						if read1_alignment and read2_alignment:
 							read_name = read1_alignment.query_name
 							total_reads.add(read_name)
 							combined_ascore = read1_alignment.tags[0][1] + read2_alignment.tags[0][1]
+
+							# mates with deletions along their reference span cannot pass the filters applied downstream, so
+							# avoid walking their aligned pairs - their score is still retained since it can define the top score.
+							read1_cigar_counts = read1_alignment.get_cigar_stats()[0]
+							read2_cigar_counts = read2_alignment.get_cigar_stats()[0]
+							if (read1_cigar_counts[2] + read1_cigar_counts[3]) > 0 or (read2_cigar_counts[2] + read2_cigar_counts[3]) > 0:
+								read_ascpus_per_allele[read_name].append([g, combined_ascore, 0.0, 0, True, 1.0, 1.0, [read1_alignment, read2_alignment]])
+								continue
 							read1_ref_positions = set(read1_alignment.get_reference_positions())
 							read2_ref_positions = set(read2_alignment.get_reference_positions())
 
@@ -2749,57 +2936,57 @@ def snv_miner_paired(input_args):
 										matches.add(b[1])
 								else:
 									indel_positions.add(b[1])
-							main_alignment_positions = set(range(first_real_alignment_pos, last_real_alignment_pos + 1))
-							has_indel = len(main_alignment_positions.intersection(indel_positions)) > 0
+							main_alignment_length = last_real_alignment_pos - first_real_alignment_pos + 1
+							has_indel = any(p != None and first_real_alignment_pos <= p <= last_real_alignment_pos for p in indel_positions)
 
 							read_length = len(set(read_alignment.get_reference_positions()))
-							matching_percentage = float(len(matches))/float(len(main_alignment_positions))
+							matching_percentage = float(len(matches))/float(main_alignment_length)
 
 							# 0 added just to signify that it is a single mate contributing to the paired end combined ascore
 							combined_ascore = 0 + read_alignment.tags[0][1]
 
-							read_ascpus_per_allele[read_name].append([g, combined_ascore, matching_percentage, len(main_alignment_positions), has_indel, 0.0, 0.0, [read_alignment]])
+							read_ascpus_per_allele[read_name].append([g, combined_ascore, matching_percentage, main_alignment_length, has_indel, 0.0, 0.0, [read_alignment]])
 
 			accounted_reads = set([])
-			hg_align_pos_alleles = defaultdict(lambda: defaultdict(set))
+			hg_align_pos_allele_counts = np.zeros((codon_alignment_lengths[hg]+1, 4), dtype=np.int32)
+			hg_align_pos_allele_reads = set([])
 			supported_snvs = defaultdict(lambda: defaultdict(set))
 			for read in read_ascpus_per_allele:
-				top_score = -1000000
-				score_sorted_alignments = sorted(read_ascpus_per_allele[read], key=itemgetter(1), reverse=True)
-				for i, align in enumerate(score_sorted_alignments):
-					if i == 0: top_score = align[1]
+				read_alignments = read_ascpus_per_allele[read]
+				top_score = max([align[1] for align in read_alignments])
+				for align in read_alignments:
 					if align[1] == top_score and ((align[2] >= 0.99 and align[3] >= 100) or (align[2] >= 0.95 and align[3] >= 180)) and align[4] == False and align[5] < 0.02: # and align[6] < 0.25:
 						for read_alignment in align[-1]:
 							topaligns_handle.write(read_alignment)
 
-							min_read_ref_pos = min(read_alignment.get_reference_positions())
-							read_referseq = read_alignment.get_reference_sequence().upper()
-							read_queryseq = read_alignment.query_sequence
+							read_queryseq = read_alignment.query_sequence.upper()
 							read_queryqua = read_alignment.query_qualities
+							align_gene_seq = gene_sequence_upper[align[0]]
+							align_gene_seq_len = gene_sequence_length[align[0]]
+							align_gene_msa_pos = gene_pos_to_msa_pos[hg][align[0]]
 
-							for b in read_alignment.get_aligned_pairs(with_seq=True):
-								if b[0] == None or b[1] == None: continue
+							for b in read_alignment.get_aligned_pairs(matches_only=True, with_seq=True):
 								ref_pos = b[1]+1
-								alt_al = read_queryseq[b[0]].upper()
-								ref_al = read_referseq[b[1] - min_read_ref_pos].upper()
-								assert (ref_al == str(gene_sequence[align[0]]).upper()[b[1]])
+								alt_al = read_queryseq[b[0]]
+								ref_al = b[2].upper()
+								assert (ref_al == align_gene_seq[b[1]])
 								if b[2] == 'n' or ref_al == 'N' or alt_al == 'N': continue
 								que_qual = read_queryqua[b[0]]
-								if (que_qual >= 30) and ((ref_pos+3) < len(gene_sequence[align[0]])):
-									cod_pos = gene_pos_to_msa_pos[hg][align[0]][ref_pos]
-									hg_align_pos_alleles[cod_pos][alt_al].add(read)
+								if (que_qual >= 30) and ((ref_pos+3) < align_gene_seq_len):
+									cod_pos = align_gene_msa_pos[ref_pos]
+									if alt_al in allele_index and not (cod_pos, alt_al, read) in hg_align_pos_allele_reads:
+										hg_align_pos_allele_reads.add((cod_pos, alt_al, read))
+										hg_align_pos_allele_counts[cod_pos, allele_index[alt_al]] += 1
 									accounted_reads.add(read)
-									det_outf.write('\t'.join([str(x) for x in [sample, hg, align[0], ref_pos, cod_pos, ref_al, alt_al, read, align[1], align[2], align[3], align[4]]]) + '\n')
+									det_outf.write('%s\t%s\t%s\t%d\t%d\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (sample, hg, align[0], ref_pos, cod_pos, ref_al, alt_al, read, align[1], align[2], align[3], align[4]))
 									if b[2].islower():
 										assert (alt_al != ref_al)
 										snv_id = str(read_alignment.reference_name) + '_|_' + str(ref_pos) + '_|_' + ref_al + '_|_' + alt_al
 										supported_snvs[snv_id][read].add(align[1])
 
-			for pos in range(1, codon_alignment_lengths[hg]+1):
-				printlist = [hg, str(pos)]
-				for al in ['A', 'C', 'G', 'T']:
-					printlist.append(str(len(hg_align_pos_alleles[pos][al])))
-				res_outf.write(','.join(printlist) + '\n')
+			for pos, (a_count, c_count, g_count, t_count) in enumerate(hg_align_pos_allele_counts.tolist()):
+				if pos == 0: continue
+				res_outf.write('%s,%d,%d,%d,%d,%d\n' % (hg, pos, a_count, c_count, g_count, t_count))
 
 			for snv in supported_snvs:
 				support_info = []
@@ -2815,8 +3002,9 @@ def snv_miner_paired(input_args):
 		topaligns_handle.close()
 		bam_handle.close()
 
-		os.system("samtools sort -@ %d %s -o %s" % (1, topaligns_file, topaligns_file_sorted))
-		os.system("samtools index %s" % topaligns_file_sorted)
+		pysam.sort('-@', '4', '-m', '256M', '-o', topaligns_file_sorted, topaligns_file)
+		pysam.index('-@', '4', topaligns_file_sorted)
+		os.remove(topaligns_file)
 
 	except Exception as e:
 		if logObject:
@@ -2824,6 +3012,19 @@ def snv_miner_paired(input_args):
 			logObject.error(traceback.format_exc())
 		raise RuntimeError(traceback.format_exc())
 
+# data shared by the population genetics analyses of all homolog groups, set once in each worker process
+popgen_worker_data = {}
+
+def init_popgen_worker(worker_data):
+	"""
+	Initializer of the worker processes used by the runPopulationGeneticsAnalysis() function, which stores the data
+	shared by all homolog groups at module scope.
+
+	:param worker_data: dictionary of data shared by all homolog groups.
+	"""
+	global popgen_worker_data
+	popgen_worker_data = worker_data
+
 def popgen_analysis_of_hg(inputs):
 	"""
 	Helper function which is to be called from the runPopulationGeneticsAnalysis() function to parallelize population
@@ -2832,31 +3033,38 @@ def popgen_analysis_of_hg(inputs):
 	:param inputs: list of inputs passed in by GCF.runPopulationGeneticsAnalysis().
 	"""
 
-	gcf_id, gcf_annot, hg, codon_alignment_fasta, popgen_dir, plots_dir, comp_gene_info, hg_genes, bgc_sample, hg_prop_multi_copy, hg_order_scpus, gw_pairwise_similarities, comparem_used, sample_population, population, species_phylogeny, sample_size, logObject = inputs
+	gcf_id, gcf_annot, hg, codon_alignment_fasta, popgen_dir, plots_dir, comparem_used, population, species_phylogeny, sample_size, logObject = inputs
+	comp_gene_info = popgen_worker_data['comp_gene_info']
+	total_bgc_samples = popgen_worker_data['total_bgc_samples']
+	hg_prop_multi_copy = popgen_worker_data['hg_prop_multi_copy']
+	hg_order_scpus = popgen_worker_data['hg_order_scpus']
+	gw_pairwise_similarities = popgen_worker_data['gw_pairwise_similarities']
+	sample_population = popgen_worker_data['sample_population']
+	population_counts = popgen_worker_data['population_counts']
+	population_samples = popgen_worker_data['population_samples']
 
 	domain_plot_file = plots_dir + hg + '_domain.txt'
 	position_plot_file = plots_dir + hg + '_position.txt'
 	plot_pdf_file = plots_dir + hg + '.pdf'
 
-	domain_plot_handle = open(domain_plot_file, 'w')
-	position_plot_handle = open(position_plot_file, 'w')
-
 	seqs = []
 	samples_ordered = []
 	genes_ordered = []
-	bgc_codons = defaultdict(list)
+	bgc_codons = {}
 	num_codons = None
 	samples = set([])
 	gene_lengths = []
-	gene_locs = defaultdict(dict)
-	core_counts = defaultdict(int)
+	gene_locs = {}
+	core_counts = Counter()
 	products = set([])
 	sample_leaf_names = defaultdict(list)
+	alignment_records = []
 	updated_codon_alignment_fasta = popgen_dir + codon_alignment_fasta.split('/')[-1]
-	updated_codon_alignment_handle = open(updated_codon_alignment_fasta, 'w')
+	updated_codon_alignment_lines = []
 	with open(codon_alignment_fasta) as ocaf:
-		for rec in SeqIO.parse(ocaf, 'fasta'):
-			sample_id, gene_id = rec.id.split('|')
+		for rec_title, rec_seq in SimpleFastaParser(ocaf):
+			rec_id = rec_title.split(None, 1)[0]
+			sample_id, gene_id = rec_id.split('|')
 			if sample_population != None and population != None and population != sample_population[sample_id]: continue
 			if len(gene_id.split('_')[0]) == 3:
 				if not comp_gene_info[gene_id]['is_expansion_bgc']:
@@ -2864,26 +3072,29 @@ def popgen_analysis_of_hg(inputs):
 						core_counts['core'] += 1
 					else:
 						core_counts['auxiliary'] += 1
-			updated_codon_alignment_handle.write('>' + rec.description + '\n' + str(rec.seq) + '\n')
+			updated_codon_alignment_lines.extend(['>', rec_title, '\n', rec_seq, '\n'])
 			products.add(comp_gene_info[gene_id]['product'])
-			real_pos = 1
-			seq = str(rec.seq).upper().replace('N', '-')
+			seq = rec_seq.translate(upper_n_to_gap)
 			#seqlen = len(seq)
 			#gapless_seqlen = len(b for b in seqlen if b != '-')
-			sample_leaf_names[sample_id].append(rec.id)
-			seqs.append(list(seq))
-			codons = [str(rec.seq)[i:i + 3] for i in range(0, len(str(rec.seq)), 3)]
-			num_codons = len(codons)
-			bgc_codons[rec.id] = codons
+			sample_leaf_names[sample_id].append(rec_id)
+			seqs.append(seq)
+			rec_seq_bytes = rec_seq.encode()
+			rec_seq_array = np.frombuffer(rec_seq_bytes, dtype=np.uint8)
+			alignment_records.append((rec_id, rec_seq_array))
+			# codons are kept as the raw alignment bytes, with any partial trailing codon padded out as a gap
+			if len(rec_seq_bytes) % 3 != 0:
+				rec_seq_bytes += b'-' * (3 - (len(rec_seq_bytes) % 3))
+			num_codons = len(rec_seq_bytes) // 3
+			bgc_codons[rec_id] = rec_seq_bytes
 			samples.add(sample_id)
 			samples_ordered.append(sample_id)
 			genes_ordered.append(gene_id)
-			for msa_pos, bp in enumerate(str(rec.seq)):
-				if bp != '-':
-					gene_locs[gene_id][real_pos] = msa_pos + 1
-					real_pos += 1
-			gene_lengths.append(len(str(rec.seq).replace('-', '')))
-	updated_codon_alignment_handle.close()
+			# MSA positions (1-based) of each non-gap residue, indexed by 0-based position along the gene
+			gene_locs[gene_id] = (np.flatnonzero(rec_seq_array != ord('-')) + 1).astype(np.int32)
+			gene_lengths.append(len(gene_locs[gene_id]))
+	with open(updated_codon_alignment_fasta, 'w', buffering=OUTPUT_BUFFER_SIZE) as updated_codon_alignment_handle:
+		updated_codon_alignment_handle.writelines(updated_codon_alignment_lines)
 	codon_alignment_fasta = updated_codon_alignment_fasta
 
 	if len(seqs) == 0: return
@@ -2897,76 +3108,88 @@ def popgen_analysis_of_hg(inputs):
 	if comparem_used != None:
 		if gw_pairwise_similarities:
 			beta_rd_stats = []
-			hg_pairwise_similarities = util.determineSeqSimCodonAlignment(codon_alignment_fasta, use_translation=comparem_used)
-			for i, s1 in enumerate(sorted(samples)):
-				for j, s2 in enumerate(sorted(samples)):
-					if i >= j: continue
-					if s1 in hg_pairwise_similarities and s2 in hg_pairwise_similarities:
-						hg_seq_sim = hg_pairwise_similarities[s1][s2]
-						gw_seq_sim = gw_pairwise_similarities[s1][s2]
-						if gw_seq_sim != 0.0:
-							beta_rd = hg_seq_sim / float(gw_seq_sim)
-							beta_rd_stats.append(beta_rd)
+			hg_pairwise_similarities = util.determineSeqSimCodonAlignment(codon_alignment_fasta, use_translation=comparem_used,
+																		  codon_alignment_records=[(rec_id, rec_seq_array.tobytes().decode()) for rec_id, rec_seq_array in alignment_records])
+			# only pairs of samples which both have similarities for the homolog group are compared, visited in the
+			# same sorted order as before
+			compared_samples = [s for s in sorted(samples) if s in hg_pairwise_similarities]
+			for s1, s2 in itertools.combinations(compared_samples, 2):
+				hg_seq_sim = hg_pairwise_similarities[s1][s2]
+				gw_seq_sim = gw_pairwise_similarities[s1][s2]
+				if gw_seq_sim != 0.0:
+					beta_rd = hg_seq_sim / float(gw_seq_sim)
+					beta_rd_stats.append(beta_rd)
 			if len(beta_rd_stats) >= 1:
 				median_beta_rd = round(statistics.median(beta_rd_stats), 2)
 				max_beta_rd = round(max(beta_rd_stats), 2)
 
 	is_core = False
-	if (sum(core_counts.values()) > 0.0):
-		if (float(core_counts['core']) / sum(core_counts.values()) >= 0.5):
+	total_core_counts = sum(core_counts.values())
+	if (total_core_counts > 0.0):
+		if (float(core_counts['core']) / total_core_counts >= 0.5):
 			is_core = True
 
 	median_gene_length = statistics.median(gene_lengths)
 
-	variable_sites = set([])
-	conserved_sites = set([])
-	nondominant_sites  =  set([])
-	position_plot_handle.write('\t'.join(['pos', 'num_seqs', 'num_alleles', 'num_gaps', 'maj_allele_freq']) + '\n')
-
 	# TODO: consider out-souring filtering to use phykit
-	sample_differences_to_consensus = defaultdict(lambda: defaultdict(int))
-	ambiguous_sites = 0
-	nonambiguous_sites = 0
-	ambiguous_sites_pos = set([])
-	for i, ls in enumerate(zip(*seqs)):
-		al_counts = defaultdict(int)
-		for al in ls:
-			al_counts[al] += 1
-		maj_allele_count = 0
-		if not (len(al_counts) == 1 and '-' in al_counts):
-			maj_allele_count = max([al_counts[al] for al in al_counts if al != '-'])
-		tot_count = sum(al_counts.values())
-		num_alleles = len(al_counts.keys())
-		num_gaps = al_counts['-']
-		if num_gaps > 0:
-			num_alleles -= 1
-		gap_allele_freq = float(num_gaps) / tot_count
-		maj_allele_freq = 0.0
-		if float(tot_count-num_gaps) > 0.0:
-			maj_allele_freq = float(maj_allele_count) / float(tot_count-num_gaps)
-		position_plot_handle.write('\t'.join([str(x) for x in [i + 1, tot_count, num_alleles, num_gaps, maj_allele_freq]]) + '\n')
-		if gap_allele_freq < 0.10:
-			if maj_allele_freq >= 0.95:
-				conserved_sites.add(i)
-			else:
-				variable_sites.add(i)
-			if maj_allele_freq < 0.75:
-				nondominant_sites.add(i)
-			nonambiguous_sites += 1
-		else:
-			ambiguous_sites += 1
-			ambiguous_sites_pos.add(i+1)
-		maj_allele_count = max(al_counts.values())
-		maj_alleles = set([a[0] for a in al_counts.items() if maj_allele_count == a[1]])
-		maj_allele = sorted(list(maj_alleles))[0]
-		for j, al in enumerate(ls):
-			sid = samples_ordered[j]
-			gid = genes_ordered[j]
-			if al != maj_allele:
-				sample_differences_to_consensus[sid][gid] += 1
-			else:
-				sample_differences_to_consensus[sid][gid] += 0
-	position_plot_handle.close()
+
+	# allele counts are tallied for all sites at once from a (sequences x sites) byte matrix of the alignment, with one
+	# column per distinct byte found in the alignment. These are sorted, so ties for the consensus allele go to the
+	# smallest, as when sorting alleles.
+	num_sites = min([len(sq) for sq in seqs])
+	tot_count = len(seqs)
+	alignment_matrix = np.array([np.frombuffer(sq[:num_sites].encode(), dtype=np.uint8) for sq in seqs]).reshape(tot_count, num_sites)
+	alleles = np.unique(alignment_matrix)
+	site_allele_counts = np.zeros((num_sites, len(alleles)), dtype=np.int64)
+	for ai, allele in enumerate(alleles.tolist()):
+		site_allele_counts[:, ai] = np.count_nonzero(alignment_matrix == allele, axis=0)
+
+	gap_allele = alleles == ord('-')
+	num_gaps = site_allele_counts[:, gap_allele].sum(axis=1)
+	num_alleles = np.count_nonzero(site_allele_counts, axis=1) - (num_gaps > 0)
+	maj_allele_counts = np.zeros(num_sites, dtype=np.int64)
+	if (~gap_allele).any():
+		maj_allele_counts = site_allele_counts[:, ~gap_allele].max(axis=1)
+	nongap_counts = tot_count - num_gaps
+	maj_allele_freqs = np.divide(maj_allele_counts, nongap_counts, out=np.zeros(num_sites), where=nongap_counts > 0)
+	gap_allele_freqs = num_gaps / float(tot_count)
+
+	nonambiguous_site_mask = gap_allele_freqs < 0.10
+	conserved_sites = set(np.flatnonzero(nonambiguous_site_mask & (maj_allele_freqs >= 0.95)).tolist())
+	variable_sites = set(np.flatnonzero(nonambiguous_site_mask & (maj_allele_freqs < 0.95)).tolist())
+	nondominant_sites = set(np.flatnonzero(nonambiguous_site_mask & (maj_allele_freqs < 0.75)).tolist())
+	nonambiguous_sites = int(np.count_nonzero(nonambiguous_site_mask))
+	ambiguous_sites = num_sites - nonambiguous_sites
+
+	position_plot_lines = ['\t'.join(['pos', 'num_seqs', 'num_alleles', 'num_gaps', 'maj_allele_freq']) + '\n']
+	for i, site_num_alleles, site_num_gaps, maj_allele_freq in zip(range(num_sites), num_alleles.tolist(), num_gaps.tolist(), maj_allele_freqs.tolist()):
+		position_plot_lines.append('\t'.join([str(x) for x in [i + 1, tot_count, site_num_alleles, site_num_gaps, maj_allele_freq]]) + '\n')
+
+	# count differences of each sequence to the consensus across all sites at once.
+	consensus_array = alleles[site_allele_counts.argmax(axis=1)] if num_sites > 0 else np.zeros(0, dtype=np.uint8)
+	seq_differences_to_consensus = np.count_nonzero(alignment_matrix != consensus_array, axis=1)
+
+	# differences are summed per gene into a padded (samples x max genes per sample) matrix, where each sample has a
+	# row and each of its genes a column, in the order they are first encountered in the alignment.
+	consensus_sample_index = {}
+	sample_gene_index = defaultdict(dict)
+	seq_rows = np.zeros(tot_count, dtype=np.int64)
+	seq_cols = np.zeros(tot_count, dtype=np.int64)
+	for j, (sample, gene) in enumerate(zip(samples_ordered, genes_ordered)):
+		if not sample in consensus_sample_index:
+			consensus_sample_index[sample] = len(consensus_sample_index)
+		gene_index = sample_gene_index[sample]
+		if not gene in gene_index:
+			gene_index[gene] = len(gene_index)
+		seq_rows[j] = consensus_sample_index[sample]
+		seq_cols[j] = gene_index[gene]
+	consensus_samples = list(consensus_sample_index.keys())
+	sample_gene_counts = np.array([len(sample_gene_index[s]) for s in consensus_samples], dtype=np.int64)
+	sample_gene_diff_matrix = np.zeros((len(consensus_samples), int(sample_gene_counts.max())))
+	np.add.at(sample_gene_diff_matrix, (seq_rows, seq_cols), seq_differences_to_consensus)
+	sample_gene_diff_matrix[np.arange(sample_gene_diff_matrix.shape[1])[None, :] >= sample_gene_counts[:, None]] = np.inf
+	with open(position_plot_file, 'w', buffering=OUTPUT_BUFFER_SIZE) as position_plot_handle:
+		position_plot_handle.write(''.join(position_plot_lines))
 
 	ambiguous_prop = float(ambiguous_sites)/float(ambiguous_sites + nonambiguous_sites)
 
@@ -2974,7 +3197,7 @@ def popgen_analysis_of_hg(inputs):
 	domain_positions_msa = defaultdict(set)
 	domain_min_position_msa = defaultdict(lambda: 1e8)
 	all_domains = set([])
-	domain_plot_handle.write('\t'.join(['domain', 'domain_index', 'min_pos', 'max_pos']) + '\n')
+	domain_plot_lines = ['\t'.join(['domain', 'domain_index', 'min_pos', 'max_pos']) + '\n']
 
 	issue_with_domain_coords = False
 	at_least_one_gene_is_multi_part = False
@@ -3011,47 +3234,37 @@ def popgen_analysis_of_hg(inputs):
 			except:
 				issue_with_domain_coords = True
 			relative_end = min([len(gene_locs[gene]), domain_end - gene_start])
-			domain_range = range(relative_start, relative_end)
-			for pos in domain_range:
-				msa_pos = gene_locs[gene][pos + 1]
-				if domain_info['type'] == 'PFAM_domain':
-					domain_positions_msa[domain_name].add(msa_pos)
-					if domain_min_position_msa[domain_name] > msa_pos:
-						domain_min_position_msa[domain_name] = msa_pos
+			# MSA positions of the gene increase along the gene, so the first position of the domain is its minimum
+			msa_positions = gene_locs[gene][relative_start:relative_end]
+			if domain_info['type'] == 'PFAM_domain' and len(msa_positions) > 0:
+				domain_positions_msa[domain_name].update(msa_positions.tolist())
+				if domain_min_position_msa[domain_name] > msa_positions[0]:
+					domain_min_position_msa[domain_name] = int(msa_positions[0])
 			all_domains.add(domain_info['type'] + '_|_' + domain_info['aSDomain'] + '_|_' + domain_info['description'])
 
 	if not at_least_one_domain_is_multi_part and not at_least_one_gene_is_multi_part:
 		if issue_with_domain_coords:
 			raise RuntimeError("Issue with fitting domain coordinates to gene coordinates")
 		for i, dom in enumerate(sorted(domain_min_position_msa.items(), key=itemgetter(1))):
-			tmp = []
-			old_pos = None
-			for j, pos in enumerate(sorted(domain_positions_msa[dom[0]])):
-				if j == 0:
-					old_pos = pos - 1
-				if pos - 1 != old_pos:
-					if len(tmp) > 0:
-						min_pos = min(tmp)
-						max_pos = max(tmp)
-						domain_plot_handle.write('\t'.join([str(x) for x in [dom[0], i, min_pos, max_pos]]) + '\n')
-					tmp = []
-				tmp.append(pos)
-				old_pos = pos
-			if len(tmp) > 0:
-				min_pos = min(tmp)
-				max_pos = max(tmp)
-				domain_plot_handle.write('\t'.join([str(x) for x in [dom[0], i, min_pos, max_pos]]) + '\n')
-
-	domain_plot_handle.close()
+			# run-length encode the sorted MSA positions of the domain into contiguous ranges
+			positions = np.sort(np.fromiter(domain_positions_msa[dom[0]], dtype=np.int32))
+			if len(positions) == 0: continue
+			breaks = np.flatnonzero(np.diff(positions) != 1)
+			range_starts = positions[np.r_[0, breaks + 1]]
+			range_ends = positions[np.r_[breaks, len(positions) - 1]]
+			for min_pos, max_pos in zip(range_starts.tolist(), range_ends.tolist()):
+				domain_plot_lines.append('\t'.join([str(x) for x in [dom[0], i, min_pos, max_pos]]) + '\n')
+
+	with open(domain_plot_file, 'w', buffering=OUTPUT_BUFFER_SIZE) as domain_plot_handle:
+		domain_plot_handle.write(''.join(domain_plot_lines))
 
 	rscript_plot_cmd = ["Rscript", RSCRIPT_FOR_CLUSTER_ASSESSMENT_PLOTTING, domain_plot_file, position_plot_file,
 						plot_pdf_file]
 	if logObject:
 		logObject.info('Running R-based plotting with the following command: %s' % ' '.join(rscript_plot_cmd))
 	try:
-		subprocess.call(' '.join(rscript_plot_cmd), shell=True, stdout=subprocess.DEVNULL,
-						stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		subprocess.call(rscript_plot_cmd, stdout=subprocess.DEVNULL,
+						stderr=subprocess.DEVNULL)
 		if logObject:
 			logObject.info('Successfully ran: %s' % ' '.join(rscript_plot_cmd))
 	except Exception as e:
@@ -3062,66 +3275,48 @@ def popgen_analysis_of_hg(inputs):
 
 	#### Perform population genetics analyses, including dN/dS calculation and Tajima's D calculation
 
+	# the records written to the updated codon alignment are revisited from memory, with positions beyond the
+	# shortest sequence (and thus beyond the sites assessed above) regarded as non-ambiguous.
 	high_ambiguity_sequences = set([])
-	with open(codon_alignment_fasta) as ocaf:
-		for rec in SeqIO.parse(ocaf, 'fasta'):
-			if sample_population != None and population != None and population != sample_population[sample_id]: continue
-			total_nonambiguous_positions = 0
-			gap_nonambiguous_positions = 0
-			for msa_pos, bp in enumerate(str(rec.seq)):
-				if not (msa_pos+1) in ambiguous_sites_pos:
-					total_nonambiguous_positions += 1
-					if bp == '-':
-						gap_nonambiguous_positions += 1
-			if total_nonambiguous_positions > 0:
-				seq_ambiguous_prop = float(gap_nonambiguous_positions)/float(total_nonambiguous_positions)
-				if seq_ambiguous_prop >= 0.25:
-					high_ambiguity_sequences.add(rec.id)
-			else:
-				high_ambiguity_sequences.add(rec.id)
+	for rec_id, rec_seq_array in alignment_records:
+		if sample_population != None and population != None and population != sample_population[sample_id]: continue
+		nonambiguous_positions = np.ones(len(rec_seq_array), dtype=bool)
+		nonambiguous_positions[:num_sites] = nonambiguous_site_mask
+		total_nonambiguous_positions = int(np.count_nonzero(nonambiguous_positions))
+		gap_nonambiguous_positions = int(np.count_nonzero(nonambiguous_positions & (rec_seq_array == ord('-'))))
+		if total_nonambiguous_positions > 0:
+			seq_ambiguous_prop = float(gap_nonambiguous_positions)/float(total_nonambiguous_positions)
+			if seq_ambiguous_prop >= 0.25:
+				high_ambiguity_sequences.add(rec_id)
+		else:
+			high_ambiguity_sequences.add(rec_id)
 
+	# retain codon sites which are variable and have less than 10% gapped/ambiguous codons, determined for all sites at
+	# once from a (sequences x codons x 3) byte matrix of the alignment.
 	sequences_filtered = defaultdict(lambda: '')
-	for cod_index in range(0, num_codons):
-		cod_count = defaultdict(int)
-		for bgc in bgc_codons:
-			if bgc in high_ambiguity_sequences: continue
-			cod = bgc_codons[bgc][cod_index].replace('N', '-')
-			if not '-' in cod:
-				cod_count[cod] += 1
-
-		#singleton_codons = set([])
-		#for cod in cod_count:
-		#	if cod_count[cod] == 1: singleton_codons.add(cod)
-
-		aa_count = defaultdict(int)
-		cod_count = defaultdict(int)
-		cods = set([])
-		for bgc in bgc_codons:
-			if bgc in high_ambiguity_sequences: continue
-			cod = bgc_codons[bgc][cod_index].replace('N', '-')
-			if '-' in cod: cod = '---'
-			aa = None
-			if '-' in cod: aa = '-'
-			else: cod_obj = Seq(cod); aa = str(cod_obj.translate())
-			cods.add(cod)
-			cod_count[cod] += 1
-			aa_count[aa] += 1
-		if len(cod_count) > 0:
-			major_codon_count = max(cod_count.values())
-			#major_codon_freq = float(major_codon_count) / float(sum(cod_count.values()))
-			gap_residue_freq = float(aa_count['-']) / float(sum(aa_count.values()))
-			if ((len(cod_count) >= 3) or (len(cod_count) >= 2 and gap_residue_freq == 0.0)) and gap_residue_freq < 0.1:
-				for bgc in bgc_codons:
-					if bgc in high_ambiguity_sequences: continue
-					cod = bgc_codons[bgc][cod_index].replace('N', '-')
-					if '-' in cod: cod = '---'
-					sequences_filtered[bgc] += cod
-
+	retained_bgcs = [bgc for bgc in bgc_codons if not bgc in high_ambiguity_sequences]
+	if len(retained_bgcs) > 0 and num_codons > 0:
+		codon_bases = np.frombuffer(b''.join([bgc_codons[bgc] for bgc in retained_bgcs]), dtype=np.uint8)
+		codon_bases = codon_bases.reshape(len(retained_bgcs), num_codons, 3).copy()
+		gap_matrix = gap_base_lut[codon_bases].any(axis=2)
+		codon_bases[gap_matrix] = ord('-')
+		codon_ids = (codon_bases[:, :, 0].astype(np.int32) << 16) | (codon_bases[:, :, 1].astype(np.int32) << 8) | codon_bases[:, :, 2]
+		distinct_codons = 1 + np.count_nonzero(np.diff(np.sort(codon_ids, axis=0), axis=0), axis=0)
+		gap_residue_freqs = gap_matrix.sum(axis=0) / float(len(retained_bgcs))
+		retained_sites = ((distinct_codons >= 3) | ((distinct_codons >= 2) & (gap_residue_freqs == 0.0))) & (gap_residue_freqs < 0.1)
+		if retained_sites.any():
+			retained_codon_bases = codon_bases[:, retained_sites, :]
+			for bi, bgc in enumerate(retained_bgcs):
+				sequences_filtered[bgc] = retained_codon_bases[bi].tobytes().decode('ascii')
+
+	filtered_sequence_length = 0
+	if len(sequences_filtered) > 0:
+		filtered_sequence_length = len(next(iter(sequences_filtered.values())))
 
 	median_dnds = "NA"
 	mad_dnds = "NA"
 	tajimas_d = "NA"
-	if len(sequences_filtered) >= 4 and len(list(sequences_filtered.values())[0]) >= 21:
+	if len(sequences_filtered) >= 4 and filtered_sequence_length >= 21:
 		if species_phylogeny:
 			pass
 			"""
@@ -3135,9 +3330,11 @@ def popgen_analysis_of_hg(inputs):
 
 
 			all_median_dnds = []
-			for iter in range(0, 20):
-				combos = list(itertools.combinations(list(sequences_filtered.values()), 2))
-				random.Random(iter).shuffle(combos)
+			# pairs are enumerated once and each iteration shuffles a fresh copy of them
+			all_combos = list(itertools.combinations(list(sequences_filtered.values()), 2))
+			for boot_i in range(0, 20):
+				combos = list(all_combos)
+				random.Random(boot_i).shuffle(combos)
 
 				all_dNdS = []
 				for i, pair in enumerate(combos):
@@ -3167,7 +3364,7 @@ def popgen_analysis_of_hg(inputs):
 		if tajimas_d != '< 3 segregating sites':
 			tajimas_d = round(tajimas_d, 2)
 
-	prop_samples_with_hg = len(samples) / float(len(set(bgc_sample.values())))
+	prop_samples_with_hg = len(samples) / float(total_bgc_samples)
 	prop_conserved = "NA"
 	prop_majallele_nondominant = "NA"
 	if (len(conserved_sites) + len(variable_sites)) > 0:
@@ -3190,34 +3387,33 @@ def popgen_analysis_of_hg(inputs):
 				round(ambiguous_prop,2), tajimas_d, prop_conserved, prop_majallele_nondominant, median_beta_rd,
 				max_beta_rd, median_dnds, mad_dnds]
 
-	hg_consim_handle = open(popgen_dir + hg + '_sim_to_consensus.txt', 'w')
-	for s in sample_differences_to_consensus:
-		min_diff_to_consensus = 1e100
-		for g in sample_differences_to_consensus[s]:
-			if min_diff_to_consensus > sample_differences_to_consensus[s][g]:
-				min_diff_to_consensus = sample_differences_to_consensus[s][g]
+	# minimum difference to consensus across the gene instances of each sample, computed once as a row-wise minimum
+	# over the padded (samples x max genes per sample) matrix.
+	sample_min_diffs_to_consensus = sample_gene_diff_matrix.min(axis=1).tolist()
+
+	consim_lines = []
+	alignment_length = float(len(seqs[0]))
+	for si, s in enumerate(consensus_samples):
+		min_diff_to_consensus = sample_min_diffs_to_consensus[si]
 		if min_diff_to_consensus < 1e100:
-			hg_consim_handle.write(hg + '\t' + s + '\t' + str(min_diff_to_consensus / float(len(seqs[0]))) + '\n')
-	hg_consim_handle.close()
+			consim_lines.append(hg + '\t' + s + '\t' + str(min_diff_to_consensus / alignment_length) + '\n')
+	with open(popgen_dir + hg + '_sim_to_consensus.txt', 'w') as hg_consim_handle:
+		hg_consim_handle.write(''.join(consim_lines))
 
 	if sample_population and not population:
-		population_counts = defaultdict(int)
-		population_samples = defaultdict(set)
-		for s, p in sample_population.items():
-			population_counts[p] += 1
-			population_samples[p].add(s)
-
 		most_positive_tajimas_d = [['NA'], 0.0]
 		most_negative_tajimas_d = [['NA'], 0.0]
 		all_tajimas_d = []
 
+		# group filtered sequences by the population of their sample once, rather than re-scanning per population
+		population_filtered_sequences = defaultdict(list)
+		for seq_id in sequences_filtered:
+			population_filtered_sequences[sample_population[seq_id.split('|')[0]]].append(sequences_filtered[seq_id])
+
 		for p in population_counts:
 			if population_counts[p] < 4: continue
-			population_sequences = []
-			for seq_id in sequences_filtered:
-				if sample_population[seq_id.split('|')[0]] == p:
-					population_sequences.append(sequences_filtered[seq_id])
-			if len(population_sequences) >= 4 and len(list(sequences_filtered.values())[0]) >= 21:
+			population_sequences = population_filtered_sequences[p]
+			if len(population_sequences) >= 4 and filtered_sequence_length >= 21:
 				p_tajimas_d = util.calculateTajimasD(population_sequences)
 				if p_tajimas_d != '< 3 segregating sites':
 					p_tajimas_d = round(p_tajimas_d, 3)
@@ -3239,55 +3435,49 @@ def popgen_analysis_of_hg(inputs):
 			mad_tajimas_d = median_abs_deviation(all_tajimas_d, scale="normal")
 
 		pops_with_hg = set([])
-		pop_count_with_hg = defaultdict(int)
-		for s in sample_differences_to_consensus:
-			min_diff_to_consensus = 1e100
-			for g in sample_differences_to_consensus[s]:
-				if min_diff_to_consensus > sample_differences_to_consensus[s][g]:
-					min_diff_to_consensus = sample_differences_to_consensus[s][g]
-			if min_diff_to_consensus < 1e100:
+		pop_count_with_hg = Counter()
+		for si, s in enumerate(consensus_samples):
+			if sample_min_diffs_to_consensus[si] < 1e100:
 				pop_count_with_hg[sample_population[s]] += 1
 				pops_with_hg.add(sample_population[s])
 
+		# rows of the padded (samples x max genes per sample) difference matrix for the samples of each population, so
+		# minimum differences between all pairs of samples can be computed as array operations.
+		population_diff_rows = {}
+		for pop in pop_count_with_hg:
+			pop_sample_indices = [consensus_sample_index[s] for s in sorted(population_samples[pop]) if s in consensus_sample_index]
+			population_diff_rows[pop] = sample_gene_diff_matrix[np.array(pop_sample_indices, dtype=np.int64)]
+
 		fishers_pvals = []
 		fst_like_estimates = []
+		total_pop_count_with_hg = sum(pop_count_with_hg.values())
+		total_population_counts = sum(population_counts.values())
+		pop_pi_within = {}
 		for pi, pop in enumerate(pop_count_with_hg):
-			other_count = sum([x[1] for x in pop_count_with_hg.items() if x[0] != pop])
-			other_total = sum([x[1] for x in population_counts.items() if x[0] != pop])
+			other_count = total_pop_count_with_hg - pop_count_with_hg[pop]
+			other_total = total_population_counts - population_counts[pop]
 			odds, pval = fisher_exact([[pop_count_with_hg[pop], population_counts[pop]], [other_count, other_total]])
 			fishers_pvals.append(pval)
-			pds_within = []
-			for si1, s1 in enumerate(sorted(population_samples[pop])):
-				for si2, s2 in enumerate(sorted(population_samples[pop])):
-					if si1 >= si2: continue
-					min_diff = 1e100
-					for g1 in sample_differences_to_consensus[s1]:
-						for g2 in sample_differences_to_consensus[s2]:
-							samp_gene_diff = abs(sample_differences_to_consensus[s1][g1] - sample_differences_to_consensus[s2][g2])
-							if samp_gene_diff < min_diff:
-								min_diff = samp_gene_diff
-					if min_diff < 1e100:
-						pds_within.append(min_diff)
+			within_min_diffs = pairwise_min_differences(population_diff_rows[pop], population_diff_rows[pop])
+			within_min_diffs = within_min_diffs[np.triu_indices(within_min_diffs.shape[0], k=1)]
+			pds_within = within_min_diffs[np.isfinite(within_min_diffs)].tolist()
 			pi_within = 0.0
 			if len(pds_within) > 0:
 				pi_within = statistics.median(pds_within)
+			pop_pi_within[pop] = pi_within
+
+		# differences between populations are symmetric, so each pair of populations is only compared once and its
+		# median difference is used for the fst-like estimate of both populations.
+		for pi, pop in enumerate(pop_count_with_hg):
 			for cpi, comp_pop in enumerate(pop_count_with_hg):
-				if pop != comp_pop:
-					pds_between = []
-					for si1, s1 in enumerate(sorted(population_samples[pop])):
-						for si2, s2 in enumerate(sorted(population_samples[comp_pop])):
-							min_diff = 1e100
-							for g1 in sample_differences_to_consensus[s1]:
-								for g2 in sample_differences_to_consensus[s2]:
-									samp_gene_diff = abs(sample_differences_to_consensus[s1][g1] - sample_differences_to_consensus[s2][g2])
-									if samp_gene_diff < min_diff:
-										min_diff = samp_gene_diff
-							if min_diff < 1e100:
-								pds_between.append(min_diff)
-					if len(pds_between) > 0:
-						pi_between = statistics.median(pds_between)
+				if pi >= cpi: continue
+				between_min_diffs = pairwise_min_differences(population_diff_rows[pop], population_diff_rows[comp_pop])
+				pds_between = between_min_diffs[np.isfinite(between_min_diffs)].tolist()
+				if len(pds_between) > 0:
+					pi_between = statistics.median(pds_between)
+					for fst_pop in [pop, comp_pop]:
 						if pi_between > 0:
-							fst_like_est = float(pi_between - pi_within)/float(pi_between)
+							fst_like_est = float(pi_between - pop_pi_within[fst_pop])/float(pi_between)
 							fst_like_estimates.append(fst_like_est)
 						else:
 							fst_like_estimates.append(0.0)
@@ -3302,11 +3492,14 @@ def popgen_analysis_of_hg(inputs):
 
 		pop_rel_freqs = []
 		for p in population_counts:
-			prf = float(pop_count_with_hg[p])/float(sum(pop_count_with_hg.values()))
+			prf = float(pop_count_with_hg.get(p, 0))/float(total_pop_count_with_hg)
 			pop_rel_freqs.append(prf)
 
 		population_entropy = entropy(pop_rel_freqs, base=2)
 
+		# populations without the hg are reported with a frequency of zero, after those carrying it
+		pop_hg_count_items = list(pop_count_with_hg.items()) + [(p, 0) for p in population_counts if not p in pop_count_with_hg]
+
 		most_neg_taj_d = most_negative_tajimas_d[1]
 		if most_negative_tajimas_d[0][0] == 'NA': most_neg_taj_d = 'NA'
 
@@ -3316,13 +3509,12 @@ def popgen_analysis_of_hg(inputs):
 		hg_population_info = [len(pops_with_hg), float(len(pops_with_hg))/float(len(population_counts)), fisher_pval,
 							  median_tajimas_d, mad_tajimas_d, str(most_neg_taj_d) + '|' + ','.join(most_negative_tajimas_d[0]),
 							  str(most_pos_taj_d) + '|' + ','.join(most_positive_tajimas_d[0]),
-							  population_entropy, median_fst_like_est, '|'.join([str(x[0]) + '=' + str(float(x[1])/population_counts[x[0]]) for x in pop_count_with_hg.items()])]
+							  population_entropy, median_fst_like_est, '|'.join([str(x[0]) + '=' + str(float(x[1])/population_counts[x[0]]) for x in pop_hg_count_items])]
 		hg_info += hg_population_info
 
 	hg_info += ['; '.join(all_domains)]
-	hg_stats_handle = open(popgen_dir + hg + '_stats.txt', 'w')
-	hg_stats_handle.write('\t'.join([str(x) for x in hg_info]) + '\n')
-	hg_stats_handle.close()
+	with open(popgen_dir + hg + '_stats.txt', 'w') as hg_stats_handle:
+		hg_stats_handle.write('\t'.join(map(str, hg_info)) + '\n')
 
 def create_codon_msas(inputs):
 	"""
@@ -3330,33 +3522,35 @@ def create_codon_msas(inputs):
 	of codon alignments for each homolog group of interest in the GCF.
 	:param inputs: list of inputs passed in by GCF.constructCodonAlignments().
 	"""
-	hg, gene_sequences, nucl_seq_dir, prot_seq_dir, prot_alg_dir, codo_alg_dir, cpus, use_ms5, logObject = inputs
+	hg, gene_sequences, nucl_seq_dir, prot_seq_dir, prot_alg_dir, codo_alg_dir, cpus, use_ms5, keep_protein_msa, logObject = inputs
 
 	hg_nucl_fasta = nucl_seq_dir + '/' + hg + '.fna'
 	hg_prot_fasta = prot_seq_dir + '/' + hg + '.faa'
 	hg_prot_msa = prot_alg_dir + '/' + hg + '.msa.faa'
 	hg_codo_msa = codo_alg_dir + '/' + hg + '.msa.fna'
 
-	hg_nucl_handle = open(hg_nucl_fasta, 'w')
-	hg_prot_handle = open(hg_prot_fasta, 'w')
 	# sorted added because order of sequences might be influencing MAFFT alignment
 	# TODO: confirm this makes MAFFT results reproducible, no option for seeding apparent
+	hg_nucl_lines = []
+	hg_prot_lines = []
 	for s in sorted(gene_sequences):
-		hg_nucl_handle.write('>' + s + '\n' + str(gene_sequences[s][0]) + '\n')
-		hg_prot_handle.write('>' + s + '\n' + str(gene_sequences[s][1]) + '\n')
-	hg_nucl_handle.close()
-	hg_prot_handle.close()
-
-	align_cmd = ['mafft', '--thread', str(cpus), '--maxiterate', '1000', '--localpair', hg_prot_fasta, '>', hg_prot_msa]
+		hg_nucl_lines.extend(['>', s, '\n', str(gene_sequences[s][0]), '\n'])
+		hg_prot_lines.extend(['>', s, '\n', str(gene_sequences[s][1]), '\n'])
+	with open(hg_nucl_fasta, 'w', buffering=OUTPUT_BUFFER_SIZE) as hg_nucl_handle:
+		hg_nucl_handle.writelines(hg_nucl_lines)
+	with open(hg_prot_fasta, 'w', buffering=OUTPUT_BUFFER_SIZE) as hg_prot_handle:
+		hg_prot_handle.writelines(hg_prot_lines)
+
+	# the protein alignment is read straight from the aligner's output and codons are threaded onto it in memory. It is
+	# only written to disk if requested or if PAL2NAL is needed because the sequences could not be back-threaded.
+	align_cmd = ['mafft', '--thread', str(cpus), '--maxiterate', '1000', '--localpair', hg_prot_fasta]
 	if use_ms5:
-		align_cmd = ['muscle', '-super5', hg_prot_fasta, '-output', hg_prot_msa, '-amino', '-threads', str(cpus)]
-	pal2nal_cmd = ['pal2nal.pl', hg_prot_msa, hg_nucl_fasta, '-output', 'fasta', '>', hg_codo_msa]
+		align_cmd = ['muscle', '-super5', hg_prot_fasta, '-output', '/dev/stdout', '-amino', '-threads', str(cpus)]
 
 	if logObject:
 		logObject.info('Running multiple sequence alignment with the following command: %s' % ' '.join(align_cmd))
 	try:
-		subprocess.call(' '.join(align_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		prot_msa_data = subprocess.run(align_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode()
 		if logObject:
 			logObject.info('Successfully ran: %s' % ' '.join(align_cmd))
 	except Exception as e:
@@ -3365,18 +3559,38 @@ def create_codon_msas(inputs):
 			logObject.error(traceback.format_exc())
 		raise RuntimeError('Had an issue running: %s' % ' '.join(align_cmd))
 
-	if logObject:
-		logObject.info('Running PAL2NAL with the following command: %s' % ' '.join(pal2nal_cmd))
-	try:
-		subprocess.call(' '.join(pal2nal_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
-		if logObject:
-			logObject.info('Successfully ran: %s' % ' '.join(pal2nal_cmd))
-	except Exception as e:
+	if keep_protein_msa:
+		with open(hg_prot_msa, 'w') as hg_prot_msa_handle:
+			hg_prot_msa_handle.write(prot_msa_data)
+
+	gene_nucl_seqs = {}
+	for s in gene_sequences:
+		gene_nucl_seqs[s] = str(gene_sequences[s][0])
+	codon_msa_lines = back_thread_codons(SimpleFastaParser(io.StringIO(prot_msa_data)), gene_nucl_seqs)
+	if codon_msa_lines is not None:
+		with open(hg_codo_msa, 'w', buffering=OUTPUT_BUFFER_SIZE) as hg_codo_msa_handle:
+			hg_codo_msa_handle.writelines(codon_msa_lines)
+	else:
+		if not keep_protein_msa:
+			with open(hg_prot_msa, 'w') as hg_prot_msa_handle:
+				hg_prot_msa_handle.write(prot_msa_data)
+
+		pal2nal_cmd = ['pal2nal.pl', hg_prot_msa, hg_nucl_fasta, '-output', 'fasta']
 		if logObject:
-			logObject.error('Had an issue running: %s' % ' '.join(pal2nal_cmd))
-			logObject.error(traceback.format_exc())
-		raise RuntimeError('Had an issue running: %s' % ' '.join(pal2nal_cmd))
+			logObject.info('Could not directly thread codons onto protein alignment of homolog group %s, running PAL2NAL with the following command: %s > %s' % (hg, ' '.join(pal2nal_cmd), hg_codo_msa))
+		try:
+			with open(hg_codo_msa, 'w') as hg_codo_msa_handle:
+				subprocess.call(pal2nal_cmd, stdout=hg_codo_msa_handle, stderr=subprocess.DEVNULL)
+			if logObject:
+				logObject.info('Successfully ran: %s' % ' '.join(pal2nal_cmd))
+		except Exception as e:
+			if logObject:
+				logObject.error('Had an issue running: %s' % ' '.join(pal2nal_cmd))
+				logObject.error(traceback.format_exc())
+			raise RuntimeError('Had an issue running: %s' % ' '.join(pal2nal_cmd))
+
+		if not keep_protein_msa:
+			os.remove(hg_prot_msa)
 
 	if logObject:
 		logObject.info('Achieved codon alignment for homolog group %s' % hg)
@@ -3528,8 +3742,9 @@ def identify_gcf_instances(input_args):
 			if hg == 'other' and lt in hmmscan_results_lenient.keys():
 				gcf_segment[1][i] = hmmscan_results_lenient[lt][0]
 
-		min_bgc_order = min([gene_id_to_order[gcf_segment_scaff][g] for g in gcf_segment[0]])
-		max_bgc_order = max([gene_id_to_order[gcf_segment_scaff][g] for g in gcf_segment[0]])
+		scaff_gene_id_to_order = gene_id_to_order[gcf_segment_scaff]
+		min_bgc_order = min(scaff_gene_id_to_order[g] for g in gcf_segment[0])
+		max_bgc_order = max(scaff_gene_id_to_order[g] for g in gcf_segment[0])
 
 		for oi in range(min_bgc_order-surround_gene_max, min_bgc_order):
 			if oi in gene_order_to_id[gcf_segment_scaff].keys():
@@ -3545,8 +3760,8 @@ def identify_gcf_instances(input_args):
 					gcf_segment[0].append(lt)
 					gcf_segment[1].append(hmmscan_results_lenient[lt][0])
 
-		min_bgc_pos = min([gene_location[g]['start'] for g in gcf_segment[0]])
-		max_bgc_pos = max([gene_location[g]['end'] for g in gcf_segment[0]])
+		min_bgc_pos = min(gene_location[g]['start'] for g in gcf_segment[0])
+		max_bgc_pos = max(gene_location[g]['end'] for g in gcf_segment[0])
 
 		util.createBGCGenbank(sample_prokka_data['genbank'], bgc_genbank_file, gcf_segment_scaff,
 							  min_bgc_pos, max_bgc_pos)
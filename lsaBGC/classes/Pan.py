@@ -1,10 +1,12 @@
 import os
 import sys
+import glob
 import logging
 import traceback
 import subprocess
 from collections import defaultdict
 from Bio import SeqIO
+from Bio.SeqIO.FastaIO import SimpleFastaParser
 from lsaBGC.classes.BGC import BGC
 from lsaBGC import util
 import statistics
@@ -18,6 +20,8 @@ import _pickle as cPickle
 
 lsaBGC_main_directory = '/'.join(os.path.realpath(__file__).split('/')[:-3])
 RSCRIPT_FOR_CLUSTER_ASSESSMENT_PLOTTING = lsaBGC_main_directory + '/lsaBGC/Rscripts/plotParameterImpactsOnGCF.R'
+# buffer size for large output files, shared with the GCF class
+OUTPUT_BUFFER_SIZE = 1 << 20
 
 class Pan:
 	def __init__(self, bgc_genbanks_listing, logObject=None, lineage_name='Unnamed lineage'):
@@ -323,8 +327,7 @@ class Pan:
 		if self.logObject:
 			self.logObject.info('Running the following command: %s' % ' '.join(mcxload_cmd))
 		try:
-			subprocess.call(' '.join(mcxload_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(mcxload_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			if self.logObject:
 				self.logObject.info('Successfully ran: %s' % ' '.join(mcxload_cmd))
 		except Exception as e:
@@ -340,8 +343,7 @@ class Pan:
 			self.logObject.info('Running MCL and MCXDUMP with inflation parameter set to %f' % mip)
 			self.logObject.info('Running the following command: %s' % ' '.join(mcl_cmd))
 		try:
-			subprocess.call(' '.join(mcl_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(mcl_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			assert (os.path.isfile(relations_mcl_file) and os.path.getsize(relations_mcl_file) > 50)
 			self.logObject.info('Successfully ran: %s' % ' '.join(mcl_cmd))
 		except Exception as e:
@@ -353,8 +355,7 @@ class Pan:
 		if self.logObject:
 			self.logObject.info('Running the following command: %s' % ' '.join(mcxdump_cmd))
 		try:
-			subprocess.call(' '.join(mcxdump_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(mcxdump_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			assert (os.path.isfile(mcxdump_out_file) and os.path.getsize(mcxdump_out_file) > 50)
 			if self.logObject:
 				self.logObject.info('Successfully ran: %s' % ' '.join(mcl_cmd))
@@ -455,7 +456,7 @@ class Pan:
 					self.logObject.info(
 					"Writing list of BGCs for each GCF, which will be used as input for downstream programs in the suite!")
 				gcf_listing_dir = outdir + 'GCF_Listings/'
-				if not os.path.isdir(gcf_listing_dir): os.system('mkdir %s' % gcf_listing_dir)
+				os.makedirs(gcf_listing_dir, exist_ok=True)
 				gcf_identifier = 1
 				with open(mcxdump_out_file) as omo:
 					for gcf in omo:
@@ -514,7 +515,7 @@ class Pan:
 		"""
 		try:
 			plot_input_dir = outdir + 'plotting_input/'
-			if not os.path.isdir(plot_input_dir): os.system('mkdir %s' % plot_input_dir)
+			os.makedirs(plot_input_dir, exist_ok=True)
 
 			singleton_counts = defaultdict(int)
 			clustered_counts = defaultdict(int)
@@ -703,9 +704,8 @@ class Pan:
 			if self.logObject:
 				self.logObject.info('Running R-based plotting with the following command: %s' % ' '.join(rscript_plot_cmd))
 			try:
-				subprocess.call(' '.join(rscript_plot_cmd), shell=True, stdout=sys.stderr,
-								stderr=sys.stderr,
-								executable='/bin/bash')
+				subprocess.call(rscript_plot_cmd, stdout=sys.stderr,
+								stderr=sys.stderr)
 				if self.logObject:
 					self.logObject.info('Successfully ran: %s' % ' '.join(rscript_plot_cmd))
 			except Exception as e:
@@ -825,14 +825,12 @@ class Pan:
 		outdir = os.path.abspath(outdir) + '/'
 		prot_seq_dir = outdir + 'Protein_Sequences/'
 		prot_alg_dir = outdir + 'Protein_Alignments/'
-		prot_hmm_dir = outdir + 'Profile_HMMs/'
 		search_ref_res_dir = outdir + 'Reflexive_Alignment_Results/'
 		hg_differentiation_file = open(outdir + 'Homolog_Groups_Differentiation.txt', 'w')
 
-		if not os.path.isdir(prot_seq_dir): os.system('mkdir %s' % prot_seq_dir)
-		if not os.path.isdir(prot_alg_dir): os.system('mkdir %s' % prot_alg_dir)
-		if not os.path.isdir(prot_hmm_dir): os.system('mkdir %s' % prot_hmm_dir)
-		if not os.path.isdir(search_ref_res_dir): os.system('mkdir %s' % search_ref_res_dir)
+		os.makedirs(prot_seq_dir, exist_ok=True)
+		os.makedirs(prot_alg_dir, exist_ok=True)
+		os.makedirs(search_ref_res_dir, exist_ok=True)
 
 		try:
 			inputs = []
@@ -846,23 +844,78 @@ class Pan:
 					sample_hgs[sample_id].add(hg)
 					prot_seq = gene_info['prot_seq']
 					sample_sequences[sample_id] = prot_seq
-				inputs.append([hg, sample_sequences, prot_seq_dir, prot_alg_dir, prot_hmm_dir, self.logObject])
+				inputs.append([hg, sample_sequences, prot_seq_dir, prot_alg_dir, self.logObject])
 
 			sample_hg_counts = [len(sample_hgs[x]) for x in sample_hgs]
 			self.lowerbound_hg_count = math.floor(min(sample_hg_counts))
 
-			p = multiprocessing.Pool(cpus)
-			p.map(create_hmm_profiles, inputs)
-			p.close()
+			hg_prot_msas = {}
+			with multiprocessing.Pool(cpus) as p:
+				for hg, hg_prot_msa in p.imap_unordered(create_protein_msa, inputs, chunksize=max(1, len(inputs) // (cpus * 4))):
+					hg_prot_msas[hg] = hg_prot_msa
 
 			if self.logObject:
-				self.logObject.info("Successfully created profile HMMs for each homolog group. Now beginning concatenation into single file.")
+				self.logObject.info("Successfully created protein alignments for each homolog group. Now gathering them into a single file for building profile HMMs.")
 
 			self.concatenated_profile_HMM = outdir + 'All_GCF_Homologs.hmm'
-			os.system('rm -f %s %s.h3*' % (self.concatenated_profile_HMM, self.concatenated_profile_HMM))
+			for hmm_file in [self.concatenated_profile_HMM] + glob.glob(self.concatenated_profile_HMM + '.h3*'):
+				if os.path.isfile(hmm_file): os.remove(hmm_file)
+
+			# the alignments are gathered into one multi-MSA Stockholm file, named by homolog group, such that a single
+			# multithreaded hmmbuild run constructs the profile HMMs for all homolog groups.
+			hg_msa_blocks = {}
+			for hg in sorted(hg_prot_msas):
+				msa_lines = []
+				with open(hg_prot_msas[hg]) as ohpm:
+					for rec_title, rec_seq in SimpleFastaParser(ohpm):
+						if len(rec_seq.strip()) == 0: continue
+						msa_lines.append(rec_title.split(None, 1)[0] + ' ' + rec_seq.strip())
+				if len(msa_lines) == 0:
+					if self.logObject:
+						self.logObject.warning('Protein alignment for homolog group %s is empty, no profile HMM will be constructed for it.' % hg)
+					continue
+				hg_msa_blocks[hg] = '\n'.join(['# STOCKHOLM 1.0', '#=GF ID ' + hg] + msa_lines + ['//']) + '\n'
+
+			concatenated_prot_msa = outdir + 'All_GCF_Homologs.msa.sto'
+			with open(concatenated_prot_msa, 'w') as concatenated_msa_handle:
+				concatenated_msa_handle.writelines([hg_msa_blocks[hg] for hg in sorted(hg_msa_blocks)])
 
-			for f in os.listdir(prot_hmm_dir):
-				os.system('cat %s >> %s' % (prot_hmm_dir + f, self.concatenated_profile_HMM))
+			hmmbuild_cmd = ['hmmbuild', '--amino', '--cpu', str(cpus), '-o', '/dev/null', self.concatenated_profile_HMM,
+							concatenated_prot_msa]
+			if self.logObject:
+				self.logObject.info('Running hmmbuild (from HMMER3) with the following command: %s' % ' '.join(hmmbuild_cmd))
+			try:
+				subprocess.check_call(hmmbuild_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+				assert (os.path.isfile(self.concatenated_profile_HMM))
+				if self.logObject:
+					self.logObject.info('Successfully ran: %s' % ' '.join(hmmbuild_cmd))
+			except:
+				# a single problematic alignment fails the combined run, so profile HMMs are instead built one homolog
+				# group at a time, skipping those which hmmbuild cannot handle.
+				if self.logObject:
+					self.logObject.warning('Had an issue running: %s, building profile HMMs for each homolog group separately instead.' % ' '.join(hmmbuild_cmd))
+				if os.path.isfile(self.concatenated_profile_HMM): os.remove(self.concatenated_profile_HMM)
+				prot_hmm_dir = outdir + 'Profile_HMMs/'
+				os.makedirs(prot_hmm_dir, exist_ok=True)
+				with open(self.concatenated_profile_HMM, 'w') as concatenated_hmm_handle:
+					for hg in sorted(hg_msa_blocks):
+						hg_prot_sto = prot_hmm_dir + hg + '.msa.sto'
+						hg_prot_hmm = prot_hmm_dir + hg + '.hmm'
+						with open(hg_prot_sto, 'w') as hg_sto_handle:
+							hg_sto_handle.write(hg_msa_blocks[hg])
+						hg_hmmbuild_cmd = ['hmmbuild', '--amino', '--cpu', str(cpus), '-o', '/dev/null', hg_prot_hmm, hg_prot_sto]
+						hg_hmmbuild_rc = subprocess.call(hg_hmmbuild_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+						if hg_hmmbuild_rc != 0 or not os.path.isfile(hg_prot_hmm):
+							if self.logObject:
+								self.logObject.warning('Had an issue running: %s, no profile HMM will be constructed for homolog group %s.' % (' '.join(hg_hmmbuild_cmd), hg))
+							continue
+						with open(hg_prot_hmm) as hg_hmm_handle:
+							concatenated_hmm_handle.write(hg_hmm_handle.read())
+
+			if not os.path.isfile(self.concatenated_profile_HMM) or os.path.getsize(self.concatenated_profile_HMM) == 0:
+				if self.logObject:
+					self.logObject.error('No profile HMMs could be constructed for any homolog group.')
+				raise RuntimeError('No profile HMMs could be constructed for any homolog group.')
 
 			if quick_mode:
 				self.consensus_sequence_HMM = outdir + 'All_GCF_Homologs_ConsensusSequences.fasta'
@@ -873,9 +926,8 @@ class Pan:
 					self.logObject.info(
 						'Running hmmemit on concatenated profiles HMM to get consensus sequences with the following command: %s' % ' '.join(hmmemit_cmd))
 				try:
-					subprocess.call(' '.join(hmmemit_cmd), shell=True, stdout=subprocess.DEVNULL,
-									stderr=subprocess.DEVNULL,
-									executable='/bin/bash')
+					subprocess.call(hmmemit_cmd, stdout=subprocess.DEVNULL,
+									stderr=subprocess.DEVNULL)
 					if self.logObject:
 						self.logObject.info('Successfully ran: %s' % ' '.join(hmmemit_cmd))
 				except:
@@ -889,9 +941,8 @@ class Pan:
 					self.logObject.info(
 						'Running Diamond makedb on concatenated profiles with the following command: %s' % ' '.join(makedb_cmd))
 				try:
-					subprocess.call(' '.join(makedb_cmd), shell=True, stdout=subprocess.DEVNULL,
-									stderr=subprocess.DEVNULL,
-									executable='/bin/bash')
+					subprocess.call(makedb_cmd, stdout=subprocess.DEVNULL,
+									stderr=subprocess.DEVNULL)
 					if self.logObject:
 						self.logObject.info('Successfully ran: %s' % ' '.join(makedb_cmd))
 				except:
@@ -919,9 +970,7 @@ class Pan:
 					self.logObject.info(
 						'Running hmmpress on concatenated profiles with the following command: %s' % ' '.join(hmmpress_cmd))
 				try:
-					subprocess.call(' '.join(hmmpress_cmd), shell=True, stdout=subprocess.DEVNULL,
-									stderr=subprocess.DEVNULL,
-									executable='/bin/bash')
+					subprocess.call(hmmpress_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 					if self.logObject:
 						self.logObject.info('Successfully ran: %s' % ' '.join(hmmpress_cmd))
 				except:
@@ -970,11 +1019,10 @@ class Pan:
 							hits_per_gene[gene_id].append([hg, eval])
 
 				for gene_id in hits_per_gene:
-					for i, hit in enumerate(sorted(hits_per_gene[gene_id], key=itemgetter(1))):
-						if i == 0:
-							in_hg_flag = False
-							if gene_id in self.gene_to_hg and hit[0] == self.gene_to_hg[gene_id]: in_hg_flag = True
-							best_hits[hit[0]][sample][in_hg_flag].append(hit[1])
+					hit = min(hits_per_gene[gene_id], key=itemgetter(1))
+					in_hg_flag = False
+					if gene_id in self.gene_to_hg and hit[0] == self.gene_to_hg[gene_id]: in_hg_flag = True
+					best_hits[hit[0]][sample][in_hg_flag].append(hit[1])
 
 			for hg in best_hits:
 				true_hits = []
@@ -1025,21 +1073,18 @@ class Pan:
 		:param cpus: The number of cpus (will be used for parallelizing)
 		"""
 		search_res_dir = os.path.abspath(outdir + 'Alignment_Results') + '/'
-		if not os.path.isdir(search_res_dir): os.system('mkdir %s' % search_res_dir)
+		os.makedirs(search_res_dir, exist_ok=True)
 
 		if not annotation_pickle_file:
-			with multiprocessing.Manager() as manager:
-				sample_gbk_info = manager.dict()
-				genbanks = []
-				for sample in expanded_sample_prokka_data:
-					sample_genbank = expanded_sample_prokka_data[sample]['genbank']
-					genbanks.append([sample, sample_genbank, sample_gbk_info])
-
-				with manager.Pool(cpus) as pool:
-					pool.map(util.parseGenbankAndFindBoundaryGenes, genbanks)
-
-				for sample in sample_gbk_info:
-					gene_location, scaff_genes, bound_genes, gito, goti = sample_gbk_info[sample]
+			genbanks = []
+			for sample in expanded_sample_prokka_data:
+				sample_genbank = expanded_sample_prokka_data[sample]['genbank']
+				genbanks.append([sample, sample_genbank])
+
+			# parsed Genbank information is returned by each worker rather than written to a manager-shared dictionary
+			with multiprocessing.Pool(cpus) as pool:
+				for sample, sample_gbk_info in pool.imap_unordered(util.parseGenbankAndFindBoundaryGenes, genbanks, chunksize=max(1, len(genbanks) // (cpus * 4))):
+					gene_location, scaff_genes, bound_genes, gito, goti = sample_gbk_info
 					self.gene_location[sample] = gene_location
 					self.scaffold_genes[sample] = scaff_genes
 					self.boundary_genes[sample] = bound_genes
@@ -1095,98 +1140,77 @@ class Pan:
 										 'median_gene_length': median_gene_nucl_seq_lens,
 										 'gene_length_deviation': mad_gene_nucl_seq_lens}
 
+		lenient_evalue_cutoff = decimal.Decimal(1e-10)
 		for sample in expanded_sample_prokka_data:
 			result_file = search_res_dir + sample + '.txt'
 			assert (os.path.isfile(result_file))
 
+			# the result file is read and split once, with hits retained for the filtering pass below
+			hits = []
 			best_hit_per_gene = defaultdict(lambda: [set([]), 0.0])
 			with open(result_file) as orf:
 				for line in orf:
-					line = line.strip()
-					ls = line.split()
-					if quick_mode:
-						hg = ls[1].split('-consensus')[0]
-						gene_id = ls[0]
-						bitscore = float(ls[11])
-						if bitscore > best_hit_per_gene[gene_id][1]:
-							best_hit_per_gene[gene_id][1] = bitscore
-							best_hit_per_gene[gene_id][0] = set([hg])
-						elif bitscore == best_hit_per_gene[gene_id][1]:
-							best_hit_per_gene[gene_id][0].add(hg)
-					else:
-						if line.startswith("#"): continue
-						hg = ls[0]
-						gene_id = ls[2]
-						score = float(ls[5])
-						if score > best_hit_per_gene[gene_id][1]:
-							best_hit_per_gene[gene_id][1] = score
-							best_hit_per_gene[gene_id][0] = set([hg])
-						elif score == best_hit_per_gene[gene_id][1]:
-							best_hit_per_gene[gene_id][0].add(hg)
-
-			with open(result_file) as orf:
-				for line in orf:
-					line = line.strip()
 					ls = line.split()
 					if quick_mode:
 						hg = ls[1].split('-consensus')[0]
 						gene_id = ls[0]
-						gene_length = abs(self.gene_location[sample][gene_id]['start'] - self.gene_location[sample][gene_id]['end'])
-						is_boundary_gene = gene_id in self.boundary_genes[sample]
-						if not hg in best_hit_per_gene[gene_id][0]: continue
-						scaffold = self.gene_location[sample][gene_id]['scaffold']
-						eval = decimal.Decimal(ls[10])
-						bitscore = float(ls[11])
-						if eval < decimal.Decimal(1e-10):
-							self.hmmscan_results_lenient[sample][gene_id] = [hg, eval]
-						if (not is_boundary_gene) and \
-								(not (gene_length <= hg_valid_length_range[hg]['max_gene_length'] and gene_length >= hg_valid_length_range[hg]['min_gene_length'])) and \
-								(abs(gene_length - hg_valid_length_range[hg]['median_gene_length']) >= (2 * hg_valid_length_range[hg]['gene_length_deviation'])): continue
-						if eval <= self.hg_max_self_evalue[hg][0]:
-							self.hmmscan_results[gene_id].append([hg, eval, sample, scaffold, bitscore])
-						elif eval <= decimal.Decimal(1e-10) and is_boundary_gene:
-							self.hmmscan_results[gene_id].append([hg, eval, sample, scaffold, bitscore])
+						evalue = ls[10]
+						score = float(ls[11])
 					else:
 						if line.startswith("#"): continue
 						hg = ls[0]
 						gene_id = ls[2]
-						gene_length = abs(self.gene_location[sample][gene_id]['start'] - self.gene_location[sample][gene_id]['end'])
-						is_boundary_gene = gene_id in self.boundary_genes[sample]
-						if not hg in best_hit_per_gene[gene_id][0]: continue
-						scaffold = self.gene_location[sample][gene_id]['scaffold']
-						eval = decimal.Decimal(ls[4])
+						evalue = ls[4]
 						score = float(ls[5])
-						if eval < decimal.Decimal(1e-10):
-							self.hmmscan_results_lenient[sample][gene_id] = [hg, eval]
-						if (not is_boundary_gene) and \
-								(not (gene_length <= hg_valid_length_range[hg]['max_gene_length'] and gene_length >= hg_valid_length_range[hg]['min_gene_length'])) and \
-								(abs(gene_length - hg_valid_length_range[hg]['median_gene_length']) >= (2 * hg_valid_length_range[hg]['gene_length_deviation'])): continue
-						if eval <= self.hg_max_self_evalue[hg][0]:
-							self.hmmscan_results[gene_id].append([hg, eval, sample, scaffold, score])
-						elif eval <= decimal.Decimal(1e-10) and is_boundary_gene:
-							self.hmmscan_results[gene_id].append([hg, eval, sample, scaffold, score])
-
-def create_hmm_profiles(inputs):
+					hits.append([hg, gene_id, evalue, score])
+					if score > best_hit_per_gene[gene_id][1]:
+						best_hit_per_gene[gene_id][1] = score
+						best_hit_per_gene[gene_id][0] = set([hg])
+					elif score == best_hit_per_gene[gene_id][1]:
+						best_hit_per_gene[gene_id][0].add(hg)
+
+			sample_gene_location = self.gene_location[sample]
+			sample_boundary_genes = self.boundary_genes[sample]
+			for hg, gene_id, evalue, score in hits:
+				if not hg in best_hit_per_gene[gene_id][0]: continue
+				gene_length = abs(sample_gene_location[gene_id]['start'] - sample_gene_location[gene_id]['end'])
+				is_boundary_gene = gene_id in sample_boundary_genes
+				scaffold = sample_gene_location[gene_id]['scaffold']
+				eval = decimal.Decimal(evalue)
+				if eval < lenient_evalue_cutoff:
+					self.hmmscan_results_lenient[sample][gene_id] = [hg, eval]
+				if (not is_boundary_gene) and \
+						(not (gene_length <= hg_valid_length_range[hg]['max_gene_length'] and gene_length >= hg_valid_length_range[hg]['min_gene_length'])) and \
+						(abs(gene_length - hg_valid_length_range[hg]['median_gene_length']) >= (2 * hg_valid_length_range[hg]['gene_length_deviation'])): continue
+				if eval <= self.hg_max_self_evalue[hg][0]:
+					self.hmmscan_results[gene_id].append([hg, eval, sample, scaffold, score])
+				elif eval <= lenient_evalue_cutoff and is_boundary_gene:
+					self.hmmscan_results[gene_id].append([hg, eval, sample, scaffold, score])
+
+def create_protein_msa(inputs):
 	"""
-	Function to create MAFFT based MSAs of proteins for homolog group and then use Hmmer3 to create HMM profiles.
+	Function to create MAFFT based MSAs of proteins for homolog group. Profile HMMs are subsequently built from these
+	for all homolog groups at once.
+
+	:return: tuple of the homolog group and the path to its protein MSA.
 	"""
-	hg, sample_sequences, prot_seq_dir, prot_alg_dir, prot_hmm_dir, logObject = inputs
+	hg, sample_sequences, prot_seq_dir, prot_alg_dir, logObject = inputs
 
 	hg_prot_fasta = prot_seq_dir + '/' + hg + '.faa'
 	hg_prot_msa = prot_alg_dir + '/' + hg + '.msa.faa'
-	hg_prot_hmm = prot_hmm_dir + '/' + hg + '.hmm'
 
-	hg_prot_handle = open(hg_prot_fasta, 'w')
+	hg_prot_lines = []
 	for s in sample_sequences:
-		hg_prot_handle.write('>' + s + '\n' + str(sample_sequences[s]) + '\n')
-	hg_prot_handle.close()
+		hg_prot_lines.extend(['>', s, '\n', str(sample_sequences[s]), '\n'])
+	with open(hg_prot_fasta, 'w', buffering=OUTPUT_BUFFER_SIZE) as hg_prot_handle:
+		hg_prot_handle.writelines(hg_prot_lines)
 
-	mafft_cmd = ['mafft', '--maxiterate', '1000', '--localpair', hg_prot_fasta, '>', hg_prot_msa]
+	mafft_cmd = ['mafft', '--maxiterate', '1000', '--localpair', hg_prot_fasta]
 	if logObject:
-		logObject.info('Running mafft with the following command: %s' % ' '.join(mafft_cmd))
+		logObject.info('Running mafft with the following command: %s > %s' % (' '.join(mafft_cmd), hg_prot_msa))
 	try:
-		subprocess.call(' '.join(mafft_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		with open(hg_prot_msa, 'w') as hg_prot_msa_handle:
+			subprocess.call(mafft_cmd, stdout=hg_prot_msa_handle, stderr=subprocess.DEVNULL)
 		if logObject:
 			logObject.info('Successfully ran: %s' % ' '.join(mafft_cmd))
 	except:
@@ -1195,20 +1219,7 @@ def create_hmm_profiles(inputs):
 			logObject.error(traceback.format_exc())
 		raise RuntimeError('Had an issue running: %s' % ' '.join(mafft_cmd))
 
-	hmmbuild_cmd = ['hmmbuild', '--amino', '-n', hg, hg_prot_hmm, hg_prot_msa]
 	if logObject:
-		logObject.info('Running hmmbuild (from HMMER3) with the following command: %s' % ' '.join(hmmbuild_cmd))
-	try:
-		subprocess.call(' '.join(hmmbuild_cmd), shell=True, stdout=subprocess.DEVNULL,
-						stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
-		if logObject:
-			logObject.info('Successfully ran: %s' % ' '.join(hmmbuild_cmd))
-	except:
-		if logObject:
-			logObject.error('Had an issue running: %s' % ' '.join(hmmbuild_cmd))
-			logObject.error(traceback.format_exc())
-		raise RuntimeError('Had an issue running: %s' % ' '.join(hmmbuild_cmd))
+		logObject.info('Constructed protein alignment for homolog group %s' % hg)
 
-	if logObject:
-		logObject.info('Constructed profile HMM for homolog group %s' % hg)
+	return hg, hg_prot_msa
@@ -15,7 +15,6 @@ from Bio import SeqIO
 from collections import defaultdict
 import logging
 import traceback
-import subprocess
 
 def readInAnnotationFilesForExpandedSampleSet(expansion_listing_file, logObject=None):
 	"""
@@ -252,8 +251,7 @@ def runOrthoFinder(prokka_proteomes_dir, orthofinder_outdir, orthofinder_load_co
 	else:
 		try:
 			logObject.info('Running the following command: %s' % ' '.join(orthofinder_cmd))
-			subprocess.call(' '.join(orthofinder_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			util.callCommand(orthofinder_cmd)
 			logObject.info('Successfully ran OrthoFinder!')
 			tmp_orthofinder_dir = os.path.abspath(
 				[prokka_proteomes_dir + 'OrthoFinder/' + f for f in os.listdir(prokka_proteomes_dir + 'OrthoFinder/') if f.startswith('Results')][0]) + '/'
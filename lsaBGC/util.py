@@ -2,15 +2,16 @@ import os
 import sys
 from Bio import SeqIO
 from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
 from Bio.SeqFeature import SeqFeature, FeatureLocation
 import logging
 import subprocess
+import shlex
 import statistics
 from operator import itemgetter
 from collections import defaultdict
 import traceback
 import multiprocessing
-import copy
 from scipy import stats
 from ete3 import Tree
 import itertools
@@ -27,6 +28,15 @@ version = pkg_resources.require("lsaBGC")[0].version
 
 
 valid_alleles = set(['A', 'C', 'G', 'T'])
+# codes of valid alleles, with all other characters coded as 4, for comparing aligned sequences as arrays
+allele_code_lut = np.full(256, 4, dtype=np.uint8)
+for allele_code, allele in enumerate(sorted(valid_alleles)):
+	allele_code_lut[ord(allele)] = allele_code
+# characters which are removed or replaced with underscores in sample names
+sample_name_cleanup_table = str.maketrans({'#': '', '*': '_', ':': '_', ';': '_', ' ': '_', '|': '_', '"': '_', "'": '_',
+										   '=': '_', '-': '_', '(': '', ')': '', '/': '', '\\': '', '[': '', ']': '',
+										   ',': ''})
+# characters in command arguments which indicate the command relies on bash, e.g. to split a string of several options
 curr_dir = os.path.abspath(pathlib.Path(__file__).parent.resolve()) + '/'
 main_dir = '/'.join(curr_dir.split('/')[:-2]) + '/'
 
@@ -89,14 +99,49 @@ def parseCDSCoord(str_gbk_loc):
 def writeRefinedProteomes(s, sample_bgcs, refined_proteomes_outdir, logObject):
 	try:
 		refined_proteome_handle = open(refined_proteomes_outdir + s + '.faa', 'w')
+		# only the locus tag and translation of CDS features are needed, so the feature tables of the BGC Genbanks are
+		# streamed line by line rather than parsed into full SeqRecords
+		cds_features = []
 		for bgc in sample_bgcs:
 			with open(bgc) as obgc:
-				for rec in SeqIO.parse(obgc, 'genbank'):
-					for feature in rec.features:
-						if feature.type == "CDS":
-							lt = feature.qualifiers.get('locus_tag')[0]
-							prot_seq = feature.qualifiers.get('translation')[0]
-							refined_proteome_handle.write('>' + lt + '\n' + str(prot_seq) + '\n')
+				in_features = False
+				curr_cds = None
+				curr_qualifier = None
+				in_quoted_value = False
+				for line in obgc:
+					line = line.rstrip('\r\n')
+					if line.startswith('FEATURES'):
+						in_features = True
+						continue
+					if not in_features: continue
+					if not line.startswith(' '):
+						# feature table ends at the ORIGIN/CONTIG line or the end of the record
+						in_features = False
+						curr_cds = None
+					elif len(line) > 5 and line[5] != ' ':
+						curr_cds = None
+						if line[5:21].strip() == 'CDS':
+							curr_cds = [None, None]
+							cds_features.append(curr_cds)
+						curr_qualifier = None
+						in_quoted_value = False
+					elif curr_cds is not None:
+						content = line[21:].strip()
+						if content.startswith('/') and not in_quoted_value:
+							curr_qualifier, _, value = content[1:].partition('=')
+							in_quoted_value = value.startswith('"') and (len(value) == 1 or not value.endswith('"'))
+							if curr_qualifier == 'locus_tag' and curr_cds[0] is None:
+								curr_cds[0] = value.strip('"')
+							elif curr_qualifier == 'translation' and curr_cds[1] is None:
+								curr_cds[1] = value.strip('"')
+							else:
+								curr_qualifier = None
+						else:
+							if in_quoted_value and content.endswith('"'):
+								in_quoted_value = False
+							if curr_qualifier == 'translation':
+								curr_cds[1] += content.strip('"')
+		refined_proteome_handle.writelines(['>' + lt + '\n' + prot_seq + '\n' for lt, prot_seq in cds_features])
 		refined_proteome_handle.close()
 	except:
 		logObject.warning(
@@ -118,22 +163,19 @@ def getSampleRetentionSet(sample_retention_file):
 def determineOutliersByGeneLength(gene_sequences, logObject):
 	filtered_gene_sequences = {}
 	try:
-		og_gene_nucl_seq_lens = []
-		for g in gene_sequences:
-			sample, gene = g.split('|')
-			if len(gene.split('_')[0]) == 3:
-				gene_nucl_seq = gene_sequences[g][0]
-				gene_nucl_seq_len = len(gene_nucl_seq)
-				og_gene_nucl_seq_lens.append(gene_nucl_seq_len)
-
-		median_gene_nucl_seq_lens = statistics.median(og_gene_nucl_seq_lens)
-		mad_gene_nucl_seq_lens = max(stats.median_abs_deviation(og_gene_nucl_seq_lens, scale="normal"), 25)
-
-		for g in gene_sequences:
-			gene_nucl_seq = gene_sequences[g][0]
-			gene_nucl_seq_len = len(gene_nucl_seq)
-			if abs(gene_nucl_seq_len - median_gene_nucl_seq_lens) <= mad_gene_nucl_seq_lens:
-				filtered_gene_sequences[g] = gene_sequences[g]
+		genes = list(gene_sequences.keys())
+		gene_nucl_seq_lens = np.fromiter((len(gene_sequences[g][0]) for g in genes), dtype=np.int64, count=len(genes))
+		og_gene_mask = np.array([len(g.split('|')[1].split('_')[0]) == 3 for g in genes], dtype=bool)
+		og_gene_nucl_seq_lens = gene_nucl_seq_lens[og_gene_mask]
+		assert (len(og_gene_nucl_seq_lens) > 0)
+
+		median_gene_nucl_seq_lens = np.median(og_gene_nucl_seq_lens)
+		# MAD scaled to be consistent with the standard deviation of a normal distribution
+		mad_gene_nucl_seq_lens = max(np.median(np.abs(og_gene_nucl_seq_lens - median_gene_nucl_seq_lens)) / 0.6744897501960817, 25)
+
+		keep = np.abs(gene_nucl_seq_lens - median_gene_nucl_seq_lens) <= mad_gene_nucl_seq_lens
+		for gi in np.flatnonzero(keep).tolist():
+			filtered_gene_sequences[genes[gi]] = gene_sequences[genes[gi]]
 	except:
 		logObject.warning(
 			"Unable to filter gene sequences to remove outliers, possibly because there are too few sequences.")
@@ -199,9 +241,7 @@ def determineNonUniqueRegionsAlongCodonAlignment(outdir, initial_sample_prokka_d
 			logObject.info(
 				'Running Diamond makedb on proteins from GCF with the following command: %s' % ' '.join(makedb_cmd))
 		try:
-			subprocess.call(' '.join(makedb_cmd), shell=True, stdout=subprocess.DEVNULL,
-							stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(makedb_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			if logObject:
 				logObject.info('Successfully ran: %s' % ' '.join(makedb_cmd))
 		except:
@@ -220,9 +260,7 @@ def determineNonUniqueRegionsAlongCodonAlignment(outdir, initial_sample_prokka_d
 				'Running Diamond blastp between proteins not found in GCF against proteins found in GCF: %s' % ' '.join(
 					diamond_cmd))
 		try:
-			subprocess.call(' '.join(diamond_cmd), shell=True, stdout=subprocess.DEVNULL,
-							stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(diamond_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			if logObject:
 				logObject.info('Successfully ran: %s' % ' '.join(diamond_cmd))
 		except:
@@ -267,6 +305,36 @@ def determineNonUniqueRegionsAlongCodonAlignment(outdir, initial_sample_prokka_d
 		raise RuntimeError(traceback.format_exc())
 
 
+def calculatePairwiseMatchingPercentages(sequences, use_only_core=True):
+	"""
+	Function to compute the proportion of matching positions between all pairs of aligned sequences. Positions which
+	are gaps in both sequences are never considered and, if use_only_core is True, neither are positions which are a gap
+	in either sequence. Counts are computed as products of per-character indicator matrices of the alignment rather than
+	by comparing sequences position by position.
+
+	:param sequences: list of aligned sequences (upper-case strings).
+	:param use_only_core: only consider positions which are not gaps in both sequences.
+	:return: (sequences x sequences) matrix of matching proportions, which are 0.0 for pairs without any positions to
+	         compare.
+	"""
+	aln_len = min([len(seq) for seq in sequences])
+	seq_matrix = np.frombuffer(''.join([seq[:aln_len] for seq in sequences]).encode('ascii'),
+							   dtype=np.uint8).reshape(len(sequences), aln_len)
+	nongap_matrix = (seq_matrix != ord('-')).astype(np.float32)
+	match_pos = np.zeros((len(sequences), len(sequences)))
+	for char in np.unique(seq_matrix).tolist():
+		if char == ord('-'): continue
+		char_matrix = (seq_matrix == char).astype(np.float32)
+		match_pos += char_matrix @ char_matrix.T
+	tot_comp_pos = (nongap_matrix @ nongap_matrix.T).astype(np.float64)
+	if not use_only_core:
+		nongap_pos = nongap_matrix.sum(axis=1, dtype=np.float64)
+		tot_comp_pos = nongap_pos[:, None] + nongap_pos[None, :] - tot_comp_pos
+	matching_percentages = np.zeros((len(sequences), len(sequences)))
+	np.divide(match_pos, tot_comp_pos, out=matching_percentages, where=tot_comp_pos > 0)
+	return matching_percentages
+
+
 def determineSeqSimProteinAlignment(protein_alignment_file, use_only_core=True):
 	protein_sequences = {}
 	with open(protein_alignment_file) as ocaf:
@@ -274,26 +342,19 @@ def determineSeqSimProteinAlignment(protein_alignment_file, use_only_core=True):
 			protein_sequences[rec.id] = str(rec.seq).upper()
 
 	pair_seq_matching = defaultdict(lambda: defaultdict(lambda: 0.0))
-	for i, g1 in enumerate(sorted(protein_sequences)):
+	sorted_seq_ids = sorted(protein_sequences)
+	if len(sorted_seq_ids) > 1:
+		matching_percentages = calculatePairwiseMatchingPercentages([protein_sequences[g] for g in sorted_seq_ids],
+																	 use_only_core=use_only_core)
+	for i, g1 in enumerate(sorted_seq_ids):
 		s1 = g1.split('|')[0]
-		g1s = protein_sequences[g1]
-		for j, g2 in enumerate(sorted(protein_sequences)):
-			if i >= j: continue
+		if i + 1 < len(sorted_seq_ids):
+			g1_matching_percentages = matching_percentages[i].tolist()
+		for j in range(i + 1, len(sorted_seq_ids)):
+			g2 = sorted_seq_ids[j]
 			s2 = g2.split('|')[0]
 			if s1 == s2: continue
-			g2s = protein_sequences[g2]
-			tot_comp_pos = 0
-			match_pos = 0
-			for pos, g1a in enumerate(g1s):
-				g2a = g2s[pos]
-				if g1a != '-' or g2a != '-':
-					if not use_only_core or (use_only_core and g1a != '-' and g2a != '-'):
-						tot_comp_pos += 1
-						if g1a == g2a:
-							match_pos += 1
-			general_matching_percentage = 0.0
-			if tot_comp_pos > 0:
-				general_matching_percentage = float(match_pos) / float(tot_comp_pos)
+			general_matching_percentage = g1_matching_percentages[j]
 			if pair_seq_matching[s1][s2] < general_matching_percentage and pair_seq_matching[s2][
 				s1] < general_matching_percentage:
 				pair_seq_matching[s1][s2] = general_matching_percentage
@@ -302,37 +363,34 @@ def determineSeqSimProteinAlignment(protein_alignment_file, use_only_core=True):
 	return pair_seq_matching
 
 
-def determineSeqSimCodonAlignment(codon_alignment_file, use_translation=False, use_only_core=True):
+def determineSeqSimCodonAlignment(codon_alignment_file, use_translation=False, use_only_core=True,
+								  codon_alignment_records=None):
+	# records of the codon alignment already in memory, as (id, sequence) pairs, can be provided to avoid re-reading
+	# the alignment file
+	if codon_alignment_records is None:
+		with open(codon_alignment_file) as ocaf:
+			codon_alignment_records = [(rec.id, str(rec.seq)) for rec in SeqIO.parse(ocaf, 'fasta')]
 	gene_sequences = {}
-	with open(codon_alignment_file) as ocaf:
-		for i, rec in enumerate(SeqIO.parse(ocaf, 'fasta')):
-			if use_translation:
-				gene_sequences[rec.id] = str(rec.seq.upper().translate().upper())
-			else:
-				gene_sequences[rec.id] = str(rec.seq).upper()
+	for rec_id, rec_seq in codon_alignment_records:
+		if use_translation:
+			gene_sequences[rec_id] = str(Seq(rec_seq.upper()).translate().upper())
+		else:
+			gene_sequences[rec_id] = rec_seq.upper()
 
 	pair_seq_matching = defaultdict(lambda: defaultdict(lambda: 0.0))
-	for i, g1 in enumerate(sorted(gene_sequences)):
+	sorted_seq_ids = sorted(gene_sequences)
+	if len(sorted_seq_ids) > 1:
+		matching_percentages = calculatePairwiseMatchingPercentages([gene_sequences[g] for g in sorted_seq_ids],
+																	 use_only_core=use_only_core)
+	for i, g1 in enumerate(sorted_seq_ids):
 		s1 = g1.split('|')[0]
-		g1s = gene_sequences[g1]
-		for j, g2 in enumerate(sorted(gene_sequences)):
-			if i >= j: continue
+		if i + 1 < len(sorted_seq_ids):
+			g1_matching_percentages = matching_percentages[i].tolist()
+		for j in range(i + 1, len(sorted_seq_ids)):
+			g2 = sorted_seq_ids[j]
 			s2 = g2.split('|')[0]
 			if s1 == s2: continue
-			g2s = gene_sequences[g2]
-			tot_comp_pos = 0
-			match_pos = 0
-			for pos, g1a in enumerate(g1s):
-				g2a = g2s[pos]
-				if g1a != '-' or g2a != '-':
-					if not use_only_core or (use_only_core and g1a != '-' and g2a != '-'):
-						tot_comp_pos += 1
-						if g1a == g2a:
-							match_pos += 1
-
-			general_matching_percentage = 0.0
-			if tot_comp_pos > 0:
-				general_matching_percentage = float(match_pos) / float(tot_comp_pos)
+			general_matching_percentage = g1_matching_percentages[j]
 			if pair_seq_matching[s1][s2] < general_matching_percentage and pair_seq_matching[s2][
 				s1] < general_matching_percentage:
 				pair_seq_matching[s1][s2] = general_matching_percentage
@@ -342,185 +400,216 @@ def determineSeqSimCodonAlignment(codon_alignment_file, use_translation=False, u
 
 
 def determineBGCSequenceSimilarity(input):
-	hg, s1, g1s, s2, g2s, i, j, use_only_core, comparisons_managed = input
-
-	comparison_id = '_|_'.join([hg, s1, s2, str(i), str(j)])
+	"""
+	Function to determine, for a single homolog group, the samples featuring it and the maximum sequence similarity
+	between instances of the homolog group for each pair of samples.
+	"""
+	hg, codon_alignment, use_translation, use_only_core = input
 
-	tot_comp_pos = 0
-	match_pos = 0
-	for pos, g1a in enumerate(g1s):
-		g2a = g2s[pos]
-		if g1a != '-' or g2a != '-':
-			if not use_only_core or (use_only_core and g1a != '-' and g2a != '-'):
-				tot_comp_pos += 1
-				if g1a == g2a:
-					match_pos += 1
-	general_matching_percentage = 0.0
-	if tot_comp_pos > 0:
-		general_matching_percentage = float(match_pos) / float(tot_comp_pos)
-	comparisons_managed[comparison_id] = general_matching_percentage
+	gene_sequences = {}
+	with open(codon_alignment) as oca:
+		for i, rec in enumerate(SeqIO.parse(oca, 'fasta')):
+			if use_translation:
+				gene_sequences[rec.id] = str(rec.seq.upper().translate().upper())
+			else:
+				gene_sequences[rec.id] = str(rec.seq).upper()
+	genes = list(gene_sequences.keys())
+	samples = set([g.split('|')[0] for g in genes])
+
+	hg_pair_seq_matching = defaultdict(float)
+	if len(genes) > 1:
+		matching_percentages = calculatePairwiseMatchingPercentages([gene_sequences[g] for g in genes],
+																	 use_only_core=use_only_core)
+		for i, g1 in enumerate(genes):
+			s1 = g1.split('|')[0]
+			g1_matching_percentages = matching_percentages[i].tolist()
+			for j in range(i + 1, len(genes)):
+				s2 = genes[j].split('|')[0]
+				if s1 == s2: continue
+				general_matching_percentage = g1_matching_percentages[j]
+				if hg_pair_seq_matching[(s1, s2)] < general_matching_percentage:
+					hg_pair_seq_matching[(s1, s2)] = general_matching_percentage
+	return [hg, samples, dict(hg_pair_seq_matching)]
 
 
 def determineBGCSequenceSimilarityFromCodonAlignments(codon_alignments_file, cpus=1, use_translation=False,
 													  use_only_core=True):
+	"""
+	Function to compute the BGC sequence and content similarity between all pairs of samples from the codon alignments
+	of their homolog groups. Returns the sorted list of samples along with two dense n x n matrices indexed by it: the
+	average sequence similarity across shared homolog groups (NaN where samples share none) and the Jaccard
+	similarity in homolog group content.
+	"""
 	sample_hgs = defaultdict(set)
-	comparisons_managed = None
-	pair_seq_matching = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: 0.0)))
-	with multiprocessing.Manager() as manager:
-		comparisons_managed = manager.dict()
-		multiprocess_inputs = []
-		with open(codon_alignments_file) as ocaf:
-			for line in ocaf:
-				line = line.strip()
-				hg, codon_alignment = line.split('\t')
-				gene_sequences = {}
-				allele_identifiers = {}
-				with open(codon_alignment) as oca:
-					for i, rec in enumerate(SeqIO.parse(oca, 'fasta')):
-						if use_translation:
-							gene_sequences[rec.id] = str(rec.seq.upper().translate().upper())
-						else:
-							gene_sequences[rec.id] = str(rec.seq).upper()
-						allele_identifiers[rec.id] = i
-						sample = rec.id.split('|')[0]
-						sample_hgs[sample].add(hg)
-
-				for i, g1 in enumerate(gene_sequences):
-					s1 = g1.split('|')[0]
-					g1s = gene_sequences[g1]
-					for j, g2 in enumerate(gene_sequences):
-						if i >= j: continue
-						s2 = g2.split('|')[0]
-						if s1 == s2: continue
-						g2s = gene_sequences[g2]
-						multiprocess_inputs.append([hg, s1, g1s, s2, g2s, i, j, use_only_core, comparisons_managed])
-		with manager.Pool(cpus) as pool:
-			pool.map(determineBGCSequenceSimilarity, multiprocess_inputs)
-
-		for comp in comparisons_managed:
-			hg, s1, s2, i, j = comp.split('_|_')
-			general_matching_percentage = comparisons_managed[comp]
-			if pair_seq_matching[s1][s2][hg] < general_matching_percentage and pair_seq_matching[s2][s1][
-				hg] < general_matching_percentage:
-				pair_seq_matching[s1][s2][hg] = general_matching_percentage
-				pair_seq_matching[s2][s1][hg] = general_matching_percentage
-
-	bgc_pairwise_similarities = defaultdict(lambda: defaultdict(lambda: ["NA", "NA"]))
-	for i, s1 in enumerate(sorted(sample_hgs)):
-		for j, s2 in enumerate(sorted(sample_hgs)):
-			if i >= j: continue
-			common_hgs = sample_hgs[s1].intersection(sample_hgs[s2])
-			total_hgs = sample_hgs[s1].union(sample_hgs[s2])
-			sum_pair_seq_matching = 0.0
-			for hg in common_hgs:
-				sum_pair_seq_matching += pair_seq_matching[s1][s2][hg]
-			if len(common_hgs) > 0:
-				bgc_pairwise_similarities[s1][s2] = [sum_pair_seq_matching / float(len(common_hgs)),
-													 float(len(common_hgs)) / float(len(total_hgs))]
-				bgc_pairwise_similarities[s2][s1] = [sum_pair_seq_matching / float(len(common_hgs)),
-													 float(len(common_hgs)) / float(len(total_hgs))]
-			else:
-				bgc_pairwise_similarities[s1][s2] = ["NA", 0.0]
-				bgc_pairwise_similarities[s2][s1] = ["NA", 0.0]
+	hg_results = []
+	multiprocess_inputs = []
+	with open(codon_alignments_file) as ocaf:
+		for line in ocaf:
+			line = line.strip()
+			hg, codon_alignment = line.split('\t')
+			multiprocess_inputs.append([hg, codon_alignment, use_translation, use_only_core])
+
+	# each homolog group is handled by a single worker, which computes the similarities between all its instances at
+	# once and returns only the maximum similarity per pair of samples
+	with multiprocessing.Pool(cpus) as pool:
+		for hg, hg_samples, hg_pair_seq_matching in pool.imap_unordered(determineBGCSequenceSimilarity, multiprocess_inputs):
+			for sample in hg_samples:
+				sample_hgs[sample].add(hg)
+			hg_results.append(hg_pair_seq_matching)
+
+	samples = sorted(sample_hgs)
+	sample_index = dict((s, i) for i, s in enumerate(samples))
+	hgs = sorted(set([hg for s in sample_hgs for hg in sample_hgs[s]]))
+	hg_index = dict((hg, k) for k, hg in enumerate(hgs))
+
+	presence = np.zeros((len(samples), len(hgs)), dtype=np.float32)
+	for s in sample_hgs:
+		presence[sample_index[s], [hg_index[hg] for hg in sample_hgs[s]]] = 1.0
+	common_hgs = presence @ presence.T
+	total_hgs = presence.sum(axis=1)[:, None] + presence.sum(axis=1)[None, :] - common_hgs
+
+	sum_pair_seq_matching = np.zeros((len(samples), len(samples)), dtype=np.float64)
+	for hg_pair_seq_matching in hg_results:
+		hg_max_matching = defaultdict(float)
+		for (s1, s2), general_matching_percentage in hg_pair_seq_matching.items():
+			i, j = sorted([sample_index[s1], sample_index[s2]])
+			if hg_max_matching[(i, j)] < general_matching_percentage:
+				hg_max_matching[(i, j)] = general_matching_percentage
+		if hg_max_matching:
+			ij = np.array(list(hg_max_matching.keys()))
+			sum_pair_seq_matching[ij[:, 0], ij[:, 1]] += np.array(list(hg_max_matching.values()))
+	sum_pair_seq_matching = np.triu(sum_pair_seq_matching, k=1)
+	sum_pair_seq_matching += sum_pair_seq_matching.T
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		seq_sim = np.where(common_hgs > 0, sum_pair_seq_matching / common_hgs, np.nan).astype(np.float32)
+		jaccard_sim = np.where(total_hgs > 0, common_hgs / total_hgs, 0.0).astype(np.float32)
+	np.fill_diagonal(seq_sim, np.nan)
+	np.fill_diagonal(jaccard_sim, 0.0)
+
+	return [samples, seq_sim, jaccard_sim]
+
+
+def calculatePairwiseAlleleMatches(sequences):
+	"""
+	Function to count, for all pairs of aligned sequences, the positions at which both feature the same valid allele
+	(A, C, G or T) and the positions at which both feature any valid allele. Counts are computed as products of
+	per-allele indicator matrices of the alignment rather than by comparing sequences position by position.
 
-	return bgc_pairwise_similarities
+	:param sequences: list of aligned sequences (upper-case strings).
+	:return: (sequences x sequences) matrices of matching positions and of positions valid in both sequences, and an
+	         array of the number of valid positions in each sequence.
+	"""
+	aln_len = min([len(seq) for seq in sequences])
+	seq_matrix = np.frombuffer(''.join([seq[:aln_len] for seq in sequences]).encode('ascii'),
+							   dtype=np.uint8).reshape(len(sequences), aln_len)
+	allele_codes = allele_code_lut[seq_matrix]
+	# one-hot encoding of the alleles at each position, so matches at all positions are counted in a single product
+	allele_matrix = (allele_codes[:, :, None] == np.arange(len(valid_alleles), dtype=np.uint8)).reshape(
+		len(sequences), aln_len * len(valid_alleles)).astype(np.float32)
+	match_pos = (allele_matrix @ allele_matrix.T).astype(np.float64)
+	valid_matrix = (allele_codes < len(valid_alleles)).astype(np.float32)
+	valid_pos_both = (valid_matrix @ valid_matrix.T).astype(np.float64)
+	valid_pos = valid_matrix.sum(axis=1, dtype=np.float64)
+	return match_pos, valid_pos_both, valid_pos
 
 
 def determineAllelesFromCodonAlignment(codon_alignment, max_mismatch=10, matching_percentage_cutoff=0.99,
 									   filter_by_genelength=True):
-	gene_sequences = {}
+	"""
+	Function to cluster the sequences of a codon alignment into alleles, using single-linkage clustering of pairs of
+	sequences which are sufficiently similar.
+
+	:return: list of the allele clusters, a (genes x genes) matrix of the matching proportion of each pair of genes, set
+	         for pairs with the gene of the row preceding that of the column in the alignment, and a dictionary of the
+	         row/column index of each gene in this matrix.
+	"""
+	# the alignment is read once into parallel lists of identifiers, sequences and ungapped lengths
+	rec_ids = []
+	rec_seqs = []
 	gene_sequences_lengths = []
-	allele_identifiers = {}
-	seqs_comprehensive = set([])
 	with open(codon_alignment) as oca:
-		for i, rec in enumerate(SeqIO.parse(oca, 'fasta')):
-			gene_sequences_lengths.append(len(str(rec.seq).upper().replace('N', '').replace('-', '')))
+		for rec in SeqIO.parse(oca, 'fasta'):
+			rec_seq = str(rec.seq).upper()
+			rec_ids.append(rec.id)
+			rec_seqs.append(rec_seq)
+			gene_sequences_lengths.append(len(rec_seq.replace('N', '').replace('-', '')))
 	median_length = statistics.median(gene_sequences_lengths)
 	mad_length = max(stats.median_abs_deviation(gene_sequences_lengths, scale="normal"), 5)
-	with open(codon_alignment) as oca:
-		for i, rec in enumerate(SeqIO.parse(oca, 'fasta')):
-			gene_seq_len = len(str(rec.seq).upper().replace('N', '').replace('-', ''))
-			if filter_by_genelength and (
-					gene_seq_len < (median_length - mad_length) or gene_seq_len > (median_length + mad_length)):
-				continue
-			gene_sequences[rec.id] = str(rec.seq).upper()
-			allele_identifiers[rec.id] = i
-			seqs_comprehensive.add(rec.id)
+
+	genes = []
+	gene_seqs = []
+	allele_identifiers = {}
+	for i, gene_seq_len in enumerate(gene_sequences_lengths):
+		if filter_by_genelength and (
+				gene_seq_len < (median_length - mad_length) or gene_seq_len > (median_length + mad_length)):
+			continue
+		genes.append(rec_ids[i])
+		gene_seqs.append(rec_seqs[i])
+		allele_identifiers[rec_ids[i]] = i
+	gene_index = {}
+	for gi, gene in enumerate(genes):
+		gene_index[gene] = gi
 
 	pairs = []
-	seqs_paired = set([])
-	pair_matching = defaultdict(lambda: defaultdict(float))
-	for i, g1 in enumerate(gene_sequences):
-		g1s = gene_sequences[g1]
-		for j, g2 in enumerate(gene_sequences):
-			if i >= j: continue
-			g2s = gene_sequences[g2]
-			tot_comp_pos = 0
-			g1_comp_pos = 0
-			g2_comp_pos = 0
-			match_pos = 0
-			mismatch_pos = 0
-			for pos, g1a in enumerate(g1s):
-				g2a = g2s[pos]
-				if g1a in valid_alleles and g2a in valid_alleles:
-					if g1a != g2a:
-						mismatch_pos += 1
-				if g1a in valid_alleles or g2a in valid_alleles:
-					tot_comp_pos += 1
-					if g1a == g2a:
-						match_pos += 1
-				if g1a in valid_alleles:
-					g1_comp_pos += 1
-				if g2a in valid_alleles:
-					g2_comp_pos += 1
-			general_matching_percentage = float(match_pos) / float(tot_comp_pos)
-			g1_matching_percentage = float(match_pos) / float(g1_comp_pos)
-			g2_matching_percentage = float(match_pos) / float(g2_comp_pos)
-			pair_matching[g1][g2] = general_matching_percentage
-			if general_matching_percentage >= matching_percentage_cutoff or g1_matching_percentage >= matching_percentage_cutoff or g2_matching_percentage >= matching_percentage_cutoff:
-				if mismatch_pos <= max_mismatch:
-					seqs_paired.add(g1)
-					seqs_paired.add(g2)
-					pairs.append(sorted([g1, g2]))
-
-	"""	
-	Solution for single-linkage clustering taken from mimomu's repsonse in the stackoverflow page:
-	https://stackoverflow.com/questions/4842613/merge-lists-that-share-common-elements?lq=1
-	"""
-	L = pairs
-	LL = set(itertools.chain.from_iterable(L))
-	for each in LL:
-		components = [x for x in L if each in x]
-		for i in components:
-			L.remove(i)
-		L += [list(set(itertools.chain.from_iterable(components)))]
-
-	for seq in seqs_comprehensive:
-		if not seq in seqs_paired:
-			L.append([seq])
-
-	allele_cluster_min_id = {}
-	for allele_cluster in L:
-		gene_identifiers = set([])
-		for gene in allele_cluster:
-			gene_identifiers.add(allele_identifiers[gene])
-		min_gi = min(gene_identifiers)
-		allele_cluster_min_id[min_gi] = allele_cluster
+	pair_matching = np.zeros((len(genes), len(genes)))
+	if len(genes) > 1:
+		# matching statistics for all pairs of sequences are computed at once from the alignment as a byte matrix
+		match_pos, valid_pos_both, valid_pos = calculatePairwiseAlleleMatches(gene_seqs)
+		mismatch_pos = valid_pos_both - match_pos
+		tot_comp_pos = valid_pos[:, None] + valid_pos[None, :] - valid_pos_both
+		with np.errstate(divide='ignore', invalid='ignore'):
+			general_matching_percentages = match_pos / tot_comp_pos
+			g1_matching_percentages = match_pos / valid_pos[:, None]
+			g2_matching_percentages = match_pos / valid_pos[None, :]
+		paired = ((general_matching_percentages >= matching_percentage_cutoff) |
+				  (g1_matching_percentages >= matching_percentage_cutoff) |
+				  (g2_matching_percentages >= matching_percentage_cutoff)) & (mismatch_pos <= max_mismatch)
+
+		pair_matching = np.triu(general_matching_percentages, k=1)
+		pairs = np.argwhere(np.triu(paired, k=1)).tolist()
+
+	# single-linkage clustering of paired genes using a disjoint-set forest over gene indices, with path compression
+	# and union by rank
+	parent = list(range(len(genes)))
+	rank = [0] * len(genes)
+	for i, j in pairs:
+		roots = []
+		for x in [i, j]:
+			root = x
+			while parent[root] != root:
+				root = parent[root]
+			while parent[x] != root:
+				parent[x], x = root, parent[x]
+			roots.append(root)
+		ri, rj = roots
+		if ri == rj: continue
+		if rank[ri] < rank[rj]:
+			ri, rj = rj, ri
+		parent[rj] = ri
+		if rank[ri] == rank[rj]:
+			rank[ri] += 1
+
+	allele_cluster_min_id = defaultdict(list)
+	cluster_root_min_id = {}
+	for gi, gene in enumerate(genes):
+		root = gi
+		while parent[root] != root:
+			root = parent[root]
+		if not root in cluster_root_min_id:
+			cluster_root_min_id[root] = allele_identifiers[gene]
+		allele_cluster_min_id[cluster_root_min_id[root]].append(gene)
 
 	allele_clusters = defaultdict(set)
 	for i, aci in enumerate(sorted(allele_cluster_min_id.keys())):
 		for gene in allele_cluster_min_id[aci]:
 			allele_clusters['Allele_Cluster_' + str(i + 1)].add(gene)
 
-	return [allele_clusters, pair_matching]
+	return [allele_clusters, pair_matching, gene_index]
 
 
 def cleanUpSampleName(original_name):
-	return original_name.replace('#', '').replace('*', '_').replace(':', '_').replace(';', '_').replace(' ',
-																										'_').replace(
-		':', '_').replace('|', '_').replace('"', '_').replace("'", '_').replace("=", "_").replace('-', '_').replace('(',
-																													'').replace(
-		')', '').replace('/', '').replace('\\', '').replace('[', '').replace(']', '').replace(',', '')
+	return original_name.translate(sample_name_cleanup_table)
 
 
 def read_pair_generator_defunct(bam, region_string=None, start=None, stop=None):
@@ -554,89 +643,130 @@ def read_pair_generator(bam, region_string, reference_length, max_insert_size=50
     Reads are added to read_dict until a pair is found.
     """
 
-	read_reverse_counts = defaultdict(int)
-	read_forward_counts = defaultdict(int)
+	# reads are gathered in a single pass over the region, since whether a read can be paired depends on how many
+	# alignments its template has in total
+	qname_reads = {}
+	second_read_qnames = []
+	mate_unmapped_reads = []
+	get_qname_reads = qname_reads.get
+	add_second_read_qname = second_read_qnames.append
+	add_mate_unmapped_read = mate_unmapped_reads.append
 	for read in bam.fetch(region_string):
 		if read.is_supplementary: continue
 		qname = read.query_name
-		if read.is_reverse:
-			read_reverse_counts[qname] += 1
+		reads = get_qname_reads(qname)
+		if reads is None:
+			qname_reads[qname] = [read]
 		else:
-			read_forward_counts[qname] += 1
+			reads.append(read)
+			if len(reads) == 2:
+				add_second_read_qname(qname)
+		if read.mate_is_unmapped:
+			add_mate_unmapped_read(read)
 
 	visited = set([])
-	read_dict = defaultdict(lambda: [None, None])
-	for read in bam.fetch(region_string):
-		if read.is_supplementary: continue
-		qname = read.query_name
-		if read_reverse_counts[qname] > 1 or read_forward_counts[qname] > 1: continue
-		if qname not in read_dict:
+	for qname in second_read_qnames:
+		reads = qname_reads[qname]
+		if len(reads) != 2 or reads[0].is_reverse == reads[1].is_reverse: continue
+		first_read, read = reads
+		read_pair = [None, None]
+		if first_read.is_read1:
+			read_pair[0] = first_read
+		else:
+			read_pair[1] = first_read
+		# report proper pair paired-end reads, discard cases where both reads map to reference contig
+		# but in an improper fashion.
+		if read.is_proper_pair:
 			if read.is_read1:
-				read_dict[qname][0] = read
+				yield read, read_pair[1]
 			else:
-				read_dict[qname][1] = read
-		else:
-			# report proper pair paired-end reads, discard cases where both reads map to reference contig
-			# but in an improper fashion.
-			if read.is_proper_pair:
-				if read.is_read1:
-					yield read, read_dict[qname][1]
-				else:
-					yield read_dict[qname][0], read
-			visited.add(qname)
-			del read_dict[qname]
+				yield read_pair[0], read
+		visited.add(qname)
 
-	for read in bam.fetch(region_string):
+	for read in mate_unmapped_reads:
 		qname = read.query_name
 		if qname in visited: continue
-		if read.is_supplementary or (not read.mate_is_unmapped): continue
 
+		# the first and last query positions aligned to the reference are determined from the CIGAR operations
 		first_real_alignment_pos = None
 		last_real_alignment_pos = None
-		indel_positions = set([])
-		match = 0
-		aligned = 0
-		for b in read.get_aligned_pairs(with_seq=True):
-			if b[0] != None and b[1] != None and b[2] != None:
+		query_pos = 0
+		for op, op_length in read.cigartuples:
+			if op in (0, 7, 8):
 				if first_real_alignment_pos == None:
-					first_real_alignment_pos = b[0]
-				last_real_alignment_pos = b[0]
-				if b[2].isupper():
-					match += 1
-				aligned += 1
-			else:
-				indel_positions.add(b[0])
-		main_alignment_positions = set(range(first_real_alignment_pos, last_real_alignment_pos + 1))
-		has_indel = len(main_alignment_positions.intersection(indel_positions)) > 0
+					first_real_alignment_pos = query_pos
+				last_real_alignment_pos = query_pos + op_length - 1
+			if op in (0, 1, 4, 7, 8):
+				query_pos += op_length
+		if first_real_alignment_pos == None: continue
 
-		matching_percentage = match / aligned
 		positionally_checks_out = False
 		if read.is_reverse:
-			min_position = min(main_alignment_positions)
-			positionally_checks_out = (min_position - max_insert_size) < 0
+			positionally_checks_out = (first_real_alignment_pos - max_insert_size) < 0
 		else:
-			max_position = max(main_alignment_positions)
-			positionally_checks_out = (max_position + max_insert_size) > reference_length
+			positionally_checks_out = (last_real_alignment_pos + max_insert_size) > reference_length
 
-		if (positionally_checks_out):  # and (matching_percentage >= 0.95):
-			yield read_dict[qname][0], read_dict[qname][1]
+		if (positionally_checks_out):
+			read_pair = [None, None]
+			if len(qname_reads[qname]) == 1:
+				if read.is_read1:
+					read_pair[0] = read
+				else:
+					read_pair[1] = read
+			yield read_pair[0], read_pair[1]
 
 
 def getSpeciesRelationshipsFromPhylogeny(species_phylogeny, samples_in_gcf):
-	samples_in_phylogeny = set([])
+	"""
+	Function to compute the phylogenetic distances between all pairs of samples featuring a GCF. Distances are gathered
+	in a single postorder traversal of the phylogeny, where each pair of leaves is resolved at their most recent common
+	ancestor, rather than tracing the path between each pair of leaves separately.
+
+	:param species_phylogeny: path to Newick species phylogeny.
+	:param samples_in_gcf: set of samples featuring the GCF.
+
+	:return pairwise_distances: (samples x samples) float64 numpy matrix of pairwise distances between samples, which
+								replaces the former nested dictionary keyed by sample names.
+	:return samples_in_gcf_and_phylogeny: sorted list of samples found in both the GCF and the phylogeny, giving the
+										  order of rows/columns in the distance matrix.
+	:return samples_in_phylogeny: set of all samples/leaves in the phylogeny.
+	"""
 	t = Tree(species_phylogeny)
-	for leaf in t:
-		samples_in_phylogeny.add(str(leaf).strip('\n').lstrip('-'))
-
-	pairwise_distances = defaultdict(lambda: defaultdict(float))
-	for s1 in samples_in_gcf.intersection(samples_in_phylogeny):
-		for s2 in samples_in_gcf.intersection(samples_in_phylogeny):
-			try:
-				s1_s2_dist = t.get_distance(s1, s2)
-				pairwise_distances[s1][s2] = s1_s2_dist
-			except:
-				pass
-	return ([pairwise_distances, samples_in_phylogeny])
+	samples_in_phylogeny = set(t.get_leaf_names())
+
+	samples_in_gcf_and_phylogeny = sorted(samples_in_gcf.intersection(samples_in_phylogeny))
+	sample_index = {}
+	for i, s in enumerate(samples_in_gcf_and_phylogeny):
+		sample_index[s] = i
+	pairwise_distances = np.zeros((len(samples_in_gcf_and_phylogeny), len(samples_in_gcf_and_phylogeny)))
+
+	root_distances = {}
+	sample_root_distances = np.zeros(len(samples_in_gcf_and_phylogeny))
+	for node in t.traverse('preorder'):
+		if node.is_root():
+			root_distances[node] = 0.0
+		else:
+			root_distances[node] = root_distances[node.up] + node.dist
+		if node.is_leaf() and node.name in sample_index:
+			sample_root_distances[sample_index[node.name]] = root_distances[node]
+
+	node_samples = {}
+	for node in t.traverse('postorder'):
+		if node.is_leaf():
+			node_samples[node] = []
+			if node.name in sample_index:
+				node_samples[node] = [sample_index[node.name]]
+			continue
+		children_samples = [node_samples.pop(child) for child in node.children]
+		for ci, ci_samples in enumerate(children_samples):
+			if len(ci_samples) == 0: continue
+			for cj_samples in children_samples[ci + 1:]:
+				if len(cj_samples) == 0: continue
+				ci_cj_distances = sample_root_distances[ci_samples][:, None] + sample_root_distances[cj_samples][None, :] - 2 * root_distances[node]
+				pairwise_distances[np.ix_(ci_samples, cj_samples)] = ci_cj_distances
+				pairwise_distances[np.ix_(cj_samples, ci_samples)] = ci_cj_distances.T
+		node_samples[node] = list(itertools.chain.from_iterable(children_samples))
+	return ([pairwise_distances, samples_in_gcf_and_phylogeny, samples_in_phylogeny])
 
 
 def runBowtie2Alignments(bowtie2_reference, paired_end_sequencing_file, bowtie2_outdir, logObject, cpus=1):
@@ -690,7 +820,7 @@ def bowtie2_alignment(input_args):
 	bowtie2_cmd = ['bowtie2', '--very-sensitive-local', '--no-unal', '-a', '-x', bowtie2_reference, '-U',
 				   ','.join(reads), '-S', sam_file, '-p', str(bowtie2_cpus)]
 
-	samtools_view_cmd = ['samtools', 'view', '-h', '-Sb', sam_file, '>', bam_file]
+	samtools_view_cmd = ['samtools', 'view', '-h', '-Sb', sam_file, '-o', bam_file]
 	samtools_sort_cmd = ['samtools', 'sort', '-@', str(bowtie2_cpus), bam_file, '-o', bam_file_sorted]
 	samtools_index_cmd = ['samtools', 'index', bam_file_sorted]
 
@@ -735,7 +865,6 @@ def createBGCGenbank(full_genbank_file, new_genbank_file, scaffold, start_coord,
 	"""
 	try:
 		ngf_handle = open(new_genbank_file, 'w')
-		pruned_coords = set(range(start_coord, end_coord + 1))
 		with open(full_genbank_file) as ogbk:
 			for rec in SeqIO.parse(ogbk, 'genbank'):
 				if not rec.id == scaffold: continue
@@ -748,16 +877,20 @@ def createBGCGenbank(full_genbank_file, new_genbank_file, scaffold, start_coord,
 
 				new_seq_object = Seq(filtered_seq)
 
-				updated_rec = copy.deepcopy(rec)
-				updated_rec.seq = new_seq_object
+				# a new record is constructed rather than a deep copy of the full-length one, only the retained features are
+				# carried over below
+				updated_rec = SeqRecord(new_seq_object, id=rec.id, name=rec.name, description=rec.description,
+									   dbxrefs=list(rec.dbxrefs), annotations=dict(rec.annotations))
 
 				updated_features = []
 				for feature in rec.features:
-					all_coords, start, end, direction, is_multi_part = parseCDSCoord(str(feature.location))
-					feature_coords = set(range(start, end + 1))
-					if len(feature_coords.intersection(pruned_coords)) > 0:
+					start = int(feature.location.start) + 1
+					end = int(feature.location.end)
+					if end >= start_coord and start <= end_coord:
 						fls = []
-						for sc, ec, dc in all_coords:
+						for part in feature.location.parts:
+							sc = int(part.start) + 1
+							ec = int(part.end)
 							updated_start = sc - start_coord + 1
 							updated_end = ec - start_coord + 1
 							if ec > end_coord:
@@ -774,15 +907,14 @@ def createBGCGenbank(full_genbank_file, new_genbank_file, scaffold, start_coord,
 									updated_start = 1  # ; flag2 = True
 
 							strand = 1
-							if dc == '-':
+							if part.strand == -1:
 								strand = -1
 							fls.append(FeatureLocation(updated_start - 1, updated_end, strand=strand))
 						if len(fls) > 0:
 							updated_location = fls[0]
 							if len(fls) > 1:
 								updated_location = sum(fls)
-							feature.location = updated_location
-							updated_features.append(feature)
+							updated_features.append(SeqFeature(updated_location, type=feature.type, qualifiers=feature.qualifiers))
 				updated_rec.features = updated_features
 				SeqIO.write(updated_rec, ngf_handle, 'genbank')
 		ngf_handle.close()
@@ -810,7 +942,7 @@ def parseGenbankAndFindBoundaryGenes(inputs):
 	gene_id_to_order = defaultdict(dict)
 	gene_order_to_id = defaultdict(dict)
 
-	sample, sample_genbank, sample_gbk_info = inputs
+	sample, sample_genbank = inputs
 	osg = None
 	if sample_genbank.endswith('.gz'):
 		osg = gzip.open(sample_genbank, 'rt')
@@ -818,21 +950,24 @@ def parseGenbankAndFindBoundaryGenes(inputs):
 		osg = open(sample_genbank)
 	for rec in SeqIO.parse(osg, 'genbank'):
 		scaffold = rec.id
-		scaffold_length = len(str(rec.seq))
-		boundary_ranges = set(range(1, distance_to_scaffold_boundary + 1)).union(
-			set(range(scaffold_length - distance_to_scaffold_boundary, scaffold_length + 1)))
+		scaffold_length = len(rec.seq)
 		gene_starts = []
 		for feature in rec.features:
 			if not feature.type == 'CDS': continue
 			locus_tag = feature.qualifiers.get('locus_tag')[0]
 
-			all_coords, start, end, direction, is_multi_part = parseCDSCoord(str(feature.location))
+			start = int(feature.location.start) + 1
+			end = int(feature.location.end)
+			direction = '?'
+			if feature.location.strand == 1:
+				direction = '+'
+			elif feature.location.strand == -1:
+				direction = '-'
 
 			gene_location[locus_tag] = {'scaffold': scaffold, 'start': start, 'end': end, 'direction': direction}
 			scaffold_genes[scaffold].add(locus_tag)
 
-			gene_range = set(range(start, end + 1))
-			if len(gene_range.intersection(boundary_ranges)) > 0:
+			if start <= distance_to_scaffold_boundary or end >= (scaffold_length - distance_to_scaffold_boundary):
 				boundary_genes.add(locus_tag)
 
 			gene_starts.append([locus_tag, start])
@@ -841,8 +976,8 @@ def parseGenbankAndFindBoundaryGenes(inputs):
 			gene_id_to_order[scaffold][g[0]] = i
 			gene_order_to_id[scaffold][i] = g[0]
 	osg.close()
-	sample_gbk_info[sample] = [gene_location, dict(scaffold_genes), boundary_genes, dict(gene_id_to_order),
-							   dict(gene_order_to_id)]
+	return [sample, [gene_location, dict(scaffold_genes), boundary_genes, dict(gene_id_to_order),
+					 dict(gene_order_to_id)]]
 
 
 def chunks(lst, n):
@@ -890,8 +1025,7 @@ def calculateMashPairwiseDifferences(fasta_listing_file, outdir, name, sketch_si
 	mash_sketch_cmd = ['mash', 'sketch', '-p', str(cpus), '-s', str(sketch_size), '-o', mash_db, '-l', mash_input_file]
 	logObject.info('Running mash sketch with the following command: %s' % ' '.join(mash_sketch_cmd))
 	try:
-		subprocess.call(' '.join(mash_sketch_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		subprocess.call(mash_sketch_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 		logObject.info('Successfully ran: %s' % ' '.join(mash_sketch_cmd))
 	except:
 		error_message = 'Had an issue running: %s' % ' '.join(mash_sketch_cmd)
@@ -906,30 +1040,29 @@ def calculateMashPairwiseDifferences(fasta_listing_file, outdir, name, sketch_si
 		logObject.error(error_message)
 		raise RuntimeError(error_message)
 
-	# run mash distance estimation
-	mash_dist_cmd = ['mash', 'dist', '-s', str(sketch_size), '-p', str(cpus), mash_db, mash_db, '>',
-					 outdir + name + '.out']
-	logObject.info('Running mash dist with the following command: %s' % ' '.join(mash_dist_cmd))
+	# run mash distance estimation, reporting distances as a (query x reference) table
+	mash_dist_cmd = ['mash', 'dist', '-t', '-s', str(sketch_size), '-p', str(cpus), mash_db, mash_db]
+	mash_dist_output_file = outdir + name + '.out'
+	logObject.info('Running mash dist with the following command: %s > %s' % (' '.join(mash_dist_cmd), mash_dist_output_file))
 	try:
-		subprocess.call(' '.join(mash_dist_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		with open(mash_dist_output_file, 'w') as mash_dist_output_handle:
+			subprocess.call(mash_dist_cmd, stdout=mash_dist_output_handle, stderr=subprocess.DEVNULL)
 		logObject.info('Successfully ran: %s' % ' '.join(mash_dist_cmd))
 	except:
 		error_message = 'Had an issue running: %s' % ' '.join(mash_dist_cmd)
 		logObject.error(error_message)
 		raise RuntimeError(error_message)
 
+	import pandas as pd
 	pairwise_similarities = defaultdict(lambda: defaultdict(float))
 	try:
-		with open(outdir + name + '.out') as of:
-			for line in of:
-				line = line.strip()
-				ls = line.split('\t')
-				f1, f2, dist = ls[:3]
-				dist = float(dist)
-				n1 = fasta_to_name[f1]
-				n2 = fasta_to_name[f2]
-				pairwise_similarities[n1][n2] = (1.0 - dist)
+		mash_dist_df = pd.read_csv(mash_dist_output_file, sep='\t', engine='c', index_col=0)
+		query_names = [fasta_to_name[f] for f in mash_dist_df.index]
+		reference_names = [fasta_to_name[f] for f in mash_dist_df.columns]
+		similarities = (1.0 - mash_dist_df.values).tolist()
+		for qi, n2 in enumerate(query_names):
+			for ri, n1 in enumerate(reference_names):
+				pairwise_similarities[n1][n2] = similarities[qi][ri]
 	except:
 		error_message = 'Had issues reading the output of MASH dist anlaysis in: %s.out' % outdir + name
 		logObject.error(error_message)
@@ -972,8 +1105,7 @@ def runFastANI(fasta_listing_file, outdir, fastani_output_file, cpus, logObject,
 					   fastani_output_file]
 		logObject.info('Running fastANI  with the following command: %s' % ' '.join(fastani_cmd))
 		try:
-			subprocess.call(' '.join(fastani_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(fastani_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			logObject.info('Successfully ran: %s' % ' '.join(fastani_cmd))
 		except:
 			error_message = 'Had an issue running: %s' % ' '.join(fastani_cmd)
@@ -1047,8 +1179,7 @@ def runCompareM(fasta_listing_file, comparem_results_dir, cpus, logObject, prune
 						comparem_results_dir]
 		logObject.info('Running CompareM  with the following command: %s' % ' '.join(comparem_cmd))
 		try:
-			subprocess.call(' '.join(comparem_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-							executable='/bin/bash')
+			subprocess.call(comparem_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			logObject.info('Successfully ran: %s' % ' '.join(comparem_cmd))
 		except:
 			error_message = 'Had an issue running: %s' % ' '.join(comparem_cmd)
@@ -1095,44 +1226,65 @@ def parseOrthoFinderMatrix(orthofinder_matrix_file, relevant_gene_lts, all_prima
 	:return hg_median_gene_counts: median copy count for each homolog group
 	:return hg_multicopy_proportion: proportion of samples with homolog group which have multiple (paralogous) genes in the homolog group.
 	"""
+	import pandas as pd
 	gene_to_hg = {}
 	hg_genes = defaultdict(set)
 	hg_multicopy_proportion = defaultdict(lambda: 'NA')
 	hg_median_gene_counts = defaultdict(lambda: 'NA')
-	with open(orthofinder_matrix_file) as ofm:
-		for i, line in enumerate(ofm):
-			if i == 0: continue
-			line = line.strip('\n')
-			ls = line.split('\t')
-			hg = ls[0]
-			flag_in_bgc = False
-			for sgs in ls[1:]:
-				for g in sgs.split(', '):
-					if g in relevant_gene_lts:
-						flag_in_bgc = True
-						gene_to_hg[g] = hg
-						hg_genes[hg].add(g)
-			if flag_in_bgc:
-				gene_counts = []
-				for sgs in ls[1:]:
-					# critical for calculating homolog group stats, like median gene counts, multicopy proportion
-					# use only genes from the original set of genomes used to conduct full orthofinder analysis.
-					gene_counts.append(len([x for x in sgs.split(', ') if (len(x.split('_')[0]) == 3 or all_primary)]))
-
-				hg_multicopy_proportion[hg] = float(sum([1 for x in gene_counts if x > 1])) / sum(
-					[1 for x in gene_counts if x > 0])
-				hg_median_gene_counts[hg] = statistics.median(gene_counts)
+
+	# the matrix is reshaped to one row per gene (indexed by its homolog group's row in the matrix) so that genes
+	# found in BGCs are identified with a single membership test
+	of_matrix_df = pd.read_csv(orthofinder_matrix_file, sep='\t', dtype=str, keep_default_na=False).fillna('')
+	hgs = of_matrix_df.iloc[:, 0].tolist()
+	of_genes_df = of_matrix_df.iloc[:, 1:].melt(ignore_index=False)
+	of_genes_df['gene'] = of_genes_df['value'].str.split(', ')
+	of_genes_df = of_genes_df.explode('gene')
+
+	bgc_genes_df = of_genes_df[of_genes_df['gene'].isin(relevant_gene_lts)].sort_index(kind='stable')
+	for hgi, g in zip(bgc_genes_df.index.tolist(), bgc_genes_df['gene'].tolist()):
+		gene_to_hg[g] = hgs[hgi]
+		hg_genes[hgs[hgi]].add(g)
+
+	if bgc_genes_df.empty:
+		return ([gene_to_hg, hg_genes, hg_median_gene_counts, hg_multicopy_proportion])
+
+	# critical for calculating homolog group stats, like median gene counts, multicopy proportion
+	# use only genes from the original set of genomes used to conduct full orthofinder analysis.
+	of_genes_df = of_genes_df[of_genes_df.index.isin(set(bgc_genes_df.index))]
+	if all_primary:
+		is_primary = np.ones(len(of_genes_df), dtype=int)
+	else:
+		is_primary = (of_genes_df['gene'].str.split('_', n=1).str[0].str.len() == 3).astype(int).values
+	gene_counts_df = pd.Series(is_primary).groupby([of_genes_df.index.values, of_genes_df['variable'].values]).sum().unstack(fill_value=0)
+	for hgi, gene_counts in zip(gene_counts_df.index.tolist(), gene_counts_df.values.tolist()):
+		hg = hgs[hgi]
+		hg_multicopy_proportion[hg] = float(sum([1 for x in gene_counts if x > 1])) / sum(
+			[1 for x in gene_counts if x > 0])
+		hg_median_gene_counts[hg] = statistics.median(gene_counts)
 
 	return ([gene_to_hg, hg_genes, hg_median_gene_counts, hg_multicopy_proportion])
 
 
+def callCommand(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL):
+	"""
+	Function to run a command, provided as a list of arguments, directly rather than through a bash shell. A trailing
+	'>' or '>>' redirection of stdout to a file is handled here. Commands which need the shell otherwise (e.g. to
+	activate a conda environment) should be provided explicitly as ['bash', '-c', ...].
+	"""
+	cmd = [arg for arg in cmd if arg != '']
+	if len(cmd) > 2 and cmd[-2] in ('>', '>>'):
+		with open(cmd[-1], 'a' if cmd[-2] == '>>' else 'w') as redirect_handle:
+			return subprocess.call(cmd[:-2], stdout=redirect_handle, stderr=stderr)
+	return subprocess.call(cmd, stdout=stdout, stderr=stderr)
+
+
 def run_cmd(cmd, logObject, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL):
 	"""
 	Simple function to run a single command through subprocess with logging.
 	"""
 	logObject.info('Running the following command: %s' % ' '.join(cmd))
 	try:
-		subprocess.call(' '.join(cmd), shell=True, stdout=stdout, stderr=stderr, executable='/bin/bash')
+		callCommand(cmd, stdout=stdout, stderr=stderr)
 		logObject.info('Successfully ran: %s' % ' '.join(cmd))
 	except Exception as e:
 		logObject.error('Had an issue running: %s' % ' '.join(cmd))
@@ -1150,8 +1302,7 @@ def multiProcess(input):
 	logObject = input[-1]
 	logObject.info('Running the following command: %s' % ' '.join(input_cmd))
 	try:
-		subprocess.call(' '.join(input_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		callCommand(input_cmd)
 		logObject.info('Successfully ran: %s' % ' '.join(input_cmd))
 	except Exception as e:
 		logObject.warning('Had an issue running: %s' % ' '.join(input_cmd))
@@ -1535,7 +1686,6 @@ def processBGCGenbanks(bgc_listing_file, bgc_mappings, bgc_prediction_software,
 						rec.description = 'BGC prediction on scaffold %s by %s, starts at: %d' % (
 						scaff_id, bgc_prediction_software, scaff_start)
 						rec.id = scaff_id
-						updated_rec = copy.deepcopy(rec)
 						updated_features = []
 						for feature in rec.features:
 							if feature.type == 'CDS':
@@ -1556,8 +1706,8 @@ def processBGCGenbanks(bgc_listing_file, bgc_mappings, bgc_prediction_software,
 								updated_features.append(feature)
 							else:
 								updated_features.append(feature)
-						updated_rec.features = updated_features
-						SeqIO.write(updated_rec, cp_bgc_genbank_handle, 'genbank')
+						rec.features = updated_features
+						SeqIO.write(rec, cp_bgc_genbank_handle, 'genbank')
 				cp_bgc_genbank_handle.close()
 	except Exception as e:
 		logObject.error("Problem with parsing BGC Genbank listings.")
@@ -1733,8 +1883,7 @@ def runOrthoFinder2Full(bgc_prot_directory, orthofinder_outdir, logObject, cpus=
 		orthofinder_cmd = ['orthofinder', '-f', bgc_prot_directory, '-t', str(cpus)]
 
 		logObject.info('Running the following command: %s' % ' '.join(orthofinder_cmd))
-		subprocess.call(' '.join(orthofinder_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		subprocess.call(orthofinder_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 		logObject.info('Successfully ran OrthoFinder!')
 		tmp_orthofinder_dir = os.path.abspath(
 			[bgc_prot_directory + 'OrthoFinder/' + f for f in os.listdir(bgc_prot_directory + 'OrthoFinder/') if
@@ -1883,8 +2032,7 @@ def runOrthoFinder2(bgc_prot_directory, orthofinder_outdir, logObject, cpus=1):
 	try:
 		orthofinder_cmd = ['orthofinder', '-f', bgc_prot_directory, '-t', str(cpus), '-og']
 		logObject.info('Running the following command: %s' % ' '.join(orthofinder_cmd))
-		subprocess.call(' '.join(orthofinder_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		subprocess.call(orthofinder_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 		logObject.info('Successfully ran OrthoFinder!')
 		tmp_orthofinder_dir = os.path.abspath(
 			[bgc_prot_directory + 'OrthoFinder/' + f for f in os.listdir(bgc_prot_directory + 'OrthoFinder/') if
@@ -1916,8 +2064,7 @@ def runSonicParanoid2(bgc_prot_directory, sonicparanoid_outdir, logObject, cpus=
 							 'sonicparanoid2_for_lsabgc', '-t', str(cpus)]
 
 		logObject.info('Running the following command: %s' % ' '.join(sonicparanoid_cmd))
-		subprocess.call(' '.join(sonicparanoid_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		subprocess.call(sonicparanoid_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 		logObject.info('Successfully ran SonicParanoid!')
 
 		main_orthology_subdir = sonicparanoid_outdir + 'runs/sonicparanoid2_for_lsabgc/ortholog_groups/'
@@ -1994,11 +2141,10 @@ def runPanaroo(genbanks_directory, panaroo_input_dir, results_directory, logObje
 		p.map(multiProcess, reformat_cmds)
 		p.close()
 
-		panaroo_cmd = ['panaroo', '-t', str(cpus), panaroo_options, '-i', ' '.join(panaroo_inputs), '-o', results_directory]
+		panaroo_cmd = ['panaroo', '-t', str(cpus)] + shlex.split(panaroo_options) + ['-i'] + panaroo_inputs + ['-o', results_directory]
 
 		logObject.info('Running the following command: %s' % ' '.join(panaroo_cmd))
-		subprocess.call(' '.join(panaroo_cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		subprocess.call(panaroo_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 		logObject.info('Successfully ran Panaroo!')
 
 		main_ortho_file = results_directory + 'gene_presence_absence.csv'
@@ -2215,12 +2361,11 @@ def incorporateBGCProteinsIntoProteomesAndGenbanks(sample_bgc_proteins, sample_g
 
 					for blt in bgc_prots_1x:
 						blt_scaff, blt_start, blt_end = bgc_prot_to_location[blt]
-						blt_range = set(range(blt_start + scaff_start, blt_end + scaff_start + 1))
 						for glt in scaff_glts[blt_scaff]:
 							glt_scaff, glt_start, glt_end = gw_prot_to_location[glt]
-							glt_range = set(range(glt_start, glt_end + 1))
-							if glt_scaff == blt_scaff and float(len(blt_range.intersection(glt_range))) / float(
-									len(glt_range)) >= 0.25:
+							overlap_length = max(min(blt_end + scaff_start, glt_end) - max(blt_start + scaff_start, glt_start) + 1, 0)
+							if glt_scaff == blt_scaff and float(overlap_length) / float(
+									max(glt_end - glt_start + 1, 0)) >= 0.25:
 								if not glt in bgc_prots:
 									sample_lts_to_prune.add(glt)
 
@@ -2407,13 +2552,12 @@ def identifyParalogsAndCreateResultFiles(samp_hg_lts, lt_to_hg, sample_bgc_prote
 					gw_hg_lts = hg_subjects[hg].difference(hg_queries[hg])
 					for glt in gw_hg_lts:
 						glt_scaff, glt_start, glt_end = gw_prot_to_location[glt]
-						glt_range = set(range(glt_start, glt_end + 1))
 						for blt in bgc_hg_lts:
 							if blt.split('_')[1][0] == '0': continue
 							blt_scaff, blt_start, blt_end = bgc_prot_to_location[blt]
-							blt_range = set(range(blt_start, blt_end + 1))
-							if glt_scaff == blt_scaff and float(len(blt_range.intersection(glt_range))) / float(
-									len(glt_range)) >= 0.25:
+							overlap_length = max(min(blt_end, glt_end) - max(blt_start, glt_start) + 1, 0)
+							if glt_scaff == blt_scaff and float(overlap_length) / float(
+									max(glt_end - glt_start + 1, 0)) >= 0.25:
 								sample_lts_to_prune.add(glt)
 
 			final_gw_sample_faa = final_proteomes_directory + sample + '.faa'
@@ -2698,11 +2842,36 @@ def p_adjust_bh(p):
 	return q[by_orig]
 
 
+def sniffFirstLine(input_file):
+	"""
+	Function to get the first non-blank line of a (possibly gzipped) file, stripped of surrounding whitespace.
+	"""
+	ohandle = None
+	if input_file.endswith('.gz'):
+		ohandle = gzip.open(input_file, 'rt')
+	else:
+		ohandle = open(input_file)
+	first_line = None
+	for line in ohandle:
+		line = line.strip()
+		if line:
+			first_line = line
+			break
+	ohandle.close()
+	return first_line
+
+
 def is_newick(newick):
 	"""
 	Function to validate if Newick phylogeny file is correctly formatted.
 	"""
 	try:
+		# quickly rule out files which are clearly not Newick before parsing with ete3
+		if os.path.isfile(newick):
+			with open(newick) as onf:
+				newick_string = onf.read().strip()
+			if not (newick_string.startswith('(') and newick_string.endswith(';')):
+				return False
 		t = Tree(newick)
 		return True
 	except:
@@ -2711,45 +2880,34 @@ def is_newick(newick):
 
 def is_fastq(fastq):
 	"""
-	Function to validate if FASTA file is correctly formatted.
+	Function to validate if FASTQ file is correctly formatted, based on its first record header.
 	"""
 	try:
-		with open(fastq) as of:
-			SeqIO.parse(of, 'fastq')
-		return True
+		first_line = sniffFirstLine(fastq)
+		return first_line != None and first_line.startswith('@')
 	except:
 		return False
 
 
 def is_fasta(fasta):
 	"""
-	Function to validate if FASTA file is correctly formatted.
+	Function to validate if FASTA file is correctly formatted, based on its first record header.
 	"""
 	try:
-		if fasta.endswith('.gz'):
-			with gzip.open(fasta, 'rt') as ogf:
-				SeqIO.parse(ogf, 'fasta')
-		else:
-			with open(fasta) as of:
-				SeqIO.parse(of, 'fasta')
-		return True
+		first_line = sniffFirstLine(fasta)
+		return first_line != None and first_line.startswith('>')
 	except:
 		return False
 
 
 def is_genbank(gbk):
 	"""
-	Function to check in Genbank file is correctly formatted.
+	Function to check in Genbank file is correctly formatted, based on its suffix and first LOCUS line.
 	"""
 	try:
 		assert (gbk.endswith('.gbk') or gbk.endswith('.gbff') or gbk.endswith('.gbk.gz') or gbk.endswith('.gbff.gz'))
-		if gbk.endswith('.gz'):
-			with gzip.open(gbk, 'rt') as ogf:
-				SeqIO.parse(ogf, 'genbank')
-		else:
-			with open(gbk) as of:
-				SeqIO.parse(of, 'genbank')
-		return True
+		first_line = sniffFirstLine(gbk)
+		return first_line != None and first_line.startswith('LOCUS')
 	except:
 		return False
 
@@ -2825,30 +2983,28 @@ def calculateTajimasD(sequences):
 	"""Calculate pi"""
 	numseqs = len(sequences)
 	divisor = math.comb(numseqs, 2)
-	combos = itertools.combinations(sequences, 2)
-	differences = 0
-	for pair in combos:
-		seqA = pair[0]
-		seqB = pair[1]
-		for p, a in enumerate(seqA):
-			b = seqB[p]
-			if a != b and a != '-' and b != '-':
-				differences += 1
+
+	# rather than comparing all pairs of sequences, the number of pairwise differences at each alignment position is
+	# determined from the counts of each (non-gap) character in the alignment column: all pairs of non-gap characters
+	# minus the pairs sharing the same character.
+	aln_len = min(len(seq) for seq in sequences)
+	seq_matrix = np.frombuffer(''.join([seq[:aln_len] for seq in sequences]).encode('ascii'),
+							   dtype=np.uint8).reshape(numseqs, aln_len)
+	nongap_counts = np.zeros(aln_len, dtype=np.int64)
+	same_pairs = np.zeros(aln_len, dtype=np.int64)
+	for char in np.unique(seq_matrix):
+		if char == ord('-'): continue
+		char_counts = np.count_nonzero(seq_matrix == char, axis=0).astype(np.int64)
+		nongap_counts += char_counts
+		same_pairs += (char_counts * (char_counts - 1)) // 2
+	position_differences = (nongap_counts * (nongap_counts - 1)) // 2 - same_pairs
+
+	differences = int(position_differences.sum())
 	pi = float(differences) / divisor
 
 	"""Calculate s, number of segregation sites)."""
 	# Assume if we're in here seqs have already been checked
-	combos = itertools.combinations(sequences, 2)
-	indexes = set([])
-	for pair in combos:
-		seqA = pair[0]
-		seqB = pair[1]
-		for idx, (i, j) in enumerate(zip(seqA, seqB)):
-			if i != j and i != '-' and j != '-':
-				indexes.add(idx)
-
-	indexes = list(indexes)
-	S = len(indexes)
+	S = int(np.count_nonzero(position_differences))
 
 	"""
 	Now we have pi (pairwise differences) and s (number
@@ -69,19 +69,19 @@ def main():
     try:
         sample_prokka_data = processing.readInAnnotationFilesForExpandedSampleSet(annotation_listing_file)
 
-        with multiprocessing.Manager() as manager:
-            sample_gbk_info = manager.dict()
-            genbanks = []
-            for sample in sample_prokka_data:
-                sample_genbank = sample_prokka_data[sample]['genbank']
-                genbanks.append([sample, sample_genbank, sample_gbk_info])
-
-            with manager.Pool(cpus) as pool:
-                pool.map(util.parseGenbankAndFindBoundaryGenes, genbanks)
-
-            of = open(output_file, 'wb')
-            cPickle.dump(dict(sample_gbk_info), of)
-            of.close()
+        genbanks = []
+        for sample in sample_prokka_data:
+            sample_genbank = sample_prokka_data[sample]['genbank']
+            genbanks.append([sample, sample_genbank])
+
+        sample_gbk_info = {}
+        with multiprocessing.Pool(cpus) as pool:
+            for sample, gbk_info in pool.imap_unordered(util.parseGenbankAndFindBoundaryGenes, genbanks, chunksize=max(1, len(genbanks) // (cpus * 4))):
+                sample_gbk_info[sample] = gbk_info
+
+        of = open(output_file, 'wb')
+        cPickle.dump(sample_gbk_info, of)
+        of.close()
     except Exception as e:
         sys.stderr.write(traceback.format_exc())
         raise RuntimeError('Had an issue pickling annotation data!')
@@ -236,7 +236,7 @@ def lsaBGC_AutoExpansion():
 			if pickle_expansion_annotation_data_file:
 				cmd += ['-z', pickle_expansion_annotation_data_file]
 			if protocore_hgs != None:
-				cmd += ['-ph', '"' + protocore_hgs[gcf_id] + '"']
+				cmd += ['-ph'] + protocore_hgs[gcf_id].split()
 			if no_orthogroup_matrix:
 				cmd += ['-no']
 			if loose_mode:
@@ -337,7 +337,7 @@ def lsaBGC_AutoExpansion():
 
 	# create updated general listings file
 	updated_listings_file = outdir + 'Sample_Annotation_Files.txt'
-	updated_listings_handle = open(updated_listings_file, 'w')
+	updated_listings_lines = []
 	all_samples = set([])
 	primary_initial_samples = set([])
 	with open(initial_listing_file) as oilf:
@@ -345,13 +345,17 @@ def lsaBGC_AutoExpansion():
 			cleaned_sample_name = util.cleanUpSampleName(line.strip().split('\t')[0])
 			all_samples.add(cleaned_sample_name)
 			primary_initial_samples.add(cleaned_sample_name)
-			updated_listings_handle.write(line)
+			updated_listings_lines.append(line)
 
 	with open(expansion_listing_file) as oelf:
 		for line in oelf:
-			if not util.cleanUpSampleName(line.strip().split('\t')[0]) in all_samples:
-				all_samples.add(util.cleanUpSampleName(line.strip().split('\t')[0]))
-				updated_listings_handle.write(line)
+			cleaned_sample_name = util.cleanUpSampleName(line.strip().split('\t')[0])
+			if not cleaned_sample_name in all_samples:
+				all_samples.add(cleaned_sample_name)
+				updated_listings_lines.append(line)
+
+	updated_listings_handle = open(updated_listings_file, 'w')
+	updated_listings_handle.write(''.join(updated_listings_lines))
 	updated_listings_handle.close()
 
 	# further filter out entire GCF presence in samples if needed
@@ -371,7 +375,7 @@ def lsaBGC_AutoExpansion():
 	for gcf in gcf_expansion_results:
 		expanded_gcf_listing_file = gcf_expansion_results[gcf]
 		final_expanded_gcf_listing_file = updated_gcf_listing_dir + gcf + '.txt'
-		final_expanded_gcf_listing_handle = open(final_expanded_gcf_listing_file, 'w')
+		final_expanded_gcf_listing_lines = []
 		with open(expanded_gcf_listing_file) as oeglf:
 			for line in oeglf:
 				line = line.strip()
@@ -380,7 +384,7 @@ def lsaBGC_AutoExpansion():
 					logObject.info("GCF %s presence in sample %s disregarded, because BGC instance with functionally core homolog group was removed due to overlap with BGC from another GCF." % (gcf, sample))
 					continue
 				if (bgc_gbk_path in bgcs_to_discard) and (not bgc_gbk_path in original_gcfs): continue
-				final_expanded_gcf_listing_handle.write(line + '\n')
+				final_expanded_gcf_listing_lines.append(line + '\n')
 				if sample in primary_initial_samples: continue
 				if bgc_gbk_path in original_gcfs: continue
 				expansion_flag = False
@@ -394,6 +398,8 @@ def lsaBGC_AutoExpansion():
 					if lt in bgc_lt_to_hg[bgc_gbk_path]:
 						hg = bgc_lt_to_hg[bgc_gbk_path][lt]
 						sample_hg_lts[sample][hg].add(lt)
+		final_expanded_gcf_listing_handle = open(final_expanded_gcf_listing_file, 'w')
+		final_expanded_gcf_listing_handle.write(''.join(final_expanded_gcf_listing_lines))
 		final_expanded_gcf_listing_handle.close()
 
 	original_samples = []
@@ -409,18 +415,24 @@ def lsaBGC_AutoExpansion():
 				hg = ls[0]
 				all_hgs.add(hg)
 				for j, prot in enumerate(ls[1:]):
-					sample_hg_lts[original_samples[j]][hg] = sample_hg_lts[original_samples[j]][hg].union(set(prot.split(', ')))
+					if not prot: continue
+					if ', ' in prot:
+						sample_hg_lts[original_samples[j]][hg].update(prot.split(', '))
+					else:
+						sample_hg_lts[original_samples[j]][hg].add(prot)
 
 	expanded_orthofinder_matrix_file = outdir + 'Orthogroups.expanded.tsv'
 	expanded_orthofinder_matrix_handle = open(expanded_orthofinder_matrix_file, 'w')
 
-	header = [''] + [s for s in sorted(all_samples)]
-	expanded_orthofinder_matrix_handle.write('\t'.join(header) + '\n')
+	sorted_samples = sorted(all_samples)
+	header = [''] + sorted_samples
+	matrix_lines = ['\t'.join(header)]
 	for hg in sorted(all_hgs):
 		printlist = [hg]
-		for s in sorted(all_samples):
+		for s in sorted_samples:
 			printlist.append(', '.join([x.strip() for x in sample_hg_lts[s][hg] if x.strip() != '']))
-		expanded_orthofinder_matrix_handle.write('\t'.join(printlist) + '\n')
+		matrix_lines.append('\t'.join(printlist))
+	expanded_orthofinder_matrix_handle.write('\n'.join(matrix_lines) + '\n')
 	expanded_orthofinder_matrix_handle.close()
 
 	# Close logging object and exit
@@ -38,8 +38,8 @@
 import os
 import sys
 import argparse
-import subprocess
 import traceback
+import shlex
 import multiprocessing
 import math
 import itertools
@@ -470,9 +470,9 @@ def lsaBGC_Euk_Easy():
 				antismash_cmd = ['antismash', '--output-dir', primary_bgc_pred_directory + s + '/',
 						 antismash_options, '--output-basename', s, all_genome_listings_gbk[s]]
 				if docker_mode:
-					antismash_cmd = ['. /opt/conda/etc/profile.d/conda.sh && conda activate /usr/src/antismash_conda_env/ &&',
-							 'antismash', '--output-dir', primary_bgc_pred_directory + s + '/',
-							 antismash_options, '--output-basename', s, all_genome_listings_gbk[s], logObject]
+					# activating the antiSMASH conda environment requires bash, so the command is explicitly run through it
+					antismash_cmd = ['bash', '-c', '. /opt/conda/etc/profile.d/conda.sh && conda activate /usr/src/antismash_conda_env/ && antismash --output-dir %s %s --output-basename %s %s' % (shlex.quote(primary_bgc_pred_directory + s + '/'), antismash_options, shlex.quote(s), shlex.quote(all_genome_listings_gbk[s])),
+									 logObject]
 				primary_bgc_pred_cmds.append(antismash_cmd)
 		primary_genomes_listing_handle.close()
 
@@ -647,8 +647,7 @@ def lsaBGC_Euk_Easy():
 def runCmdViaSubprocess(cmd, logObject, check_files=[], check_directories=[]):
 	logObject.info('Running %s' % ' '.join(cmd))
 	try:
-		subprocess.call(' '.join(cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-						executable='/bin/bash')
+		util.callCommand(cmd)
 		for cf in check_files:
 			assert (os.path.isfile(cf))
 		for cd in check_directories:
@@ -674,17 +673,10 @@ def genbankToFasta(gbk_file, fasta_file):
 def checkUlimitSettings(num_genomes, logObject):
 	# Check ulimit settings!
 	num_files = num_genomes * num_genomes
-	uH = subprocess.check_output('ulimit -Hn', shell=True)
-	uS = subprocess.check_output('ulimit -Sn', shell=True)
-	uH = uH.decode('utf-8').strip()
-	uS = uS.decode('utf-8').strip()
-	if uH != 'unlimited':
-		uH = int(uH)
-	else:
+	uS, uH = resource.getrlimit(resource.RLIMIT_NOFILE)
+	if uH == resource.RLIM_INFINITY:
 		uH = 1e15
-	if uS != 'unlimited':
-		uS = int(uS)
-	else:
+	if uS == resource.RLIM_INFINITY:
 		uS = 1e15
 	if num_files > uS:
 		logObject.warning(